@@ -64,6 +64,10 @@ DMOJ_STATS_LANGUAGE_THRESHOLD = 10
 DMOJ_SUBMISSIONS_REJUDGE_LIMIT = 10
 # Maximum number of submissions a single user can queue without the `spam_submission` permission
 DMOJ_SUBMISSION_LIMIT = 2
+# Full contest scoreboards are cached, and rebuilt at most once every DMOJ_CONTEST_RANKING_DEBOUNCE seconds after
+# results change. Unchanged scoreboards are kept for DMOJ_CONTEST_RANKING_CACHE_TTL seconds. None disables the cache.
+DMOJ_CONTEST_RANKING_DEBOUNCE = 5
+DMOJ_CONTEST_RANKING_CACHE_TTL = 3600
 DMOJ_BLOG_NEW_PROBLEM_COUNT = 7
 DMOJ_BLOG_RECENTLY_ATTEMPTED_PROBLEMS_COUNT = 7
 DMOJ_TOTP_TOLERANCE_HALF_MINUTES = 1
@@ -400,6 +404,55 @@ BRIDGED_JUDGE_ADDRESS = [('localhost', 9999)]
 BRIDGED_JUDGE_PROXIES = None
 BRIDGED_DJANGO_ADDRESS = [('localhost', 9998)]
 BRIDGED_DJANGO_CONNECT = None
+# Number of persistent, pipelined connections each Django process keeps to the bridge.
+# 0 opens a new connection for every request.
+BRIDGED_DJANGO_POOL_SIZE = 0
+# To spread judges over several bridges, list the address every bridge accepts the site on, and start each one with
+# runbridged --shard <index> and its own addresses. Submissions are routed by a consistent hash of the problem code,
+# so every bridge needs judges for the problems that hash to it. None uses BRIDGED_DJANGO_CONNECT alone.
+BRIDGED_DJANGO_SHARDS = None
+# Serve all bridge connections from an asyncio event loop instead of a thread per connection.
+# Packet handling then runs on a pool of BRIDGED_ASYNCIO_WORKERS threads.
+BRIDGED_ASYNCIO = False
+BRIDGED_ASYNCIO_WORKERS = 16
+# Without BRIDGED_ASYNCIO, the work timers hand off to keep the scheduler thread free, like pinging judges, runs on a
+# pool of BRIDGED_BACKGROUND_WORKERS threads. With it, it runs on the BRIDGED_ASYNCIO_WORKERS pool.
+BRIDGED_BACKGROUND_WORKERS = 4
+# Order of the submissions waiting within a priority tier: 'fifo', 'fair' to share the judges evenly between
+# contests, and between users outside of contests, so that one busy user or contest cannot hold everyone else up,
+# or 'sjf' to grade the submissions expected to be quickest first. Grading times are estimated per problem and
+# language from recent submissions. With 'sjf', a submission is never overtaken by ones queued more than
+# BRIDGED_QUEUE_SJF_AGING times its estimated grading time after it.
+BRIDGED_QUEUE_POLICY = 'fifo'
+BRIDGED_QUEUE_SJF_AGING = 10
+# Submissions expected to take this many times longer to grade than usual are sent to the free judge that has been
+# fastest, rather than the least loaded one. None disables this.
+BRIDGED_HEAVY_SUBMISSION_FACTOR = 4
+# Test case results are written in bulk once this many are pending, or at least every interval (in seconds).
+BRIDGED_TEST_CASE_FLUSH_SIZE = 500
+BRIDGED_TEST_CASE_FLUSH_INTERVAL = 0.5
+# Live updates of a submission are merged, and only the latest one is posted to the event daemon every interval (in
+# seconds). The end of grading is always posted right away.
+BRIDGED_EVENT_FLUSH_INTERVAL = 0.5
+# Run the built-in event hub (see EVENT_DAEMON_HUB_SOCKET) in the bridge process.
+BRIDGED_EVENT_HUB = False
+# Codecs, in order of preference, offered to judges that negotiate one in their handshake. Others use zlib.
+# zstd and lz4 need the zstandard and lz4 packages. Packets shorter than the threshold (in bytes) are sent
+# uncompressed once a codec is negotiated.
+BRIDGED_CODECS = ['zstd', 'lz4', 'zlib']
+BRIDGED_CODEC_THRESHOLD = 256
+BRIDGED_ZLIB_LEVEL = 6
+BRIDGED_ZSTD_LEVEL = 3
+# Path to a dictionary shared with the judges for zstd and lz4, made with the makebridgedictionary command.
+BRIDGED_CODEC_DICTIONARY = None
+# If set, the bridge journals its queue to this file, and on startup requeues the submissions a previous run left
+# queued or grading instead of marking them as internal errors. The journal is rewritten once it holds more than
+# BRIDGED_JOURNAL_COMPACT_SIZE records. Set BRIDGED_JOURNAL_FSYNC to also survive power loss, at a cost per write.
+BRIDGED_JOURNAL_PATH = None
+BRIDGED_JOURNAL_COMPACT_SIZE = 10000
+BRIDGED_JOURNAL_FSYNC = False
+# Address to serve Prometheus metrics at /metrics on, e.g. ('localhost', 9997). None disables it.
+BRIDGED_METRICS_ADDRESS = None
 
 # Event Server configuration
 EVENT_DAEMON_USE = False
@@ -408,6 +461,21 @@ EVENT_DAEMON_GET = 'ws://localhost:9996/'
 EVENT_DAEMON_POLL = '/channels/'
 EVENT_DAEMON_KEY = None
 EVENT_DAEMON_AMQP_EXCHANGE = 'dmoj-events'
+# Post events from a background thread instead of waiting for the event daemon, sending up to
+# EVENT_DAEMON_BATCH_SIZE at a time. Events are dropped if more than EVENT_DAEMON_QUEUE_SIZE are waiting, e.g.
+# while the daemon is down. Event ids are then not known, and post() returns 0.
+EVENT_DAEMON_ASYNC = False
+EVENT_DAEMON_QUEUE_SIZE = 10000
+EVENT_DAEMON_BATCH_SIZE = 100
+# To use the built-in event hub instead of websocket/daemon.js, set the path of the Unix socket it takes posts on,
+# and point EVENT_DAEMON_GET and EVENT_DAEMON_POLL at EVENT_DAEMON_HUB_ADDRESS, where it serves websockets and long
+# polls. Run it with the runeventhub command, or inside the bridge with BRIDGED_EVENT_HUB. It keeps the last
+# EVENT_DAEMON_HUB_MAX_QUEUE messages for clients catching up, and long polls time out after
+# EVENT_DAEMON_HUB_POLL_TIMEOUT seconds.
+EVENT_DAEMON_HUB_SOCKET = None
+EVENT_DAEMON_HUB_ADDRESS = ('localhost', 9996)
+EVENT_DAEMON_HUB_MAX_QUEUE = 50
+EVENT_DAEMON_HUB_POLL_TIMEOUT = 60
 EVENT_DAEMON_SUBMISSION_KEY = '6Sdmkx^%pk@GsifDfXcwX*Y7LRF%RGT8vmFpSxFBT$fwS7trc8raWfN#CSfQuKApx&$B#Gh2L7p%W!Ww'
 
 # Internationalization
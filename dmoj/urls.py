@@ -135,6 +135,7 @@ urlpatterns = [
         url(r'^/clone$', contests.ContestClone.as_view(), name='contest_clone'),
         url(r'^/ranking/$', contests.ContestRanking.as_view(), name='contest_ranking'),
         url(r'^/ranking/ajax$', contests.contest_ranking_ajax, name='contest_ranking_ajax'),
+        url(r'^/ranking/snapshot$', contests.contest_ranking_snapshot_ajax, name='contest_ranking_snapshot'),
         url(r'^/join$', contests.ContestJoin.as_view(), name='contest_join'),
         url(r'^/leave$', contests.ContestLeave.as_view(), name='contest_leave'),
         url(r'^/stats$', contests.ContestStats.as_view(), name='contest_stats'),
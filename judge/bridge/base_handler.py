@@ -6,6 +6,7 @@ from itertools import chain
 
 from netaddr import IPGlob, IPSet
 
+from judge.bridge.packet_codecs import CodecError
 from judge.utils.unicode import utf8text
 
 logger = logging.getLogger('judge.bridge')
@@ -14,6 +15,9 @@ size_pack = struct.Struct('!I')
 assert size_pack.size == 4
 
 MAX_ALLOWED_PACKET_SIZE = 8 * 1024 * 1024
+# Size of the buffer each connection receives into. Packets larger than this are decompressed piece by piece as they
+# arrive, so the compressed packet is never held in memory as a whole.
+RECV_BUFFER_SIZE = 64 * 1024
 
 
 def proxy_list(human_readable):
@@ -36,9 +40,15 @@ class Disconnect(Exception):
 # use setup(), most tools will complain about uninitialized variables.
 # This metaclass will allow sane __init__ behaviour while also magically
 # calling the methods that handles the request.
+#
+# Event-driven servers (see judge.bridge.server.AsyncServer) feed data to the
+# handler themselves, so for those we only construct the handler.
 class RequestHandlerMeta(type):
     def __call__(cls, *args, **kwargs):
         handler = super().__call__(*args, **kwargs)
+        if getattr(handler.server, 'event_driven', False):
+            return handler
+
         handler.on_connect()
         try:
             handler.handle()
@@ -51,6 +61,7 @@ class RequestHandlerMeta(type):
 
 class ZlibPacketHandler(metaclass=RequestHandlerMeta):
     proxies = []
+    zlib_level = zlib.Z_DEFAULT_COMPRESSION
 
     def __init__(self, request, client_address, server):
         self.request = request
@@ -59,6 +70,11 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
         self.server_address = server.server_address
         self._initial_tag = None
         self._got_packet = False
+        self._reading_proxy = False
+        self._recv_view = memoryview(bytearray(RECV_BUFFER_SIZE))
+        # Set once a codec is negotiated with the peer (see judge.bridge.packet_codecs). Until then, every packet is
+        # a plain zlib stream.
+        self.codec = None
 
     @property
     def timeout(self):
@@ -68,25 +84,51 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
     def timeout(self, timeout):
         self.request.settimeout(timeout or None)
 
-    def read_sized_packet(self, size, initial=None):
+    def _check_packet_size(self, size):
         if size > MAX_ALLOWED_PACKET_SIZE:
             logger.log(logging.WARNING if self._got_packet else logging.INFO,
                        'Disconnecting client due to too-large message size (%d bytes): %s', size, self.client_address)
             raise Disconnect()
 
-        buffer = []
+    def read_sized_packet(self, size, initial=None):
+        self._check_packet_size(size)
+        if self.codec is not None:
+            return self._read_encoded_packet(size, initial)
+
+        decompressor = zlib.decompressobj()
+        chunks = []
         remainder = size
 
         if initial:
-            buffer.append(initial)
+            chunks.append(decompressor.decompress(initial))
             remainder -= len(initial)
             assert remainder >= 0
 
+        view = self._recv_view
         while remainder:
-            data = self.request.recv(remainder)
-            remainder -= len(data)
-            buffer.append(data)
-        self._on_packet(b''.join(buffer))
+            received = self.request.recv_into(view, min(remainder, len(view)))
+            if not received:
+                raise Disconnect()
+            remainder -= received
+            chunks.append(decompressor.decompress(view[:received]))
+
+        if not decompressor.eof:
+            raise zlib.error('Error -5 while decompressing data: incomplete or truncated stream')
+        self._on_payload(chunks[0] if len(chunks) == 1 else b''.join(chunks))
+
+    def _read_encoded_packet(self, size, initial=None):
+        view = self._recv_view if size <= len(self._recv_view) else memoryview(bytearray(size))
+        length = 0
+        if initial:
+            length = len(initial)
+            view[:length] = initial
+
+        while length < size:
+            received = self.request.recv_into(view[length:size])
+            if not received:
+                raise Disconnect()
+            length += received
+        self._on_packet(view[:size])
 
     def parse_proxy_protocol(self, line):
         words = line.split()
@@ -106,12 +148,15 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
             raise Disconnect()
 
     def read_size(self, buffer=b''):
-        while len(buffer) < size_pack.size:
-            recv = self.request.recv(size_pack.size - len(buffer))
-            if not recv:
+        view = self._recv_view
+        length = len(buffer)
+        view[:length] = buffer
+        while length < size_pack.size:
+            received = self.request.recv_into(view[length:size_pack.size])
+            if not received:
                 raise Disconnect()
-            buffer += recv
-        return size_pack.unpack(buffer)[0]
+            length += received
+        return size_pack.unpack_from(view)[0]
 
     def read_proxy_header(self, buffer=b''):
         # Max line length for PROXY protocol is 107, and we received 4 already.
@@ -124,12 +169,48 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
             buffer += data
         return buffer
 
+    def extract_packets(self, buffer):
+        # Non-blocking counterpart of handle(): consumes complete packets from the front of buffer (a bytearray
+        # that event-driven servers append received data to) and yields their compressed payloads.
+        while True:
+            if self._initial_tag is None:
+                if len(buffer) < size_pack.size:
+                    return
+                self._initial_tag = bytes(buffer[:size_pack.size])
+                self._reading_proxy = self.client_address[0] in self.proxies and self._initial_tag == b'PROX'
+
+            if self._reading_proxy:
+                index = buffer.find(b'\r\n')
+                if index < 0:
+                    # Max line length for PROXY protocol is 107.
+                    if len(buffer) > 107:
+                        raise Disconnect()
+                    return
+                self.parse_proxy_protocol(bytes(buffer[:index]))
+                del buffer[:index + 2]
+                self._reading_proxy = False
+                continue
+
+            if len(buffer) < size_pack.size:
+                return
+            size = size_pack.unpack_from(buffer)[0]
+            self._check_packet_size(size)
+            end = size_pack.size + size
+            if len(buffer) < end:
+                return
+            packet = bytes(buffer[size_pack.size:end])
+            del buffer[:end]
+            yield packet
+
     def _on_packet(self, data):
-        decompressed = zlib.decompress(data).decode('utf-8')
+        self._on_payload(zlib.decompress(data) if self.codec is None else self.codec.decode(data))
+
+    def _on_payload(self, payload):
         self._got_packet = True
-        self.on_packet(decompressed)
+        self.on_packet(payload)
 
     def on_packet(self, data):
+        # data is the decompressed packet as bytes, which json.loads accepts directly.
         raise NotImplementedError()
 
     def on_connect(self):
@@ -169,7 +250,7 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
                 self.read_sized_packet(self.read_size())
         except Disconnect:
             return
-        except zlib.error:
+        except (zlib.error, CodecError):
             if self._got_packet:
                 logger.warning('Encountered zlib error during packet handling, disconnecting client: %s',
                                self.client_address, exc_info=True)
@@ -189,8 +270,29 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
             raise
 
     def send(self, data):
-        compressed = zlib.compress(data.encode('utf-8'))
-        self.request.sendall(size_pack.pack(len(compressed)) + compressed)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.codec is None:
+            compressed = zlib.compress(data, self.zlib_level)
+            self._send_buffers([size_pack.pack(len(compressed)), compressed])
+        else:
+            tag, body = self.codec.encode(data)
+            self._send_buffers([size_pack.pack(len(tag) + len(body)), tag, body])
+
+    def _send_buffers(self, buffers):
+        sendmsg = getattr(self.request, 'sendmsg', None)
+        if sendmsg is None:
+            self.request.sendall(b''.join(buffers))
+            return
+
+        # Gather the header and the payload in a single system call instead of concatenating them first.
+        sent = sendmsg(buffers)
+        for buffer in buffers:
+            if sent >= len(buffer):
+                sent -= len(buffer)
+                continue
+            self.request.sendall(memoryview(buffer)[sent:])
+            sent = 0
 
     def close(self):
         self.request.shutdown(socket.SHUT_RDWR)
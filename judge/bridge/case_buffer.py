@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from django import db
+from django.db.models import Case, IntegerField, Value, When
+
+from judge.models import Submission, SubmissionTestCase
+from judge.utils.metrics import Gauge, Histogram
+
+logger = logging.getLogger('judge.bridge')
+
+buffer_depth = Gauge('bridge_test_case_buffer_depth', 'Test case results waiting to be written to the database.')
+flush_time = Histogram('bridge_test_case_flush_seconds', 'Time taken to write out buffered test case results.')
+
+
+class CaseWriteBuffer(object):
+    """Write-behind stage for test case results reported by judges.
+
+    Rows for SubmissionTestCase and current_testcase updates are collected across packets and submissions, and
+    written out in one bulk insert and one UPDATE once enough cases are pending or the flush interval passes.
+    Handlers must call flush() with the submission ID before finalizing a submission, which returns only after all
+    of its buffered rows, including any already being written by the background flush, are in the database.
+    """
+
+    def __init__(self, flush_size=500, flush_interval=0.5):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # Held while taking rows out of the buffer and writing them, so a flush never overtakes an earlier one.
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        self._cases = {}
+        self._current_testcase = {}
+        self._depth = 0
+
+        self.flush_count = 0
+        self.flushed_cases = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+        buffer_depth.set_function(lambda: self._depth)
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def add(self, submission_id, cases, current_testcase):
+        with self._lock:
+            self._cases.setdefault(submission_id, []).extend(cases)
+            self._current_testcase[submission_id] = max(self._current_testcase.get(submission_id, 0),
+                                                        current_testcase)
+            self._depth += len(cases)
+            if self._depth >= self.flush_size:
+                self._wakeup.set()
+
+    def discard(self, submission_id):
+        with self._flush_lock, self._lock:
+            self._depth -= len(self._cases.pop(submission_id, ()))
+            self._current_testcase.pop(submission_id, None)
+
+    def _take(self, submission_id):
+        with self._lock:
+            if submission_id is None:
+                cases, self._cases = self._cases, {}
+                current, self._current_testcase = self._current_testcase, {}
+            else:
+                cases = {submission_id: self._cases.pop(submission_id)} if submission_id in self._cases else {}
+                current = ({submission_id: self._current_testcase.pop(submission_id)}
+                           if submission_id in self._current_testcase else {})
+            self._depth -= sum(map(len, cases.values()))
+        return cases, current
+
+    def _write(self, cases, current):
+        if current:
+            Submission.objects.filter(id__in=list(current)).update(current_testcase=Case(
+                *[When(id=id, then=Value(position)) for id, position in current.items()],
+                output_field=IntegerField(),
+            ))
+        SubmissionTestCase.objects.bulk_create([case for rows in cases.values() for case in rows])
+
+    def flush(self, submission_id=None):
+        with self._flush_lock:
+            cases, current = self._take(submission_id)
+            if not cases and not current:
+                return
+
+            start = time.monotonic()
+            try:
+                self._write(cases, current)
+            except Exception:
+                # One bad submission (e.g. deleted while grading) must not take down the rows of the others.
+                logger.warning('Failed to flush %d test case(s) in bulk, retrying one submission at a time',
+                               sum(map(len, cases.values())), exc_info=True)
+                db.connection.close()
+                for id in set(cases) | set(current):
+                    try:
+                        self._write({id: cases.get(id, [])}, {id: current[id]} if id in current else {})
+                    except Exception:
+                        logger.exception('Failed to store test cases for submission: %s', id)
+                        db.connection.close()
+
+            latency = time.monotonic() - start
+            self.flush_count += 1
+            self.flushed_cases += sum(map(len, cases.values()))
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            flush_time.observe(latency)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error flushing test cases')
+        self.flush()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
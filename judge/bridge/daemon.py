@@ -1,15 +1,27 @@
 import logging
 import signal
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
+from judge.bridge.case_buffer import CaseWriteBuffer
 from judge.bridge.django_handler import DjangoHandler
+from judge.bridge.event_coalescer import EventCoalescer
+from judge.bridge.grading_cost import GradingCostModel
+from judge.bridge.journal import QueueJournal
 from judge.bridge.judge_handler import JudgeHandler
 from judge.bridge.judge_list import JudgeList
-from judge.bridge.server import Server
-from judge.models import Judge, Submission
+from judge.bridge.queue_policy import make_policy
+from judge.bridge.scheduler import Scheduler
+from judge.bridge.server import AsyncServer, Server
+from judge.bridge.submission_data import get_submissions_data
+from judge.event_hub import EventHubServer
+from judge.judgeapi import bridge_shard
+from judge.models import Judge, Problem, Submission
+from judge.utils.metrics import MetricsRequestHandler, MetricsServer
 
 logger = logging.getLogger('judge.bridge')
 
@@ -18,17 +30,105 @@ def reset_judges():
     Judge.objects.update(online=False, ping=None, load=None)
 
 
-def judge_daemon():
-    reset_judges()
-    Submission.objects.filter(status__in=Submission.IN_PROGRESS_GRADING_STATUS) \
-        .update(status='IE', result='IE', error=None)
-    judges = JudgeList()
+def restore_queue(judges, journal, entries):
+    # Submissions the previous run was still responsible for are queued again, in priority order and otherwise in
+    # the order they were first received. A submission the judges were disconnected from on shutdown was marked IE
+    # then, while anything that finished before the journal caught up is left alone.
+    entries = sorted(entries, key=lambda entry: entry['priority'])
+    submissions = {id: (problem, language, source) for id, problem, language, source in
+                   Submission.objects.filter(id__in=[entry['id'] for entry in entries],
+                                             status__in=Submission.IN_PROGRESS_GRADING_STATUS + ('IE',))
+                             .values_list('id', 'problem__code', 'language__key', 'source__source')}
+    Submission.objects.filter(id__in=list(submissions)).update(status='QU', result=None, error=None)
 
-    judge_server = Server(settings.BRIDGED_JUDGE_ADDRESS, partial(JudgeHandler, judges=judges))
-    django_server = Server(settings.BRIDGED_DJANGO_ADDRESS, partial(DjangoHandler, judges=judges))
+    submission_data = get_submissions_data(list(submissions))
+    restored = 0
+    for entry in entries:
+        id = entry['id']
+        data = submission_data.get(id)
+        if data is None:
+            journal.free(id)
+            continue
+        problem, language, source = submissions[id]
+        judges.judge(id, problem, language, source, entry['priority'], data)
+        restored += 1
+
+    logger.info('Restored %d submission(s) from the queue journal', restored)
+    return set(submissions)
+
+
+def judge_daemon(judge_addresses=None, django_addresses=None, metrics_address=None, journal_path=None, shard=None):
+    """Runs the bridge. The arguments override the corresponding BRIDGED_* settings.
+
+    When several bridges share the load (see BRIDGED_DJANGO_SHARDS), shard is the index of this one, and only the
+    submissions to problems routed to it are touched on startup. The online status of judges is then left alone, as
+    most of them are connected to the other bridges.
+    """
+    judge_addresses = judge_addresses or settings.BRIDGED_JUDGE_ADDRESS
+    django_addresses = django_addresses or settings.BRIDGED_DJANGO_ADDRESS
+    metrics_address = metrics_address or settings.BRIDGED_METRICS_ADDRESS
+    journal_path = journal_path or settings.BRIDGED_JOURNAL_PATH
+    if settings.BRIDGED_EVENT_HUB and not settings.EVENT_DAEMON_HUB_SOCKET:
+        raise ImproperlyConfigured('BRIDGED_EVENT_HUB needs EVENT_DAEMON_HUB_SOCKET to take posts on')
+
+    in_progress = Submission.objects.filter(status__in=Submission.IN_PROGRESS_GRADING_STATUS)
+    if shard is None:
+        reset_judges()
+    else:
+        problems = [code for code in Problem.objects.values_list('code', flat=True) if bridge_shard(code) == shard]
+        in_progress = in_progress.filter(problem__code__in=problems)
+        logger.info('Bridge shard %d serves %d problem(s)', shard, len(problems))
+
+    journal = None
+    restored = set()
+    costs = GradingCostModel()
+    judges = JudgeList(policy=make_policy(settings.BRIDGED_QUEUE_POLICY, costs, settings.BRIDGED_QUEUE_SJF_AGING),
+                       costs=costs, heavy_factor=settings.BRIDGED_HEAVY_SUBMISSION_FACTOR)
+    if journal_path:
+        journal = judges.journal = QueueJournal(journal_path, settings.BRIDGED_JOURNAL_COMPACT_SIZE,
+                                                settings.BRIDGED_JOURNAL_FSYNC)
+        restored = restore_queue(judges, journal, journal.open())
+    in_progress.exclude(id__in=restored).update(status='IE', result='IE', error=None)
+
+    test_case_buffer = CaseWriteBuffer(settings.BRIDGED_TEST_CASE_FLUSH_SIZE, settings.BRIDGED_TEST_CASE_FLUSH_INTERVAL)
+    scheduler = Scheduler()
+    events = EventCoalescer(settings.BRIDGED_EVENT_FLUSH_INTERVAL)
+    # Timers on the scheduler thread hand anything that could block off to this pool.
+    executor = ThreadPoolExecutor(max_workers=settings.BRIDGED_ASYNCIO_WORKERS if settings.BRIDGED_ASYNCIO else
+                                  settings.BRIDGED_BACKGROUND_WORKERS, thread_name_prefix='bridge')
+    judge_handler = partial(JudgeHandler, judges=judges, test_case_buffer=test_case_buffer, scheduler=scheduler,
+                            events=events, background=executor)
+
+    if settings.BRIDGED_ASYNCIO:
+        judge_server = AsyncServer(judge_addresses, judge_handler, executor)
+        django_server = AsyncServer(django_addresses, partial(DjangoHandler, judges=judges), executor)
+    else:
+        judge_server = Server(judge_addresses, judge_handler)
+        django_server = Server(django_addresses, partial(DjangoHandler, judges=judges))
+
+    # Started, and listening, before anything else, since the bridge posts to it.
+    event_hub = None
+    if settings.BRIDGED_EVENT_HUB:
+        event_hub = EventHubServer(settings.EVENT_DAEMON_HUB_SOCKET, settings.EVENT_DAEMON_HUB_ADDRESS,
+                                   settings.EVENT_DAEMON_HUB_MAX_QUEUE, settings.EVENT_DAEMON_HUB_POLL_TIMEOUT)
+        threading.Thread(target=event_hub.serve_forever, daemon=True).start()
+        event_hub.started.wait()
+        if event_hub.start_error is not None:
+            raise RuntimeError('Event hub failed to start') from event_hub.start_error
 
     threading.Thread(target=django_server.serve_forever).start()
     threading.Thread(target=judge_server.serve_forever).start()
+    test_case_thread = threading.Thread(target=test_case_buffer.run)
+    test_case_thread.start()
+    scheduler_thread = threading.Thread(target=scheduler.run)
+    scheduler_thread.start()
+    event_thread = threading.Thread(target=events.run)
+    event_thread.start()
+
+    metrics_server = None
+    if metrics_address:
+        metrics_server = MetricsServer(tuple(metrics_address), MetricsRequestHandler)
+        threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
 
     stop = threading.Event()
 
@@ -43,5 +143,18 @@ def judge_daemon():
     try:
         stop.wait()
     finally:
+        if journal is not None:
+            journal.close()
         django_server.shutdown()
         judge_server.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        test_case_buffer.stop()
+        test_case_thread.join()
+        scheduler.stop()
+        scheduler_thread.join()
+        events.stop()
+        event_thread.join()
+        if event_hub is not None:
+            event_hub.shutdown()
+        executor.shutdown(wait=False)
@@ -3,6 +3,7 @@ import logging
 import struct
 
 from judge.bridge.base_handler import Disconnect, ZlibPacketHandler
+from judge.bridge.submission_data import get_submission_data, get_submissions_data, language_limits
 
 logger = logging.getLogger('judge.bridge')
 size_pack = struct.Struct('!I')
@@ -14,8 +15,10 @@ class DjangoHandler(ZlibPacketHandler):
 
         self.handlers = {
             'submission-request': self.on_submission,
+            'submission-batch-request': self.on_submission_batch,
             'terminate-submission': self.on_termination,
             'disconnect-judge': self.on_disconnect_request,
+            'invalidate-limits': self.on_invalidate_limits,
         }
         self.judges = judges
 
@@ -24,13 +27,24 @@ class DjangoHandler(ZlibPacketHandler):
 
     def on_packet(self, packet):
         packet = json.loads(packet)
+        request_id = packet.get('request-id')
         try:
             result = self.handlers.get(packet.get('name', None), self.on_malformed)(packet)
         except Exception:
             logger.exception('Error in packet handling (Django-facing)')
             result = {'name': 'bad-request'}
+
+        if packet.get('no-reply'):
+            return
+        if request_id is None:
+            self.send(result)
+            raise Disconnect()
+
+        # Requests on a persistent connection are tagged, unless they need no reply, and every one of them gets a
+        # reply so the client can match replies to pipelined requests.
+        result = dict(result or {})
+        result['request-id'] = request_id
         self.send(result)
-        raise Disconnect()
 
     def on_submission(self, data):
         id = data['submission-id']
@@ -40,9 +54,23 @@ class DjangoHandler(ZlibPacketHandler):
         priority = data['priority']
         if not self.judges.check_priority(priority):
             return {'name': 'bad-request'}
-        self.judges.judge(id, problem, language, source, priority)
+        data = get_submission_data(id)
+        if data is None:
+            return {'name': 'bad-request'}
+        self.judges.judge(id, problem, language, source, priority, data)
         return {'name': 'submission-received', 'submission-id': id}
 
+    def on_submission_batch(self, data):
+        priority = data['priority']
+        if not self.judges.check_priority(priority):
+            return {'name': 'bad-request'}
+        submission_data = get_submissions_data([sub['submission-id'] for sub in data['submissions']])
+        submissions = [(sub['submission-id'], sub['problem-id'], sub['language'], sub['source'],
+                        submission_data[sub['submission-id']])
+                       for sub in data['submissions'] if sub['submission-id'] in submission_data]
+        self.judges.judge_batch(submissions, priority)
+        return {'name': 'submission-batch-received', 'count': len(submissions)}
+
     def on_termination(self, data):
         return {'name': 'submission-received', 'judge-aborted': self.judges.abort(data['submission-id'])}
 
@@ -51,6 +79,9 @@ class DjangoHandler(ZlibPacketHandler):
         force = data['force']
         self.judges.disconnect(judge_id, force=force)
 
+    def on_invalidate_limits(self, data):
+        language_limits.invalidate(data.get('problem-id'))
+
     def on_malformed(self, packet):
         logger.error('Malformed packet: %s', packet)
 
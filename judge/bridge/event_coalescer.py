@@ -0,0 +1,93 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from judge import event_poster as event
+from judge.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger('judge.bridge')
+
+emitted_count = Counter('bridge_events_emitted_total', 'Live update events posted to the event daemon.', ['channel'])
+suppressed_count = Counter('bridge_events_suppressed_total',
+                           'Live update events replaced by a later one before they were posted.', ['channel'])
+pending_count = Gauge('bridge_events_pending', 'Live update events waiting for the next flush.')
+
+
+def channel_type(channel):
+    # sub_<secret> and contest_<id> would make one series per submission or contest.
+    return channel.split('_', 1)[0]
+
+
+class EventCoalescer(object):
+    """Merges the live updates the bridge posts, so that the event daemon only gets the latest state of each.
+
+    Events are keyed by channel and an optional key, e.g. the submission id on the shared submissions channel. Within
+    a flush interval, a new event replaces the pending one with the same key, and everything pending is posted in the
+    order it was first queued once the interval is up. Terminal events, like the end of grading, are posted right
+    away, replacing any pending event with their key, so they are never lost or delayed. Once more than max_pending
+    events are waiting, the oldest one is posted without waiting for the flush.
+    """
+
+    def __init__(self, flush_interval=0.5, max_pending=10000, post=None):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._post = post or event.post
+
+        self._lock = threading.Lock()
+        # Held while posting, so a terminal event is never overtaken by a stale update of the same submission that
+        # was taken out of the pending events just before it.
+        self._post_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._pending = OrderedDict()  # (channel, key): message
+
+        pending_count.set_function(lambda: len(self._pending))
+
+    def post(self, channel, message, key=None, terminal=False):
+        if terminal:
+            with self._post_lock:
+                with self._lock:
+                    if self._pending.pop((channel, key), None) is not None:
+                        suppressed_count.inc(channel_type(channel))
+                self._emit(channel, message)
+            return
+
+        overflow = None
+        with self._lock:
+            if (channel, key) in self._pending:
+                suppressed_count.inc(channel_type(channel))
+            self._pending[channel, key] = message
+            if len(self._pending) > self.max_pending:
+                overflow = self._pending.popitem(last=False)
+        if overflow is not None:
+            (channel, _), message = overflow
+            with self._post_lock:
+                self._emit(channel, message)
+
+    def _emit(self, channel, message):
+        try:
+            self._post(channel, message)
+        except Exception:
+            logger.exception('Failed to post event to %s', channel)
+        else:
+            emitted_count.inc(channel_type(channel))
+
+    def flush(self):
+        with self._post_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+            for (channel, _), message in pending.items():
+                self._emit(channel, message)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error flushing events')
+        self.flush()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
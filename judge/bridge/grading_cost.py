@@ -0,0 +1,53 @@
+class GradingCostModel(object):
+    """Rolling estimates of how long submissions take to grade, learned from the submissions the bridge sees finish.
+
+    Costs are exponentially weighted moving averages of the seconds from grading-begin to grading-end, kept per
+    (problem, language), per problem and overall, so that a new language or problem falls back to the closest thing
+    known. Judges are not equally fast, so each judge also has a slowness, the moving average of how long it took
+    relative to the estimate, and its times are divided by it before they are averaged in.
+
+    The model is not thread-safe; the JudgeList only uses it with its lock held.
+    """
+
+    def __init__(self, alpha=0.2, default=1.0):
+        self.alpha = alpha
+        self.default = default
+        self._costs = {}  # (problem, language): seconds
+        self._problems = {}  # problem: seconds
+        self._overall = None
+        self._slowness = {}  # judge name: ratio of its grading times to the estimates
+
+    def _average(self, mapping, key, value):
+        previous = mapping.get(key)
+        mapping[key] = value if previous is None else previous + self.alpha * (value - previous)
+
+    def estimate(self, problem, language):
+        cost = self._costs.get((problem, language))
+        if cost is None:
+            cost = self._problems.get(problem)
+        if cost is None:
+            cost = self.typical()
+        return cost
+
+    def typical(self):
+        return self.default if self._overall is None else self._overall
+
+    def is_heavy(self, problem, language, factor):
+        return self.estimate(problem, language) > factor * self.typical()
+
+    def slowness(self, judge):
+        return self._slowness.get(judge, 1.0)
+
+    def record(self, judge, problem, language, seconds):
+        if seconds <= 0:
+            return
+        if (problem, language) in self._costs:
+            # A single outlier, like a judge stalling on a full disk, shouldn't make it look hopeless for long.
+            ratio = seconds / self._costs[problem, language]
+            self._average(self._slowness, judge, min(max(ratio, 0.1), 10.0))
+        seconds /= self.slowness(judge)
+
+        self._average(self._costs, (problem, language), seconds)
+        self._average(self._problems, problem, seconds)
+        previous = self._overall
+        self._overall = seconds if previous is None else previous + self.alpha * (seconds - previous)
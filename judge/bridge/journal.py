@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger('judge.bridge')
+
+
+class QueueJournal(object):
+    """Append-only log of the submissions the bridge is responsible for, so they survive a restart.
+
+    Every submission handed to the JudgeList is journaled when it is received, when it is dispatched to a judge, and
+    when it leaves the bridge, i.e. when its judge is freed or it is aborted while queued. Replaying the journal
+    yields the submissions that were still queued or being graded, in the order they were received.
+
+    The live set is also kept in memory. Once the journal holds more than compact_size records and at least twice as
+    many as there are live submissions, it is rewritten to contain only the live ones, so replaying it takes time
+    proportional to the work that is actually outstanding.
+    """
+
+    def __init__(self, path, compact_size=10000, fsync=False):
+        self.path = path
+        self.compact_size = compact_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._live = {}  # submission id: {'id', 'priority', 'problem', 'language', 'judge'}
+        self._records = 0
+        self._file = None
+
+    def open(self):
+        """Reads the journal, then opens it for appending. Returns the live entries in the order they were received."""
+        with self._lock:
+            self._live = {}
+            self._records = 0
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._records += 1
+                        try:
+                            self._apply(json.loads(line))
+                        except (ValueError, KeyError, TypeError):
+                            # The last record may be torn if we crashed while writing it.
+                            logger.warning('Ignoring malformed journal record: %r', line)
+            except FileNotFoundError:
+                pass
+
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._compact_if_needed()
+            return [dict(entry) for entry in self._live.values()]
+
+    def _apply(self, record):
+        op, id = record['op'], record['id']
+        if op == 'enqueue':
+            entry = self._live.setdefault(id, {'id': id, 'judge': None})
+            entry.update(priority=record['priority'], problem=record['problem'], language=record['language'])
+        elif op == 'dispatch':
+            if id in self._live:
+                self._live[id]['judge'] = record['judge']
+        elif op in ('free', 'abort'):
+            self._live.pop(id, None)
+        else:
+            raise ValueError('unknown journal op: %r' % op)
+
+    def _write(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._file is None:
+                return
+            try:
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                logger.exception('Failed to write to queue journal: %s', self.path)
+                return
+            self._records += 1
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self._records <= self.compact_size or self._records < 2 * len(self._live):
+            return
+
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                for entry in self._live.values():
+                    f.write(json.dumps({'op': 'enqueue', 'id': entry['id'], 'priority': entry['priority'],
+                                        'problem': entry['problem'], 'language': entry['language']},
+                                       separators=(',', ':')) + '\n')
+                    if entry['judge'] is not None:
+                        f.write(json.dumps({'op': 'dispatch', 'id': entry['id'], 'judge': entry['judge']},
+                                           separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+        except OSError:
+            logger.exception('Failed to compact queue journal: %s', self.path)
+            return
+
+        self._file.close()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._records = len(self._live) + sum(entry['judge'] is not None for entry in self._live.values())
+        logger.info('Compacted queue journal to %d records', self._records)
+
+    def enqueue(self, id, priority, problem, language):
+        self._write({'op': 'enqueue', 'id': id, 'priority': priority, 'problem': problem, 'language': language})
+
+    def dispatch(self, id, judge):
+        self._write({'op': 'dispatch', 'id': id, 'judge': judge})
+
+    def free(self, id):
+        self._write({'op': 'free', 'id': id})
+
+    def abort(self, id):
+        self._write({'op': 'abort', 'id': id})
+
+    def close(self):
+        # Anything that happens after this, like judges disconnecting as the bridge shuts down, is not recorded, so
+        # that the submissions they were grading are picked up again on the next start.
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
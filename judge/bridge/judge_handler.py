@@ -3,7 +3,7 @@ import json
 import logging
 import threading
 import time
-from collections import deque, namedtuple
+from collections import deque
 from operator import itemgetter
 
 from django import db
@@ -12,31 +12,95 @@ from django.utils import timezone
 
 from judge import event_poster as event
 from judge.bridge.base_handler import ZlibPacketHandler, proxy_list
+from judge.bridge.packet_codecs import negotiate
+from judge.bridge.registration import sync_problems, sync_runtimes
+from judge.bridge.submission_data import SubmissionVanished, ensure_connection, get_submission_data
 from judge.caching import finished_submission
-from judge.models import Judge, Language, LanguageLimit, Problem, RuntimeVersion, Submission, SubmissionTestCase
+from judge.models import Judge, RuntimeVersion, Submission, SubmissionTestCase
+from judge.utils.metrics import Counter, Histogram
+from judge.utils.ranking import contest_ranking_update
 
 logger = logging.getLogger('judge.bridge')
 json_log = logging.getLogger('judge.json.bridge')
 
-UPDATE_RATE_LIMIT = 5
-UPDATE_RATE_TIME = 0.5
-SubmissionData = namedtuple('SubmissionData', 'time memory short_circuit pretests_only contest_no attempt_no user_id')
+PING_INTERVAL = 10
+ACKNOWLEDGE_TIMEOUT = 20
+# Seconds to wait after a supported-problems packet before registering the new problem list, in case more follow.
+PROBLEM_SYNC_DELAY = 5
+
+finished_count = Counter('bridge_submissions_finished_total', 'Submissions a judge finished with, in any state.',
+                         ['judge'])
+test_case_count = Counter('bridge_test_cases_total', 'Test case results received from judges.', ['judge'])
+grading_start_time = Histogram('bridge_queue_to_grading_seconds',
+                               'Time from receiving a submission to a judge beginning to grade it.')
+grading_time = Histogram('bridge_grading_seconds', 'Time from grading-begin to grading-end on a judge.')
+
+
+class GradingAccumulator(object):
+    """Running aggregate of the test cases of a submission, as needed to finalize it on grading-end."""
+
+    status_codes = ['SC', 'AC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
+
+    def __init__(self, submission_id):
+        self.submission_id = submission_id
+        self.time = 0
+        self.memory = 0
+        self.points = 0.0
+        self.total = 0
+        self.status = 0
+        self.batches = {}  # batch number: (points, total)
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_database(cls, submission_id):
+        accumulator = cls(submission_id)
+        for case in SubmissionTestCase.objects.filter(submission_id=submission_id):
+            accumulator.add(case)
+        return accumulator
+
+    def add(self, case):
+        self.time += case.time
+        if not case.batch:
+            self.points += case.points
+            self.total += case.total
+        else:
+            if case.batch in self.batches:
+                self.batches[case.batch][0] = min(self.batches[case.batch][0], case.points)
+                self.batches[case.batch][1] = max(self.batches[case.batch][1], case.total)
+            else:
+                self.batches[case.batch] = [case.points, case.total]
+        self.memory = max(self.memory, case.memory)
+        i = self.status_codes.index(case.status)
+        if i > self.status:
+            self.status = i
 
+    def elapsed(self):
+        return time.monotonic() - self.started
 
-def _ensure_connection():
-    try:
-        db.connection.cursor().execute('SELECT 1').fetchall()
-    except Exception:
-        db.connection.close()
+    def result(self):
+        """Returns (time, memory, case points, case total, result) for the submission."""
+        points = self.points
+        total = self.total
+        for batch_points, batch_total in self.batches.values():
+            points += batch_points
+            total += batch_total
+        return self.time, self.memory, round(points, 1), round(total, 1), self.status_codes[self.status]
 
 
 class JudgeHandler(ZlibPacketHandler):
     proxies = proxy_list(settings.BRIDGED_JUDGE_PROXIES or [])
+    zlib_level = settings.BRIDGED_ZLIB_LEVEL
 
-    def __init__(self, request, client_address, server, judges):
+    def __init__(self, request, client_address, server, judges, test_case_buffer, scheduler, events, background):
         super().__init__(request, client_address, server)
 
         self.judges = judges
+        self.test_case_buffer = test_case_buffer
+        # The scheduler thread is shared by every judge, so what its timers do that could block, like writing to the
+        # socket, is handed off to the background executor.
+        self.scheduler = scheduler
+        self.background = background
+        self.events = events
         self.handlers = {
             'grading-begin': self.on_grading_begin,
             'grading-end': self.on_grading_end,
@@ -53,6 +117,7 @@ class JudgeHandler(ZlibPacketHandler):
             'handshake': self.on_handshake,
         }
         self._working = False
+        self._working_on = None  # (problem, language) of the current submission
         self._no_response_job = None
         self._problems = []
         self.executors = {}
@@ -63,17 +128,21 @@ class JudgeHandler(ZlibPacketHandler):
         self.name = None
         self.batch_id = None
         self.in_batch = False
-        self._stop_ping = threading.Event()
+        self._ping_job = None
+        self._ping_pending = False
         self._ping_average = deque(maxlen=6)  # 1 minute average, just like load
         self._time_delta = deque(maxlen=6)
 
-        # each value is (updates, last reset)
-        self.update_counter = {}
         self.judge = None
         self.judge_address = None
 
         self._submission_cache_id = None
         self._submission_cache = {}
+        self._grading = None
+
+        self._registration_lock = threading.Lock()
+        self._registered_problems = None  # ids of the problems the database has for this judge, once known
+        self._problem_sync_job = None
 
     def on_connect(self):
         self.timeout = 15
@@ -81,7 +150,12 @@ class JudgeHandler(ZlibPacketHandler):
         json_log.info(self._make_json_log(action='connect'))
 
     def on_disconnect(self):
-        self._stop_ping.set()
+        if self._ping_job is not None:
+            self._ping_job.cancel()
+        self._cancel_no_response_job()
+        if self._problem_sync_job is not None:
+            self._problem_sync_job.cancel()
+            self._sync_problems()
         if self._working:
             logger.error('Judge %s disconnected while handling submission %s', self.name, self._working)
         self.judges.remove(self)
@@ -91,6 +165,7 @@ class JudgeHandler(ZlibPacketHandler):
 
         json_log.info(self._make_json_log(action='disconnect', info='judge disconnected'))
         if self._working:
+            self.test_case_buffer.flush(self._working)
             Submission.objects.filter(id=self._working).update(status='IE', result='IE', error='')
             json_log.error(self._make_json_log(sub=self._working, action='close', info='IE due to shutdown on grading'))
 
@@ -110,18 +185,11 @@ class JudgeHandler(ZlibPacketHandler):
         judge = self.judge = Judge.objects.get(name=self.name)
         judge.start_time = timezone.now()
         judge.online = True
-        judge.problems.set(Problem.objects.filter(code__in=list(self.problems.keys())))
-        judge.runtimes.set(Language.objects.filter(key__in=list(self.executors.keys())))
-
-        # Delete now in case we somehow crashed and left some over from the last connection
-        RuntimeVersion.objects.filter(judge=judge).delete()
-        versions = []
-        for lang in judge.runtimes.all():
-            versions += [
-                RuntimeVersion(language=lang, name=name, version='.'.join(map(str, version)), priority=idx, judge=judge)
-                for idx, (name, version) in enumerate(self.executors[lang.key])
-            ]
-        RuntimeVersion.objects.bulk_create(versions)
+        # The problems of a judge are kept when it disconnects, so a judge reconnecting after a network blip usually
+        # has nothing to register.
+        with self._registration_lock:
+            self._registered_problems = sync_problems(judge, list(self.problems))
+        sync_runtimes(judge, self.executors)
         judge.last_ip = self.client_address[0]
         judge.save()
         self.judge_address = '[%s]:%s' % (self.client_address[0], self.client_address[1])
@@ -160,10 +228,21 @@ class JudgeHandler(ZlibPacketHandler):
         self.executors = packet['executors']
         self.name = packet['id']
 
-        self.send({'name': 'handshake-success'})
+        # Judges that support it list the codecs they can use in the handshake. The reply still uses zlib framing,
+        # and the chosen codec applies to everything after it, in both directions.
+        codec, dictionary = negotiate(
+            packet.get('codecs') or (), settings.BRIDGED_CODECS, packet.get('codec-dictionaries') or (),
+            settings.BRIDGED_CODEC_DICTIONARY, threshold=settings.BRIDGED_CODEC_THRESHOLD,
+            zlib_level=settings.BRIDGED_ZLIB_LEVEL, zstd_level=settings.BRIDGED_ZSTD_LEVEL,
+        )
+        if codec is None:
+            self.send({'name': 'handshake-success'})
+        else:
+            self.send({'name': 'handshake-success', 'codec': codec.name, 'codec-dictionary': dictionary})
+            self.codec = codec
         logger.info('Judge authenticated: %s (%s)', self.client_address, packet['id'])
         self.judges.register(self)
-        threading.Thread(target=self._ping_thread).start()
+        self._ping_job = self.scheduler.call_every(PING_INTERVAL, self._ping)
         self._connected()
 
     def can_judge(self, problem, executor):
@@ -173,42 +252,6 @@ class JudgeHandler(ZlibPacketHandler):
     def working(self):
         return bool(self._working)
 
-    def get_related_submission_data(self, submission):
-        _ensure_connection()
-
-        try:
-            pid, time, memory, short_circuit, lid, is_pretested, sub_date, uid, part_virtual, part_id = (
-                Submission.objects.filter(id=submission)
-                          .values_list('problem__id', 'problem__time_limit', 'problem__memory_limit',
-                                       'problem__short_circuit', 'language__id', 'is_pretested', 'date', 'user__id',
-                                       'contest__participation__virtual', 'contest__participation__id')).get()
-        except Submission.DoesNotExist:
-            logger.error('Submission vanished: %s', submission)
-            json_log.error(self._make_json_log(
-                sub=self._working, action='request',
-                info='submission vanished when fetching info',
-            ))
-            return
-
-        attempt_no = Submission.objects.filter(problem__id=pid, contest__participation__id=part_id, user__id=uid,
-                                               date__lt=sub_date).exclude(status__in=('CE', 'IE')).count() + 1
-
-        try:
-            time, memory = (LanguageLimit.objects.filter(problem__id=pid, language__id=lid)
-                            .values_list('time_limit', 'memory_limit').get())
-        except LanguageLimit.DoesNotExist:
-            pass
-
-        return SubmissionData(
-            time=time,
-            memory=memory,
-            short_circuit=short_circuit,
-            pretests_only=is_pretested,
-            contest_no=part_virtual,
-            attempt_no=attempt_no,
-            user_id=uid,
-        )
-
     def disconnect(self, force=False):
         if force:
             # Yank the power out.
@@ -216,10 +259,16 @@ class JudgeHandler(ZlibPacketHandler):
         else:
             self.send({'name': 'disconnect'})
 
-    def submit(self, id, problem, language, source):
-        data = self.get_related_submission_data(id)
+    def submit(self, id, problem, language, source, data=None):
+        # The metadata is normally gathered when the submission is enqueued, outside the JudgeList lock.
+        if data is None:
+            data = get_submission_data(id)
+            if data is None:
+                raise SubmissionVanished(id)
         self._working = id
-        self._no_response_job = threading.Timer(20, self._kill_if_no_response)
+        self._working_on = problem, language
+        self._cancel_no_response_job()
+        self._no_response_job = self.scheduler.call_later(ACKNOWLEDGE_TIMEOUT, self._kill_if_no_response)
         self.send({
             'name': 'submission-request',
             'submission-id': id,
@@ -250,11 +299,11 @@ class JudgeHandler(ZlibPacketHandler):
         super(JudgeHandler, self).malformed_packet(exception)
 
     def on_submission_processing(self, packet):
-        _ensure_connection()
+        ensure_connection()
 
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='P', judged_on=self.judge):
-            event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'processing'})
+            self.events.post('sub_%s' % Submission.get_id_secret(id), {'type': 'processing'})
             self._post_update_submission(id, 'processing')
             json_log.info(self._make_json_log(packet, action='processing'))
         else:
@@ -271,11 +320,14 @@ class JudgeHandler(ZlibPacketHandler):
             self.on_submission_wrong_acknowledge(packet, self._working, packet.get('submission-id', None))
             self.close()
         logger.info('Submission acknowledged: %d', self._working)
-        if self._no_response_job:
-            self._no_response_job.cancel()
-            self._no_response_job = None
+        self._cancel_no_response_job()
         self.on_submission_processing(packet)
 
+    def _cancel_no_response_job(self):
+        job, self._no_response_job = self._no_response_job, None
+        if job is not None:
+            job.cancel()
+
     def abort(self):
         self.send({'name': 'terminate-submission'})
 
@@ -316,9 +368,27 @@ class JudgeHandler(ZlibPacketHandler):
         if not self.working:
             self.judges.update_problems(self)
 
-        self.judge.problems.set(Problem.objects.filter(code__in=list(self.problems.keys())))
+        # Judges send a packet for every change they notice, which come in bursts when problems are being deployed.
+        with self._registration_lock:
+            if self._problem_sync_job is None:
+                # The timer only hands the sync off, since it waits on the database.
+                self._problem_sync_job = self.scheduler.call_later(PROBLEM_SYNC_DELAY, self.background.submit,
+                                                                   self._sync_problems)
         json_log.info(self._make_json_log(action='update-problems', count=len(self.problems)))
 
+    def _sync_problems(self):
+        # This usually runs on the background executor.
+        with self._registration_lock:
+            self._problem_sync_job = None
+            if self.judge is None:
+                return
+            ensure_connection()
+            try:
+                self._registered_problems = sync_problems(self.judge, list(self.problems), self._registered_problems)
+            except Exception:
+                logger.exception('Failed to update the problems of judge: %s', self.name)
+                self._registered_problems = None
+
     def on_grading_begin(self, packet):
         logger.info('%s: Grading has begun on: %s', self.name, packet['submission-id'])
         self.batch_id = None
@@ -326,8 +396,13 @@ class JudgeHandler(ZlibPacketHandler):
         if Submission.objects.filter(id=packet['submission-id']).update(
                 status='G', is_pretested=packet['pretested'], current_testcase=1,
                 batch=False, judged_date=timezone.now()):
+            self.test_case_buffer.discard(packet['submission-id'])
             SubmissionTestCase.objects.filter(submission_id=packet['submission-id']).delete()
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'grading-begin'})
+            self._grading = GradingAccumulator(packet['submission-id'])
+            received = self.judges.received.get(packet['submission-id'])
+            if received is not None:
+                grading_start_time.observe(self._grading.started - received)
+            self.events.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'grading-begin'})
             self._post_update_submission(packet['submission-id'], 'grading-begin')
             json_log.info(self._make_json_log(packet, action='grading-begin'))
         else:
@@ -336,6 +411,10 @@ class JudgeHandler(ZlibPacketHandler):
 
     def on_grading_end(self, packet):
         logger.info('%s: Grading has ended on: %s', self.name, packet['submission-id'])
+        self.test_case_buffer.flush(packet['submission-id'])
+        # Learn the cost before freeing ourselves, since that dispatches the next submission.
+        if self._grading is not None and self._grading.submission_id == packet['submission-id'] and self._working_on:
+            self.judges.record_cost(self, *self._working_on, self._grading.elapsed())
         self._free_self(packet)
         self.batch_id = None
 
@@ -346,36 +425,15 @@ class JudgeHandler(ZlibPacketHandler):
             json_log.error(self._make_json_log(packet, action='grading-end', info='unknown submission'))
             return
 
-        time = 0
-        memory = 0
-        points = 0.0
-        total = 0
-        status = 0
-        status_codes = ['SC', 'AC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
-        batches = {}  # batch number: (points, total)
-
-        for case in SubmissionTestCase.objects.filter(submission=submission):
-            time += case.time
-            if not case.batch:
-                points += case.points
-                total += case.total
-            else:
-                if case.batch in batches:
-                    batches[case.batch][0] = min(batches[case.batch][0], case.points)
-                    batches[case.batch][1] = max(batches[case.batch][1], case.total)
-                else:
-                    batches[case.batch] = [case.points, case.total]
-            memory = max(memory, case.memory)
-            i = status_codes.index(case.status)
-            if i > status:
-                status = i
-
-        for i in batches:
-            points += batches[i][0]
-            total += batches[i][1]
-
-        points = round(points, 1)
-        total = round(total, 1)
+        # The test cases normally all arrived on this connection, but we have to read them back if we missed the
+        # start of grading, e.g. when the bridge restarted in the middle of it.
+        grading, self._grading = self._grading, None
+        if grading is None or grading.submission_id != submission.id:
+            grading = GradingAccumulator.from_database(submission.id)
+        else:
+            grading_time.observe(grading.elapsed())
+        time, memory, points, total, result = grading.result()
+
         submission.case_points = points
         submission.case_total = total
 
@@ -388,7 +446,7 @@ class JudgeHandler(ZlibPacketHandler):
         submission.time = time
         submission.memory = memory
         submission.points = sub_points
-        submission.result = status_codes[status]
+        submission.result = result
         submission.save()
 
         json_log.info(self._make_json_log(
@@ -401,33 +459,34 @@ class JudgeHandler(ZlibPacketHandler):
         submission.user._updating_stats_only = True
         problem._updating_stats_only = True
         problem.update_stats()
-        submission.update_contest()
+        submission.update_contest(judged=True)
 
         finished_submission(submission)
 
-        event.post('sub_%s' % submission.id_secret, {
+        self.events.post('sub_%s' % submission.id_secret, {
             'type': 'grading-end',
             'time': time,
             'memory': memory,
             'points': float(points),
             'total': float(problem.points),
             'result': submission.result,
-        })
+        }, terminal=True)
         if hasattr(submission, 'contest'):
-            participation = submission.contest.participation
-            event.post('contest_%d' % participation.contest_id, {'type': 'update'})
+            self._post_update_ranking(submission.contest.participation)
         self._post_update_submission(submission.id, 'grading-end', done=True)
 
     def on_compile_error(self, packet):
         logger.info('%s: Submission failed to compile: %s', self.name, packet['submission-id'])
+        self.test_case_buffer.flush(packet['submission-id'])
         self._free_self(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='CE', result='CE', error=packet['log']):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {
+            self.events.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {
                 'type': 'compile-error',
                 'log': packet['log'],
-            })
+            }, terminal=True)
             self._post_update_submission(packet['submission-id'], 'compile-error', done=True)
+            self._update_contest(packet['submission-id'])
             json_log.info(self._make_json_log(packet, action='compile-error', log=packet['log'],
                                               finish=True, result='CE'))
         else:
@@ -439,7 +498,7 @@ class JudgeHandler(ZlibPacketHandler):
         logger.info('%s: Submission generated compiler messages: %s', self.name, packet['submission-id'])
 
         if Submission.objects.filter(id=packet['submission-id']).update(error=packet['log']):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-message'})
+            self.events.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-message'})
             json_log.info(self._make_json_log(packet, action='compile-message', log=packet['log']))
         else:
             logger.warning('Unknown submission: %s', packet['submission-id'])
@@ -451,12 +510,14 @@ class JudgeHandler(ZlibPacketHandler):
             raise ValueError('\n\n' + packet['message'])
         except ValueError:
             logger.exception('Judge %s failed while handling submission %s', self.name, packet['submission-id'])
+        self.test_case_buffer.flush(packet['submission-id'])
         self._free_self(packet)
 
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='IE', result='IE', error=packet['message']):
-            event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'internal-error'})
+            self.events.post('sub_%s' % Submission.get_id_secret(id), {'type': 'internal-error'}, terminal=True)
             self._post_update_submission(id, 'internal-error', done=True)
+            self._update_contest(id)
             json_log.info(self._make_json_log(packet, action='internal-error', message=packet['message'],
                                               finish=True, result='IE'))
         else:
@@ -466,11 +527,14 @@ class JudgeHandler(ZlibPacketHandler):
 
     def on_submission_terminated(self, packet):
         logger.info('%s: Submission aborted: %s', self.name, packet['submission-id'])
+        self.test_case_buffer.flush(packet['submission-id'])
         self._free_self(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='AB', result='AB'):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'aborted-submission'})
+            self.events.post('sub_%s' % Submission.get_id_secret(packet['submission-id']),
+                             {'type': 'aborted-submission'}, terminal=True)
             self._post_update_submission(packet['submission-id'], 'terminated', done=True)
+            self._update_contest(packet['submission-id'])
             json_log.info(self._make_json_log(packet, action='aborted', finish=True, result='AB'))
         else:
             logger.warning('Unknown submission: %s', packet['submission-id'])
@@ -499,7 +563,10 @@ class JudgeHandler(ZlibPacketHandler):
         updates = packet['cases']
         max_position = max(map(itemgetter('position'), updates))
 
-        if not Submission.objects.filter(id=id).update(current_testcase=max_position + 1):
+        # Results for the submission we saw begin grading go through the write-behind buffer; anything else is
+        # written straight away, which also tells us whether the submission exists.
+        buffered = self._grading is not None and self._grading.submission_id == id
+        if not buffered and not Submission.objects.filter(id=id).update(current_testcase=max_position + 1):
             logger.warning('Unknown submission: %s', id)
             json_log.error(self._make_json_log(packet, action='test-case', info='unknown submission'))
             return
@@ -541,28 +608,19 @@ class JudgeHandler(ZlibPacketHandler):
                 points=test_case.points, total=test_case.total, status=test_case.status,
             ))
 
-        do_post = True
-
-        if id in self.update_counter:
-            cnt, reset = self.update_counter[id]
-            cnt += 1
-            if time.monotonic() - reset > UPDATE_RATE_TIME:
-                del self.update_counter[id]
-            else:
-                self.update_counter[id] = (cnt, reset)
-                if cnt > UPDATE_RATE_LIMIT:
-                    do_post = False
-        if id not in self.update_counter:
-            self.update_counter[id] = (1, time.monotonic())
-
-        if do_post:
-            event.post('sub_%s' % Submission.get_id_secret(id), {
-                'type': 'test-case',
-                'id': max_position,
-            })
-            self._post_update_submission(id, state='test-case')
+        self.events.post('sub_%s' % Submission.get_id_secret(id), {
+            'type': 'test-case',
+            'id': max_position,
+        })
+        self._post_update_submission(id, state='test-case')
 
-        SubmissionTestCase.objects.bulk_create(bulk_test_case_updates)
+        test_case_count.inc(self.name, amount=len(bulk_test_case_updates))
+        if buffered:
+            self.test_case_buffer.add(id, bulk_test_case_updates, max_position + 1)
+            for test_case in bulk_test_case_updates:
+                self._grading.add(test_case)
+        else:
+            SubmissionTestCase.objects.bulk_create(bulk_test_case_updates)
 
     def on_malformed(self, packet):
         logger.error('%s: Malformed packet: %s', self.name, packet)
@@ -579,18 +637,24 @@ class JudgeHandler(ZlibPacketHandler):
 
     def _free_self(self, packet):
         self._working = False
+        finished_count.inc(self.name)
         self.judges.on_judge_free(self, packet['submission-id'])
 
-    def _ping_thread(self):
+    def _ping(self):
+        # A judge whose last ping is still being sent has a stalled socket, which times out on its own.
+        if not self._ping_pending:
+            self._ping_pending = True
+            self.background.submit(self._send_ping)
+
+    def _send_ping(self):
         try:
-            while True:
-                self.ping()
-                if self._stop_ping.wait(10):
-                    break
+            self.ping()
         except Exception:
             logger.exception('Ping error in %s', self.name)
+            self._ping_job.cancel()
             self.close()
-            raise
+        finally:
+            self._ping_pending = False
 
     def _make_json_log(self, packet=None, sub=None, **kwargs):
         data = {
@@ -615,10 +679,31 @@ class JudgeHandler(ZlibPacketHandler):
             self._submission_cache_id = id
 
         if data['problem__is_public']:
-            event.post('submissions', {
+            self.events.post('submissions', {
                 'type': 'done-submission' if done else 'update-submission',
                 'state': state, 'id': id,
                 'contest': data['contest_object__key'],
                 'user': data['user_id'], 'problem': data['problem_id'],
                 'status': data['status'], 'language': data['language__key'],
-            })
+            }, key=id, terminal=done)
+
+    def _update_contest(self, id):
+        # Submissions that failed to compile or were aborted still count towards some contest formats, e.g. as
+        # penalties, so they are added to the results like graded ones.
+        if self._submission_cache_id == id and self._submission_cache['contest_object__key'] is None:
+            return
+        try:
+            submission = Submission.objects.select_related('contest__participation', 'contest__problem').get(id=id)
+        except Submission.DoesNotExist:
+            return
+        if hasattr(submission, 'contest'):
+            submission.update_contest(judged=True)
+            self._post_update_ranking(submission.contest.participation)
+
+    def _post_update_ranking(self, participation):
+        if not event.real:
+            return
+        update = contest_ranking_update(participation)
+        if update is not None:
+            # Numbered rows must all be posted for ranking pages to patch themselves, so they are not merged.
+            self.events.post('contest_%d' % participation.contest_id, update, key=update.get('update'))
@@ -1,48 +1,170 @@
+import heapq
 import logging
+import time
 from collections import namedtuple
+from itertools import count
 from operator import attrgetter
 from threading import RLock
 
-try:
-    from llist import dllist
-except ImportError:
-    from pyllist import dllist
+from judge.bridge.grading_cost import GradingCostModel
+from judge.bridge.queue_policy import FIFOPolicy
+from judge.bridge.submission_data import SubmissionVanished
+from judge.utils.metrics import Counter, Gauge, Histogram
 
 logger = logging.getLogger('judge.bridge')
 
-PriorityMarker = namedtuple('PriorityMarker', 'priority')
+queue_depth = Gauge('bridge_queue_depth', 'Submissions waiting for a judge.', ['priority'])
+judge_count = Gauge('bridge_judges', 'Connected judges.', ['state'])
+received_count = Counter('bridge_submissions_received_total', 'Submissions received for judging.', ['priority'])
+dispatched_count = Counter('bridge_submissions_dispatched_total', 'Submissions sent to a judge.', ['judge'])
+queue_wait = Histogram('bridge_queue_wait_seconds', 'Time from receiving a submission to sending it to a judge.')
+dispatch_time = Histogram('bridge_dispatch_seconds', 'Time spent finding a judge or submission and dispatching it, '
+                                                     'including waiting for the judge list lock.')
+
+QueuedSubmission = namedtuple('QueuedSubmission', 'sequence id problem language source data')
+
+
+class SubmissionQueue(object):
+    """Submissions waiting for a judge, indexed by priority, problem and language.
+
+    Each priority level maps problem -> language -> heap of submissions, ordered by the key the policy gave them
+    when they were queued, so a free judge only has to look at the heads of the queues it is capable of judging. With
+    the default policy, the key is a global sequence number, which keeps submissions FIFO within a priority level
+    across the per-(problem, language) queues.
+
+    Removing a submission only marks its entry, which is dropped once it reaches the top of its heap. Heads are
+    always live, so a heap is empty exactly when nothing is queued in it.
+    """
+
+    def __init__(self, priorities, policy=None):
+        self.policy = policy or FIFOPolicy()
+        self.levels = [{} for _ in range(priorities)]
+        self.counts = [0] * priorities
+        self.node_map = {}
+        self._sequence = count()
+
+    def __contains__(self, id):
+        return id in self.node_map
+
+    def __len__(self):
+        return len(self.node_map)
+
+    def push(self, priority, id, problem, language, source, data):
+        queued = QueuedSubmission(next(self._sequence), id, problem, language, source, data)
+        entries = self.levels[priority].setdefault(problem, {}).setdefault(language, [])
+        entry = [self.policy.key(priority, queued), queued]
+        heapq.heappush(entries, entry)
+        self.node_map[id] = (priority, entries, entry)
+        self.counts[priority] += 1
+
+    def remove(self, id, dispatched=False):
+        priority, entries, entry = self.node_map.pop(id)
+        key, queued = entry
+        self.counts[priority] -= 1
+        self.policy.removed(priority, queued, key, dispatched)
+
+        entry[1] = None
+        while entries and entries[0][1] is None:
+            heapq.heappop(entries)
+        if not entries:
+            languages = self.levels[priority][queued.problem]
+            del languages[queued.language]
+            if not languages:
+                del self.levels[priority][queued.problem]
+
+    def first_for(self, judge):
+        for level in self.levels:
+            if len(judge.problems) < len(level):
+                problems = ((problem, level[problem]) for problem in judge.problems if problem in level)
+            else:
+                problems = level.items()
+
+            best = None
+            for problem, languages in problems:
+                for language, entries in languages.items():
+                    head = entries[0]
+                    if (best is None or head[0] < best[0]) and judge.can_judge(problem, language):
+                        best = head
+            if best is not None:
+                return best[1]
 
 
 class JudgeList(object):
     priorities = 4
 
-    def __init__(self):
-        self.queue = dllist()
-        self.priority = [self.queue.append(PriorityMarker(i)) for i in range(self.priorities)]
+    def __init__(self, journal=None, policy=None, costs=None, heavy_factor=None):
+        self.queue = SubmissionQueue(self.priorities, policy)
+        self.journal = journal
+        self.costs = costs or GradingCostModel()
+        # Submissions expected to take this many times longer than usual go to the judge likely to be fastest.
+        self.heavy_factor = heavy_factor
         self.judges = set()
-        self.node_map = {}
         self.submission_map = {}
+        # submission id: monotonic time it was received, until its judge is freed
+        self.received = {}
         self.lock = RLock()
 
+        queue_depth.set_function(lambda: {(priority,): depth for priority, depth in enumerate(self.queue.counts)})
+        judge_count.set_function(self._judge_states)
+
+    def _judge_states(self):
+        judges = list(self.judges)
+        busy = sum(judge.working for judge in judges)
+        return {('busy',): busy, ('free',): len(judges) - busy}
+
+    def _dispatched(self, id, judge):
+        dispatched_count.inc(judge.name)
+        if self.journal is not None:
+            self.journal.dispatch(id, judge.name)
+        if id in self.received:
+            queue_wait.observe(time.monotonic() - self.received[id])
+
+    def _forget(self, id):
+        # The submission is gone, so it is dropped as if it were aborted, and the judge stays free.
+        self.received.pop(id, None)
+        if self.journal is not None:
+            self.journal.abort(id)
+
+    def _pick_judge(self, candidates, problem, language):
+        if self.heavy_factor is not None and self.costs.is_heavy(problem, language, self.heavy_factor):
+            return min(candidates, key=lambda judge: self.costs.slowness(judge.name) * (1 + max(judge.load, 0)))
+        # Schedule the submission on the judge reporting least load.
+        return min(candidates, key=attrgetter('load'))
+
+    def record_cost(self, judge, problem, language, seconds):
+        with self.lock:
+            self.costs.record(judge.name, problem, language, seconds)
+
     def _handle_free_judge(self, judge):
+        start = time.monotonic()
         with self.lock:
-            node = self.queue.first
-            while node:
-                if not isinstance(node.value, PriorityMarker):
-                    id, problem, language, source = node.value
-                    if judge.can_judge(problem, language):
-                        self.submission_map[id] = judge
-                        logger.info('Dispatched queued submission %d: %s', id, judge.name)
-                        try:
-                            judge.submit(id, problem, language, source)
-                        except Exception:
-                            logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
-                            self.judges.remove(judge)
-                            return
-                        self.queue.remove(node)
-                        del self.node_map[id]
-                        break
-                node = node.next
+            # A judge marks itself free before it gets here, so another thread may already have handed it work.
+            if judge.working:
+                return
+
+            queued = self.queue.first_for(judge)
+            if queued is None:
+                return
+
+            id, problem, language, source = queued.id, queued.problem, queued.language, queued.source
+            self.submission_map[id] = judge
+            logger.info('Dispatched queued submission %d: %s', id, judge.name)
+            try:
+                judge.submit(id, problem, language, source, queued.data)
+            except SubmissionVanished:
+                del self.submission_map[id]
+                self.queue.remove(id)
+                self._forget(id)
+                return self._handle_free_judge(judge)
+            except Exception:
+                logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
+                self.judges.remove(judge)
+                # The submission stays queued for another judge.
+                del self.submission_map[id]
+                return
+            self.queue.remove(id, dispatched=True)
+            self._dispatched(id, judge)
+        dispatch_time.observe(time.monotonic() - start)
 
     def register(self, judge):
         with self.lock:
@@ -69,6 +191,9 @@ class JudgeList(object):
                     del self.submission_map[sub]
                 except KeyError:
                     pass
+                self.received.pop(sub, None)
+                if self.journal is not None:
+                    self.journal.free(sub)
             self.judges.discard(judge)
 
     def __iter__(self):
@@ -78,6 +203,9 @@ class JudgeList(object):
         with self.lock:
             logger.info('Judge available after grading %d: %s', submission, judge.name)
             del self.submission_map[submission]
+            self.received.pop(submission, None)
+            if self.journal is not None:
+                self.journal.free(submission)
             self._handle_free_judge(judge)
 
     def abort(self, submission):
@@ -87,38 +215,65 @@ class JudgeList(object):
                 self.submission_map[submission].abort()
                 return True
             except KeyError:
-                try:
-                    node = self.node_map[submission]
-                except KeyError:
-                    pass
-                else:
-                    self.queue.remove(node)
-                    del self.node_map[submission]
+                if submission in self.queue:
+                    self.queue.remove(submission)
+                    self.received.pop(submission, None)
+                    if self.journal is not None:
+                        self.journal.abort(submission)
                 return False
 
     def check_priority(self, priority):
         return 0 <= priority < self.priorities
 
-    def judge(self, id, problem, language, source, priority):
+    def judge(self, id, problem, language, source, priority, data=None):
+        start = time.monotonic()
         with self.lock:
-            if id in self.submission_map or id in self.node_map:
+            if id in self.submission_map or id in self.queue:
                 # Already judging, don't queue again. This can happen during batch rejudges, rejudges should be
                 # idempotent.
                 return
 
+            if id not in self.received:
+                self.received[id] = start
+                received_count.inc(priority)
+                if self.journal is not None:
+                    self.journal.enqueue(id, priority, problem, language)
+
             candidates = [judge for judge in self.judges if not judge.working and judge.can_judge(problem, language)]
             logger.info('Free judges: %d', len(candidates))
             if candidates:
-                # Schedule the submission on the judge reporting least load.
-                judge = min(candidates, key=attrgetter('load'))
+                judge = self._pick_judge(candidates, problem, language)
                 logger.info('Dispatched submission %d to: %s', id, judge.name)
                 self.submission_map[id] = judge
                 try:
-                    judge.submit(id, problem, language, source)
+                    judge.submit(id, problem, language, source, data)
+                except SubmissionVanished:
+                    del self.submission_map[id]
+                    self._forget(id)
+                    return
                 except Exception:
                     logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
                     self.judges.discard(judge)
-                    return self.judge(id, problem, language, source, priority)
+                    del self.submission_map[id]
+                    return self.judge(id, problem, language, source, priority, data)
+                self._dispatched(id, judge)
             else:
-                self.node_map[id] = self.queue.insert((id, problem, language, source), self.priority[priority])
+                self.queue.push(priority, id, problem, language, source, data)
                 logger.info('Queued submission: %d', id)
+        dispatch_time.observe(time.monotonic() - start)
+
+    def judge_batch(self, submissions, priority):
+        with self.lock:
+            free = [judge for judge in self.judges if not judge.working]
+            for id, problem, language, source, data in submissions:
+                if free:
+                    self.judge(id, problem, language, source, priority, data)
+                    free = [judge for judge in free if not judge.working]
+                elif id not in self.submission_map and id not in self.queue:
+                    # Every judge is busy, so there is no point looking for candidates.
+                    self.received[id] = time.monotonic()
+                    received_count.inc(priority)
+                    if self.journal is not None:
+                        self.journal.enqueue(id, priority, problem, language)
+                    self.queue.push(priority, id, problem, language, source, data)
+            logger.info('Queued batch of %d submissions', len(submissions))
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+logger = logging.getLogger('judge.bridge')
+
+# Once a codec is negotiated, every packet starts with one of these tags, saying how the rest of it is encoded.
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+LZ4 = 3
+
+
+class CodecError(Exception):
+    pass
+
+
+class Codec(object):
+    """Encodes the packets of one connection. Packets shorter than threshold are sent raw."""
+
+    name = None
+    tag = None
+
+    def __init__(self, threshold=0):
+        self.threshold = threshold
+        # Packets may be sent and received from different threads, and compression contexts are not thread-safe.
+        self._lock = threading.Lock()
+
+    def encode(self, data):
+        """Returns the packet for data as a (tag, body) pair of bytes-like objects."""
+        if len(data) < self.threshold:
+            return bytes((RAW,)), data
+        with self._lock:
+            return bytes((self.tag,)), self.compress(data)
+
+    def decode(self, data):
+        if not len(data):
+            raise CodecError('empty packet')
+        tag = data[0]
+        body = memoryview(data)[1:]
+        if tag == RAW:
+            return bytes(body)
+        if tag != self.tag:
+            raise CodecError('unexpected codec tag %d, expected %d (%s)' % (tag, self.tag, self.name))
+        with self._lock:
+            return self.decompress(body)
+
+    def compress(self, data):
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        raise NotImplementedError()
+
+
+class RawCodec(Codec):
+    name = 'none'
+    tag = RAW
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return bytes(data)
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+    tag = ZLIB
+
+    def __init__(self, threshold=0, level=zlib.Z_DEFAULT_COMPRESSION):
+        super().__init__(threshold)
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        try:
+            return zlib.decompress(data)
+        except zlib.error as e:
+            raise CodecError(str(e))
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    tag = ZSTD
+
+    def __init__(self, threshold=0, level=3, dictionary=None):
+        super().__init__(threshold)
+        dictionary = dictionary and zstandard.ZstdCompressionDict(dictionary)
+        self._compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        try:
+            return self._decompressor.decompress(data)
+        except zstandard.ZstdError as e:
+            raise CodecError(str(e))
+
+
+class Lz4Codec(Codec):
+    name = 'lz4'
+    tag = LZ4
+
+    def __init__(self, threshold=0, dictionary=None):
+        super().__init__(threshold)
+        self.dictionary = dictionary
+
+    def compress(self, data):
+        if self.dictionary:
+            return lz4.block.compress(data, dict=self.dictionary)
+        return lz4.block.compress(data)
+
+    def decompress(self, data):
+        try:
+            if self.dictionary:
+                return lz4.block.decompress(data, dict=self.dictionary)
+            return lz4.block.decompress(data)
+        except lz4.block.LZ4BlockError as e:
+            raise CodecError(str(e))
+
+
+def available_codecs():
+    codecs = ['none', 'zlib']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4 is not None:
+        codecs.append('lz4')
+    return codecs
+
+
+def dictionary_id(dictionary):
+    return hashlib.sha256(dictionary).hexdigest()[:16]
+
+
+_dictionaries = {}
+
+
+def load_dictionary(path):
+    """Reads a shared compression dictionary, returning (id, contents), or (None, None) if there is none."""
+    if not path:
+        return None, None
+    if path not in _dictionaries:
+        try:
+            with open(path, 'rb') as f:
+                dictionary = f.read()
+        except OSError:
+            logger.exception('Failed to read compression dictionary: %s', path)
+            _dictionaries[path] = None, None
+        else:
+            _dictionaries[path] = dictionary_id(dictionary), dictionary
+    return _dictionaries[path]
+
+
+def make_codec(name, threshold=0, zlib_level=zlib.Z_DEFAULT_COMPRESSION, zstd_level=3, dictionary=None):
+    if name == 'none':
+        return RawCodec()
+    elif name == 'zlib':
+        return ZlibCodec(threshold, zlib_level)
+    elif name == 'zstd' and zstandard is not None:
+        return ZstdCodec(threshold, zstd_level, dictionary)
+    elif name == 'lz4' and lz4 is not None:
+        return Lz4Codec(threshold, dictionary)
+    raise CodecError('unsupported codec: %s' % name)
+
+
+def negotiate(offered, preference, offered_dictionaries=(), dictionary_path=None, **kwargs):
+    """Picks the first codec in preference that the peer offered and is available here.
+
+    Returns (codec, dictionary id), where the dictionary id is None unless the peer has our shared dictionary, or
+    (None, None) if nothing in common was found, in which case the connection keeps the original zlib framing.
+    """
+    available = available_codecs()
+    for name in preference:
+        if name in offered and name in available:
+            id, dictionary = load_dictionary(dictionary_path) if name in ('zstd', 'lz4') else (None, None)
+            if id not in offered_dictionaries:
+                id, dictionary = None, None
+            return make_codec(name, dictionary=dictionary, **kwargs), id
+    return None, None
@@ -0,0 +1,123 @@
+import time
+from collections import Counter, defaultdict
+
+
+class QueuePolicy(object):
+    """Decides the order of the submissions waiting within one priority level of the SubmissionQueue.
+
+    Each submission is given a key when it is queued, and a free judge takes the submission with the smallest key
+    among those it can judge. Keys must be unique, which is what the sequence number of the submission is for.
+    """
+
+    name = None
+
+    def key(self, priority, queued):
+        raise NotImplementedError()
+
+    def removed(self, priority, queued, key, dispatched):
+        """Called once a submission leaves the queue, because it was sent to a judge or aborted."""
+
+
+class FIFOPolicy(QueuePolicy):
+    name = 'fifo'
+
+    def key(self, priority, queued):
+        return queued.sequence
+
+
+class FairSharePolicy(QueuePolicy):
+    """Start-time fair queuing between flows: contests, and users outside of contests.
+
+    Every flow has a virtual clock that advances by the cost of each submission queued in it, divided by the weight
+    of the flow. A submission is tagged with the later of its flow's clock and the virtual time of the priority level,
+    which is the tag of the last submission dispatched from it, and submissions are served in tag order. A user
+    queueing a hundred submissions then only delays everyone else's by one submission each, instead of a hundred,
+    and a flow that was idle rejoins at the current virtual time, without credit for the time it spent idle.
+
+    Submissions in a contest are grouped by contest rather than by user, so that a busy contest cannot crowd out the
+    others in the contest priority tier, while participants of the same contest are still served in order.
+    """
+
+    name = 'fair'
+
+    def __init__(self, weights=None, costs=None):
+        # flow: weight, e.g. {('contest', 5): 2} to give contest 5 twice the share of any other flow.
+        self.weights = weights or {}
+        # With a GradingCostModel, flows share judge time rather than a number of submissions.
+        self.costs = costs
+        self._virtual_time = defaultdict(float)  # priority: tag of the last dispatched submission
+        self._finish = defaultdict(dict)  # priority: {flow: virtual time its next submission starts at}
+        self._queued = defaultdict(Counter)  # priority: {flow: number of submissions queued}
+
+    def flow(self, queued):
+        data = queued.data
+        if data is None:
+            return None
+        if data.contest_id is not None:
+            return 'contest', data.contest_id
+        return 'user', data.user_id
+
+    def cost(self, queued):
+        if self.costs is None:
+            return 1.0
+        return self.costs.estimate(queued.problem, queued.language) / self.costs.typical()
+
+    def key(self, priority, queued):
+        flow = self.flow(queued)
+        finish = self._finish[priority]
+        start = max(self._virtual_time[priority], finish.get(flow, 0.0))
+        finish[flow] = start + self.cost(queued) / self.weights.get(flow, 1)
+        self._queued[priority][flow] += 1
+        return start, queued.sequence
+
+    def removed(self, priority, queued, key, dispatched):
+        flow = self.flow(queued)
+        if dispatched and key[0] > self._virtual_time[priority]:
+            self._virtual_time[priority] = key[0]
+
+        queued_flows = self._queued[priority]
+        queued_flows[flow] -= 1
+        if queued_flows[flow] <= 0:
+            del queued_flows[flow]
+
+        # Forget flows with nothing queued once the virtual time has caught up with them, since they would start
+        # at the virtual time anyway. Flows that went idle while ahead are swept once they have piled up.
+        finish = self._finish[priority]
+        virtual_time = self._virtual_time[priority]
+        if flow not in queued_flows and finish.get(flow, 0.0) <= virtual_time:
+            finish.pop(flow, None)
+        if len(finish) > 2 * len(queued_flows) + 64:
+            for idle in [idle for idle, tag in finish.items() if idle not in queued_flows and tag <= virtual_time]:
+                del finish[idle]
+
+
+class ShortestJobPolicy(QueuePolicy):
+    """Shortest job first, by the estimated grading time, with aging.
+
+    A submission is keyed by the time it was queued plus aging times its estimated cost in seconds, so a cheap
+    submission overtakes an expensive one that arrived up to aging times their difference in cost earlier, and no
+    submission waits on cheaper ones arriving more than aging times its own cost after it.
+    """
+
+    name = 'sjf'
+
+    def __init__(self, costs, aging=10.0, clock=time.monotonic):
+        self.costs = costs
+        self.aging = aging
+        self.clock = clock
+
+    def key(self, priority, queued):
+        return self.clock() + self.aging * self.costs.estimate(queued.problem, queued.language), queued.sequence
+
+
+POLICIES = ('fifo', 'fair', 'sjf')
+
+
+def make_policy(name, costs=None, aging=10.0, clock=time.monotonic):
+    if name == 'fifo':
+        return FIFOPolicy()
+    elif name == 'fair':
+        return FairSharePolicy(costs=costs)
+    elif name == 'sjf' and costs is not None:
+        return ShortestJobPolicy(costs, aging, clock)
+    raise ValueError('unknown queue policy: %s' % name)
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+from django.db import IntegrityError
+
+from judge.models import Judge, Language, Problem, RuntimeVersion
+
+logger = logging.getLogger('judge.bridge')
+
+BATCH_SIZE = 1000
+
+
+class CodeIdCache(object):
+    """Maps the codes judges report, like problem codes, to primary keys, shared by every judge connection.
+
+    Codes that are not in the map are looked up as they come, and the whole map is reloaded once it is older than
+    ttl seconds, so renamed and deleted rows are eventually noticed. A code that does not exist is looked up again
+    every time it is asked for, which judges only do when their problem list changes.
+    """
+
+    def __init__(self, model, field, ttl=300):
+        self.model = model
+        self.field = field
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._loaded = None
+
+    def _query(self, **filters):
+        return dict(self.model.objects.filter(**filters).values_list(self.field, 'id'))
+
+    def get(self, codes):
+        """Returns {code: id} for the codes that exist."""
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._loaded > self.ttl:
+                self._ids = self._query()
+                self._loaded = time.monotonic()
+            result = {code: self._ids[code] for code in codes if code in self._ids}
+        missing = [code for code in codes if code not in result]
+
+        if missing:
+            found = {}
+            for i in range(0, len(missing), BATCH_SIZE):
+                found.update(self._query(**{self.field + '__in': missing[i:i + BATCH_SIZE]}))
+            with self._lock:
+                self._ids.update(found)
+            result.update(found)
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = None
+
+
+problem_ids = CodeIdCache(Problem, 'code')
+language_ids = CodeIdCache(Language, 'key')
+
+
+def sync_m2m(relation, instance_id, desired, current=None):
+    """Makes the ids related to instance_id through the many-to-many relation (e.g. Judge.problems) exactly desired,
+    by deleting and inserting only the rows that differ.
+
+    current is the set of related ids, if known from the last sync; otherwise it is read from the database. Returns
+    desired, to be passed as current next time.
+    """
+    through = relation.through
+    source = relation.field.m2m_field_name() + '_id'
+    target = relation.field.m2m_reverse_field_name() + '_id'
+    if current is None:
+        current = set(through.objects.filter(**{source: instance_id}).values_list(target, flat=True))
+
+    removed = list(current - desired)
+    added = list(desired - current)
+    for i in range(0, len(removed), BATCH_SIZE):
+        through.objects.filter(**{source: instance_id, target + '__in': removed[i:i + BATCH_SIZE]}).delete()
+    # Conflicts are ignored in case a previous connection of the judge is still syncing.
+    through.objects.bulk_create([through(**{source: instance_id, target: id}) for id in added],
+                                batch_size=BATCH_SIZE, ignore_conflicts=True)
+    if removed or added:
+        logger.info('Updated %s of judge %d: %d added, %d removed', relation.field.name, instance_id,
+                    len(added), len(removed))
+    return set(desired)
+
+
+def sync_problems(judge, codes, current=None):
+    try:
+        return sync_m2m(Judge.problems, judge.id, set(problem_ids.get(codes).values()), current)
+    except IntegrityError:
+        # A problem was deleted since we last loaded the map.
+        problem_ids.invalidate()
+        return sync_m2m(Judge.problems, judge.id, set(problem_ids.get(codes).values()))
+
+
+def sync_runtimes(judge, executors):
+    """Registers the languages a judge supports, and the versions of its runtimes for each of them."""
+    languages = language_ids.get(list(executors))
+    sync_m2m(Judge.runtimes, judge.id, set(languages.values()))
+
+    desired = {(languages[key], name, '.'.join(map(str, version)), priority)
+               for key, runtimes in executors.items() if key in languages
+               for priority, (name, version) in enumerate(runtimes)}
+    existing = {}
+    for id, *version in (RuntimeVersion.objects.filter(judge_id=judge.id)
+                         .values_list('id', 'language_id', 'name', 'version', 'priority')):
+        if tuple(version) in desired and tuple(version) not in existing:
+            existing[tuple(version)] = id
+
+    # Anything else, like the versions a crashed connection left behind, goes.
+    RuntimeVersion.objects.filter(judge_id=judge.id).exclude(id__in=list(existing.values())).delete()
+    RuntimeVersion.objects.bulk_create([
+        RuntimeVersion(judge_id=judge.id, language_id=language, name=name, version=version, priority=priority)
+        for language, name, version, priority in desired - existing.keys()
+    ])
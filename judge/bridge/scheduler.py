@@ -0,0 +1,94 @@
+import heapq
+import logging
+import threading
+import time
+from itertools import count
+
+logger = logging.getLogger('judge.bridge')
+
+
+class ScheduledCall(object):
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """Runs delayed calls for every connection of the bridge from a single thread.
+
+    Calls are kept in a heap ordered by deadline. Cancelling only marks a call, which is dropped once it reaches the
+    top of the heap; every call the bridge makes expires within seconds, so the heap stays around a few entries per
+    judge. Calls run on the scheduler thread, so they must not block for long.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = count()
+        self._cond = threading.Condition(threading.Lock())
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def call_later(self, delay, func, *args):
+        call = ScheduledCall(time.monotonic() + delay, func, args)
+        with self._cond:
+            heapq.heappush(self._heap, (call.when, next(self._sequence), call))
+            if self._heap[0][2] is call:
+                self._cond.notify()
+        return call
+
+    def call_every(self, interval, func, *args, first=0):
+        """Calls func every interval seconds, until func returns False or raises. Returns a handle to cancel the
+        next call, which stays valid across repetitions."""
+        handle = ScheduledCall(None, func, args)
+
+        def repeat():
+            if handle.cancelled:
+                return
+            try:
+                again = func(*args)
+            except Exception:
+                logger.exception('Error in repeated call: %r', func)
+                return
+            if again is not False and not handle.cancelled:
+                self.call_later(interval, repeat)
+
+        self.call_later(first, repeat)
+        return handle
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    when, _, call = self._heap[0]
+                    if call.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = when - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(delay)
+                else:
+                    return
+
+            try:
+                call.func(*call.args)
+            except Exception:
+                logger.exception('Error in scheduled call: %r', call.func)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
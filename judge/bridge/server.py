@@ -1,6 +1,15 @@
+import asyncio
+import logging
+import socket
 import threading
+import zlib
 from socketserver import TCPServer, ThreadingMixIn
 
+from judge.bridge.base_handler import Disconnect
+from judge.bridge.packet_codecs import CodecError
+
+logger = logging.getLogger('judge.bridge')
+
 
 class ThreadingTCPListener(ThreadingMixIn, TCPServer):
     allow_reuse_address = True
@@ -28,3 +37,189 @@ class Server:
         for server in self.servers:
             server.shutdown()
         self._shutdown.set()
+
+
+class AsyncRequest:
+    """Stands in for the socket of a ZlibPacketHandler served by an AsyncServer.
+
+    Handlers run in executor threads, so everything touching the transport is handed to the event loop.
+    """
+
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self._loop = protocol.loop
+        self._timeout = None
+
+    def gettimeout(self):
+        return self._timeout
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+        self._loop.call_soon_threadsafe(self._protocol.reset_timeout)
+
+    def sendall(self, data):
+        if self._protocol.transport.is_closing():
+            raise BrokenPipeError('connection closed')
+        self._loop.call_soon_threadsafe(self._protocol.transport.write, data)
+
+    def sendmsg(self, buffers):
+        if self._protocol.transport.is_closing():
+            raise BrokenPipeError('connection closed')
+        self._loop.call_soon_threadsafe(self._protocol.transport.writelines, buffers)
+        return sum(map(len, buffers))
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        self._loop.call_soon_threadsafe(self._protocol.transport.close)
+
+
+class PacketProtocol(asyncio.Protocol):
+    # Stop reading from a client that has this many packets waiting for an executor thread.
+    max_pending = 64
+
+    def __init__(self, listener, handler):
+        self.listener = listener
+        self.loop = listener.loop
+        self.handler_factory = handler
+        self.transport = None
+        self.handler = None
+        self._buffer = bytearray()
+        self._queue = asyncio.Queue()
+        self._paused = False
+        self._closed = False
+        self._timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.handler = self.handler_factory(AsyncRequest(self), transport.get_extra_info('peername'), self.listener)
+        self.reset_timeout()
+        self._queue.put_nowait((self.handler.on_connect,))
+        self.loop.create_task(self._dispatch())
+
+    def data_received(self, data):
+        if self._closed:
+            return
+
+        self.reset_timeout()
+        self._buffer += data
+        try:
+            for packet in self.handler.extract_packets(self._buffer):
+                self._queue.put_nowait((self.handler._on_packet, packet))
+        except Disconnect:
+            self._close()
+            return
+
+        if not self._paused and self._queue.qsize() >= self.max_pending:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._cancel_timeout()
+        self._queue.put_nowait((self.handler.on_disconnect,))
+        self._queue.put_nowait(None)
+
+    def reset_timeout(self):
+        self._cancel_timeout()
+        timeout = self.handler.timeout
+        if timeout and not self._closed:
+            self._timer = self.loop.call_later(timeout, self._timed_out)
+
+    def _cancel_timeout(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timed_out(self):
+        self._timer = None
+        if self.handler._got_packet:
+            logger.info('Socket timed out: %s', self.handler.client_address)
+            self._queue.put_nowait((self.handler.on_timeout,))
+        else:
+            logger.info('Potentially wrong protocol: %s: %r', self.handler.client_address, self.handler._initial_tag)
+        self._close()
+
+    def _close(self):
+        # Packets still waiting are dropped, just like the threaded server stops reading after a disconnect.
+        self._closed = True
+        self._cancel_timeout()
+        self.transport.close()
+
+    async def _dispatch(self):
+        handler = self.handler
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            func, *args = item
+            if self._closed and func == handler._on_packet:
+                continue
+
+            try:
+                await self.loop.run_in_executor(self.listener.executor, func, *args)
+            except (Disconnect, ConnectionError):
+                self._close()
+            except (zlib.error, CodecError):
+                if handler._got_packet:
+                    logger.warning('Encountered zlib error during packet handling, disconnecting client: %s',
+                                   handler.client_address, exc_info=True)
+                else:
+                    logger.info('Potentially wrong protocol (zlib error): %s: %r', handler.client_address,
+                                handler._initial_tag, exc_info=True)
+                self._close()
+            except Exception:
+                logger.exception('Error in base packet handling')
+                self._close()
+
+            if self._paused and self._queue.qsize() < self.max_pending // 2 and not self._closed:
+                self._paused = False
+                self.transport.resume_reading()
+
+
+class AsyncListener:
+    event_driven = True
+
+    def __init__(self, server, address):
+        self.loop = server.loop
+        self.executor = server.executor
+        self.server_address = address
+
+
+class AsyncServer:
+    """Event loop based drop-in replacement for Server.
+
+    All connections are multiplexed on a single event loop thread, while packet handling, which touches the ORM,
+    runs on a bounded executor. Packets from the same connection are always handled one at a time, in order.
+    """
+
+    def __init__(self, addresses, handler, executor):
+        self.addresses = addresses
+        self.handler = handler
+        self.executor = executor
+        self.loop = asyncio.new_event_loop()
+        self._servers = []
+
+    async def _start(self):
+        for address in self.addresses:
+            listener = AsyncListener(self, address)
+            self._servers.append(await self.loop.create_server(
+                lambda listener=listener: PacketProtocol(listener, self.handler), *address, reuse_address=True,
+            ))
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._start())
+            self.loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(asyncio.gather(*(server.wait_closed() for server in self._servers)))
+            self.loop.close()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
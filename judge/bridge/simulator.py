@@ -0,0 +1,167 @@
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from judge.bridge.packet_codecs import dictionary_id, make_codec
+
+logger = logging.getLogger('judge.bridge')
+
+size_pack = struct.Struct('!I')
+
+
+class SimulatedJudge(object):
+    """A judge that speaks the full JudgeHandler protocol, but grades instantly without running anything.
+
+    Every submission is acknowledged, begins grading, reports `cases` accepted test cases in packets of
+    `cases_per_packet`, sleeping `case_delay` seconds between packets, and then ends grading. The monotonic time at
+    which each submission was received and finished is recorded in `received` and `finished`. If `codecs` is given,
+    they are offered to the bridge in the handshake, along with `dictionary` if any. Packets are handled
+    one at a time, so like a real judge, abort requests are only seen once grading is over, and then ignored.
+    """
+
+    def __init__(self, address, name, key, problems, executors, cases=10, cases_per_packet=1, case_delay=0.0,
+                 batch_size=0, codecs=None, dictionary=None, codec_threshold=256):
+        self.address = address
+        self.name = name
+        self.key = key
+        self.problems = problems
+        self.executors = executors
+        self.cases = cases
+        self.cases_per_packet = max(1, cases_per_packet)
+        self.case_delay = case_delay
+        self.batch_size = batch_size
+        self.codecs = codecs
+        self.dictionary = dictionary
+        self.codec_threshold = codec_threshold
+        self.codec = None
+
+        self.received = {}
+        self.finished = {}
+        self.packets_sent = 0
+        self.bytes_sent = 0
+
+        self._sock = None
+        self._reader = None
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self.ready = threading.Event()
+        self.closed = threading.Event()
+
+    def send(self, packet):
+        data = json.dumps(packet, separators=(',', ':')).encode('utf-8')
+        if self.codec is None:
+            data = zlib.compress(data)
+        else:
+            tag, body = self.codec.encode(data)
+            data = tag + body
+        with self._send_lock:
+            self._sock.sendall(size_pack.pack(len(data)) + data)
+            self.packets_sent += 1
+            self.bytes_sent += size_pack.size + len(data)
+
+    def read(self):
+        header = self._reader.read(size_pack.size)
+        if len(header) < size_pack.size:
+            raise EOFError()
+        size = size_pack.unpack(header)[0]
+        data = self._reader.read(size)
+        if len(data) < size:
+            raise EOFError()
+        return json.loads(zlib.decompress(data) if self.codec is None else self.codec.decode(data))
+
+    def connect(self):
+        self._sock = socket.create_connection(self.address)
+        self._reader = self._sock.makefile('rb')
+        handshake = {
+            'name': 'handshake',
+            'id': self.name,
+            'key': self.key,
+            'problems': [[problem, 0] for problem in self.problems],
+            'executors': self.executors,
+        }
+        if self.codecs:
+            handshake['codecs'] = self.codecs
+            handshake['codec-dictionaries'] = [dictionary_id(self.dictionary)] if self.dictionary else []
+        self.send(handshake)
+
+        reply = self.read()
+        if reply['name'] != 'handshake-success':
+            raise ValueError('%s: handshake failed: %r' % (self.name, reply))
+        if reply.get('codec'):
+            self.codec = make_codec(reply['codec'], self.codec_threshold,
+                                    dictionary=self.dictionary if reply.get('codec-dictionary') else None)
+        self.ready.set()
+
+    def start(self):
+        self.connect()
+        self._thread = threading.Thread(target=self.run, name='judge-%s' % self.name, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+    def run(self):
+        try:
+            while True:
+                packet = self.read()
+                name = packet['name']
+                if name == 'ping':
+                    self.send({'name': 'ping-response', 'when': packet['when'], 'time': time.time(), 'load': 0.0})
+                elif name == 'submission-request':
+                    self.grade(packet)
+                elif name == 'disconnect':
+                    break
+        except (EOFError, OSError):
+            pass
+        except Exception:
+            logger.exception('Simulated judge failed: %s', self.name)
+        finally:
+            self.closed.set()
+            self.close()
+
+    def grade(self, packet):
+        id = packet['submission-id']
+        self.received[id] = time.monotonic()
+
+        self.send({'name': 'submission-acknowledged', 'submission-id': id})
+        self.send({'name': 'grading-begin', 'submission-id': id, 'pretested': False})
+
+        position = 1
+        while position <= self.cases:
+            cases = []
+            for position in range(position, min(position + self.cases_per_packet, self.cases + 1)):
+                if self.batch_size and (position - 1) % self.batch_size == 0:
+                    self._send_cases(id, cases)
+                    cases = []
+                    self.send({'name': 'batch-begin', 'submission-id': id})
+                cases.append({
+                    'position': position, 'status': 0, 'time': 0.01, 'memory': 1024,
+                    'points': 1, 'total-points': 1, 'output': '', 'feedback': '',
+                })
+                if self.batch_size and position % self.batch_size == 0:
+                    self._send_cases(id, cases)
+                    cases = []
+                    self.send({'name': 'batch-end', 'submission-id': id})
+            self._send_cases(id, cases)
+            position += 1
+
+            if self.case_delay:
+                time.sleep(self.case_delay)
+
+        if self.batch_size and self.cases % self.batch_size:
+            self.send({'name': 'batch-end', 'submission-id': id})
+        self.send({'name': 'grading-end', 'submission-id': id})
+        self.finished[id] = time.monotonic()
+
+    def _send_cases(self, id, cases):
+        if cases:
+            self.send({'name': 'test-case-status', 'submission-id': id, 'cases': cases})
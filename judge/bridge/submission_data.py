@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+
+from django import db
+from django.db.models import Count
+
+from judge.models import LanguageLimit, Submission
+
+logger = logging.getLogger('judge.bridge')
+
+SubmissionData = namedtuple('SubmissionData',
+                            'time memory short_circuit pretests_only contest_no attempt_no user_id contest_id')
+
+
+def ensure_connection():
+    try:
+        db.connection.cursor().execute('SELECT 1').fetchall()
+    except Exception:
+        db.connection.close()
+
+
+class SubmissionVanished(Exception):
+    """Raised when a submission is dispatched after it was deleted, so there is nothing to judge."""
+
+
+class LanguageLimitCache(object):
+    """LRU of the language-specific resource limits of recently judged problems.
+
+    Entries are dropped through invalidate() when a Problem or LanguageLimit is saved, which the site reports to
+    the bridge with an invalidate-limits packet.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._lock = threading.Lock()
+        self._problems = OrderedDict()
+        self._generation = 0
+
+    def get(self, problem_id, language_id):
+        with self._lock:
+            limits = self._problems.get(problem_id)
+            if limits is not None:
+                self._problems.move_to_end(problem_id)
+            generation = self._generation
+
+        if limits is None:
+            limits = {language: (time, memory) for language, time, memory in
+                      LanguageLimit.objects.filter(problem_id=problem_id)
+                                           .values_list('language_id', 'time_limit', 'memory_limit')}
+            with self._lock:
+                # Don't cache what we read if it might have been invalidated in the meantime.
+                if generation != self._generation:
+                    return limits.get(language_id)
+                self._problems[problem_id] = limits
+                while len(self._problems) > self.size:
+                    self._problems.popitem(last=False)
+        return limits.get(language_id)
+
+    def invalidate(self, problem_id=None):
+        with self._lock:
+            self._generation += 1
+            if problem_id is None:
+                self._problems.clear()
+            else:
+                self._problems.pop(problem_id, None)
+
+
+language_limits = LanguageLimitCache()
+
+
+def get_submission_data(submission):
+    """Gathers what a judge needs besides the source to grade a submission, or None if it no longer exists.
+
+    This runs when a submission is enqueued, before the JudgeList lock is taken.
+    """
+    return get_submissions_data([submission]).get(submission)
+
+
+def get_submissions_data(submissions):
+    """Gathers what get_submission_data does for many submissions at once, returning a dict from the ids of those
+    that still exist to their SubmissionData.
+
+    The database connection is checked once, and everything is read with two queries, whatever the number of
+    submissions.
+    """
+    ensure_connection()
+
+    rows = list(Submission.objects.filter(id__in=submissions)
+                .values_list('id', 'problem__id', 'problem__time_limit', 'problem__memory_limit',
+                             'problem__short_circuit', 'language__id', 'is_pretested', 'date', 'user__id',
+                             'contest__participation__virtual', 'contest__participation__id',
+                             'contest__participation__contest_id'))
+    for submission in set(submissions) - {row[0] for row in rows}:
+        logger.error('Submission vanished: %s', submission)
+    if not rows:
+        return {}
+
+    # The attempt number counts the earlier submissions of the same user to the same problem, in the same
+    # participation, which are read grouped by date for all of the submissions.
+    keys = {(row[1], row[8], row[10]) for row in rows}
+    counts = (Submission.objects.filter(problem__id__in={pid for pid, _, _ in keys},
+                                        user__id__in={uid for _, uid, _ in keys},
+                                        date__lt=max(row[7] for row in rows))
+                                .exclude(status__in=('CE', 'IE'))
+                                .values_list('problem__id', 'user__id', 'contest__participation__id', 'date')
+                                .annotate(count=Count('id')).order_by())
+    earlier = defaultdict(list)
+    for pid, uid, part_id, date, count in counts:
+        # Other pairs of the problems and users in the batch are read too, and skipped here.
+        if (pid, uid, part_id) in keys:
+            earlier[pid, uid, part_id].append((date, count))
+
+    data = {}
+    for id, pid, time, memory, short_circuit, lid, is_pretested, sub_date, uid, part_virtual, part_id, contest_id in \
+            rows:
+        limits = language_limits.get(pid, lid)
+        if limits is not None:
+            time, memory = limits
+
+        data[id] = SubmissionData(
+            time=time,
+            memory=memory,
+            short_circuit=short_circuit,
+            pretests_only=is_pretested,
+            contest_no=part_virtual,
+            attempt_no=sum(count for date, count in earlier[pid, uid, part_id] if date < sub_date) + 1,
+            user_id=uid,
+            contest_id=contest_id,
+        )
+    return data
@@ -1,4 +1,13 @@
+import pickle
+import time
+import zlib
+
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+
+# How long one request may spend building a contest ranking before others give up waiting and build it themselves.
+CONTEST_RANKING_BUILD_TIMEOUT = 30
 
 
 def finished_submission(sub):
@@ -8,3 +17,79 @@ def finished_submission(sub):
         keys += ['contest_complete:%d' % participation.id]
         keys += ['contest_attempted:%d' % participation.id]
     cache.delete_many(keys)
+
+
+def invalidate_contest_ranking(contest_id):
+    # Readers could otherwise rebuild the ranking from the old results, and store it as up to date, before these are
+    # committed.
+    transaction.on_commit(lambda: cache.set('contest_ranking_version:%d' % contest_id, time.time(), None))
+
+
+def next_contest_ranking_update(contest_id):
+    """
+    Numbers an update posted to the ranking of a contest.
+
+    Numbers increase by one per update, so that clients can tell when they missed some. The first number is the
+    current time in milliseconds, so that they still increase if the cache loses the count.
+    """
+    key = 'contest_ranking_update:%d' % contest_id
+    try:
+        return cache.incr(key)
+    except ValueError:
+        _last_contest_ranking_update(key)
+        return cache.incr(key)
+
+
+def _last_contest_ranking_update(key, update=None):
+    if update is None:
+        cache.add(key, int(time.time() * 1000), None)
+        update = cache.get(key)
+    return update
+
+
+def get_contest_ranking(contest_id, build):
+    """
+    Returns the cached full ranking of a contest, calling build() to make it if there is none, along with the number
+    of the last update posted before it was built, which it includes.
+
+    After the ranking is invalidated, the cached one is still returned until it is DMOJ_CONTEST_RANKING_DEBOUNCE
+    seconds old, and then rebuilt by a single request, while the others keep getting the old one.
+    """
+    update_key = 'contest_ranking_update:%d' % contest_id
+    debounce = settings.DMOJ_CONTEST_RANKING_DEBOUNCE
+    if debounce is None:
+        return _last_contest_ranking_update(update_key), build()
+
+    version_key = 'contest_ranking_version:%d' % contest_id
+    ranking_key = 'contest_ranking_v2:%d' % contest_id
+    lock_key = 'contest_ranking_lock:%d' % contest_id
+
+    # The update number is read before the ranking is built, so that it only counts updates the ranking includes.
+    values = cache.get_many([version_key, ranking_key, update_key])
+    version = values.get(version_key)
+    update = _last_contest_ranking_update(update_key, values.get(update_key))
+    cached = values.get(ranking_key)
+    if cached is not None:
+        built, built_version, built_update, ranking = cached
+        if built_version == version or time.time() < built + debounce or \
+                not cache.add(lock_key, True, CONTEST_RANKING_BUILD_TIMEOUT):
+            return built_update, pickle.loads(zlib.decompress(ranking))
+    elif not cache.add(lock_key, True, CONTEST_RANKING_BUILD_TIMEOUT):
+        # Another request is building the ranking, which is probably cheaper to wait for than to build again.
+        deadline = time.time() + CONTEST_RANKING_BUILD_TIMEOUT
+        while time.time() < deadline and cache.get(lock_key) is not None:
+            time.sleep(0.1)
+            cached = cache.get(ranking_key)
+            if cached is not None:
+                return cached[2], pickle.loads(zlib.decompress(cached[3]))
+        return update, build()
+
+    try:
+        built = time.time()
+        ranking = build()
+        # Rankings of large contests compress well, and would otherwise not fit in a memcached item.
+        cache.set(ranking_key, (built, version, update, zlib.compress(pickle.dumps(ranking, pickle.HIGHEST_PROTOCOL))),
+                  settings.DMOJ_CONTEST_RANKING_CACHE_TTL)
+    finally:
+        cache.delete(lock_key)
+    return update, ranking
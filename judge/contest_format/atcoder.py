@@ -89,12 +89,87 @@ class AtCoderContestFormat(DefaultContestFormat):
                 format_data[str(prob)] = {'time': dt, 'points': score, 'penalty': prev}
                 points += score
 
+        self.mark_counted(format_data, participation.submissions.values_list('problem_id', 'submission_id'))
         participation.cumtime = cumtime + penalty
         participation.score = points
         participation.tiebreaker = 0
         participation.format_data = format_data
         participation.save()
 
+    def compute_results(self, participation, submissions):
+        format_data = {}
+        counted = {}
+        for submission in submissions:
+            key = str(submission.problem_id)
+            # An IE can have a submission result of `None`
+            counted[key] = counted.get(key, 0) + (submission.result not in (None, 'IE', 'CE'))
+            if key not in format_data or submission.points > format_data[key]['points']:
+                format_data[key] = {'time': (submission.date - participation.start).total_seconds(),
+                                    'points': submission.points, 'penalty': counted[key] - 1}
+
+        cumtime = 0
+        penalty = 0
+        points = 0
+        for key, data in format_data.items():
+            if not self.config['penalty']:
+                data['penalty'] = 0
+            elif not data['points']:
+                # We should always display the penalty, even if the user has a score of 0
+                data['penalty'] = counted[key]
+
+            if data['points']:
+                cumtime = max(cumtime, data['time'])
+                penalty += data['penalty'] * self.config['penalty'] * 60
+            points += data['points']
+
+        participation.cumtime = cumtime + penalty
+        participation.score = points
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+
+    def apply_submission(self, participation, contest_submission):
+        format_data = participation.format_data or {}
+        previous = format_data.get(str(contest_submission.problem_id))
+        if previous and 'penalty' not in previous:
+            return False
+
+        score = contest_submission.points
+        dt = (contest_submission.submission.date - participation.start).total_seconds()
+        # An IE can have a submission result of `None`
+        counted = int(bool(self.config['penalty']) and
+                      contest_submission.submission.result not in (None, 'IE', 'CE'))
+
+        if not previous:
+            format_data[str(contest_submission.problem_id)] = {
+                'time': dt, 'points': score, 'penalty': 0 if score else counted,
+            }
+        elif score > previous['points']:
+            if previous['points'] and self.config['penalty']:
+                # We don't know how many of the penalized submissions were made after the previous best.
+                return False
+            # Before the first points, every submission was penalized, and this one is not.
+            previous.update({'time': dt, 'points': score})
+        elif not score and not previous['points']:
+            previous['penalty'] += counted
+
+        self.mark_counted(format_data, [(contest_submission.problem_id, contest_submission.submission_id)])
+
+        cumtime = 0
+        penalty = 0
+        points = 0
+        for data in format_data.values():
+            if data['points']:
+                cumtime = max(cumtime, data['time'])
+                penalty += data['penalty'] * self.config['penalty'] * 60
+            points += data['points']
+
+        participation.cumtime = cumtime + penalty
+        participation.score = points
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+        participation.save()
+        return True
+
     def display_user_problem(self, participation, contest_problem):
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
         if format_data:
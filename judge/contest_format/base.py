@@ -1,7 +1,11 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
+from collections import namedtuple
 
 from django.utils import six
 
+# The fields of a contest submission that the built-in formats compute results from.
+SubmissionResult = namedtuple('SubmissionResult', 'problem_id problem_points points date result submission_id')
+
 
 class abstractclassmethod(classmethod):
     __isabstractmethod__ = True
@@ -41,13 +45,52 @@ class BaseContestFormat(six.with_metaclass(ABCMeta)):
     def update_participation(self, participation):
         """
         Updates a ContestParticipation object's score, cumtime, and format_data fields based on this contest format.
-        Implementations should call ContestParticipation.save().
+        Implementations should record the submissions they read in format_data with mark_counted, and call
+        ContestParticipation.save().
 
         :param participation: A ContestParticipation object.
         :return: None
         """
         raise NotImplementedError()
 
+    def apply_submission(self, participation, contest_submission):
+        """
+        Updates a ContestParticipation object's score, cumtime, tiebreaker, and format_data fields with the result of
+        a single newly judged submission, instead of looking at all of the participant's submissions again. The
+        result must agree with what update_participation would compute. Implementations should call
+        ContestParticipation.save() if they return True.
+
+        This is an optional optimization. Formats that can't fold in a result, e.g. because it lowers a score, should
+        return False, and update_participation is used instead. Implementations should record the submission in
+        format_data with mark_counted, as update_participation must do for all of the submissions it reads.
+
+        :param participation: A ContestParticipation object, with the results of all previously judged submissions.
+        :param contest_submission: The ContestSubmission object that was just judged, the first time, which is_counted
+                                   says the results don't include yet.
+        :return: Whether the participation was updated.
+        """
+        return False
+
+    def update_participations(self, participations, progress=None):
+        """
+        Updates the results of many ContestParticipation objects of this contest, as update_participation does for
+        each of them, and marks disqualified participations as recompute_results does. Formats can override this to
+        compute all of the results from a few set-based queries.
+
+        :param participations: A queryset of ContestParticipation objects of this contest.
+        :param progress: A Progress object to advance as participations are updated, or None.
+        :return: The number of participations updated.
+        """
+        updated = 0
+        for participation in participations.iterator():
+            participation.recompute_results()
+            updated += 1
+            if progress is not None and updated % 10 == 0:
+                progress.did(10)
+        if progress is not None:
+            progress.did(updated % 10)
+        return updated
+
     @abstractmethod
     def display_user_problem(self, participation, contest_problem):
         """
@@ -98,3 +141,29 @@ class BaseContestFormat(six.with_metaclass(ABCMeta)):
         if points == total:
             return 'full-score'
         return 'partial-score'
+
+    @staticmethod
+    def mark_counted(format_data, submissions):
+        """
+        Records in format_data the latest submission to each problem that the results were computed from.
+
+        :param format_data: The format_data of a participation, with an entry for each problem that has results.
+        :param submissions: (problem_id, submission_id) pairs for the submissions the results were computed from.
+        :return: None
+        """
+        for problem_id, submission_id in submissions:
+            data = format_data.get(str(problem_id))
+            if data is not None and submission_id > data.get('last_submission', 0):
+                data['last_submission'] = submission_id
+
+    @classmethod
+    def is_counted(cls, participation, contest_submission):
+        """
+        Returns whether the results of a participation may already include contest_submission, e.g. because they were
+        recomputed after it was judged, or because a later submission to the same problem was added first. Adding it
+        again would count it twice, or out of order.
+        """
+        data = (participation.format_data or {}).get(str(contest_submission.problem_id))
+        # Results stored before submissions were recorded in them can't tell.
+        return data is not None and \
+            data.get('last_submission', contest_submission.submission_id) >= contest_submission.submission_id
@@ -1,4 +1,6 @@
 from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
 
 from django.core.exceptions import ValidationError
 from django.db.models import Max
@@ -8,10 +10,13 @@ from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy
 
-from judge.contest_format.base import BaseContestFormat
+from judge.caching import invalidate_contest_ranking
+from judge.contest_format.base import BaseContestFormat, SubmissionResult
 from judge.contest_format.registry import register_contest_format
 from judge.utils.timedelta import nice_repr
 
+BULK_UPDATE_CHUNK_SIZE = 1000
+
 
 @register_contest_format('default')
 class DefaultContestFormat(BaseContestFormat):
@@ -39,12 +44,100 @@ class DefaultContestFormat(BaseContestFormat):
             format_data[str(result['problem_id'])] = {'time': dt, 'points': result['points']}
             points += result['points']
 
+        # Read after the results, so that it covers at least the submissions they were computed from.
+        self.mark_counted(format_data, participation.submissions.values_list('problem_id', 'submission_id'))
         participation.cumtime = max(cumtime, 0)
         participation.score = points
         participation.tiebreaker = 0
         participation.format_data = format_data
         participation.save()
 
+    def update_participations(self, participations, progress=None):
+        # The submissions of all of the participations are read with one query, and the results computed from them
+        # are saved in chunks.
+        from judge.models import ContestSubmission
+
+        rows = (ContestSubmission.objects.filter(participation__in=participations.values('id'))
+                .order_by('participation_id', 'submission__date', 'id')
+                .values_list('participation_id', 'problem_id', 'problem__points', 'points', 'submission__date',
+                             'submission__result', 'submission_id'))
+        groups = groupby(rows.iterator(chunk_size=BULK_UPDATE_CHUNK_SIZE), key=itemgetter(0))
+        group = next(groups, None)
+
+        updated = 0
+        chunk = []
+        for participation in participations.order_by('id').iterator(chunk_size=BULK_UPDATE_CHUNK_SIZE):
+            participation.contest = self.contest
+            submissions = []
+            if group is not None and group[0] == participation.id:
+                submissions = [SubmissionResult(*row[1:]) for row in group[1]]
+                group = next(groups, None)
+
+            self.compute_results(participation, submissions)
+            self.mark_counted(participation.format_data,
+                              [(submission.problem_id, submission.submission_id) for submission in submissions])
+            if participation.is_disqualified:
+                participation.score = -9999
+            chunk.append(participation)
+
+            if len(chunk) == BULK_UPDATE_CHUNK_SIZE:
+                updated += self._save_participations(chunk, progress)
+                chunk = []
+        updated += self._save_participations(chunk, progress)
+
+        # Saving in bulk sends no post_save signals to do this.
+        invalidate_contest_ranking(self.contest.id)
+        return updated
+
+    @staticmethod
+    def _save_participations(participations, progress):
+        if participations:
+            type(participations[0]).objects.bulk_update(participations,
+                                                        ['score', 'cumtime', 'tiebreaker', 'format_data'])
+            if progress is not None:
+                progress.did(len(participations))
+        return len(participations)
+
+    def compute_results(self, participation, submissions):
+        """
+        Sets the results of a participation as update_participation would, without saving them.
+
+        :param participation: A ContestParticipation object.
+        :param submissions: A list of SubmissionResult tuples for all of its submissions, ordered by date.
+        :return: None
+        """
+        format_data = {}
+        for submission in submissions:
+            previous = format_data.get(str(submission.problem_id))
+            format_data[str(submission.problem_id)] = {
+                'time': (submission.date - participation.start).total_seconds(),
+                'points': submission.points if previous is None else max(submission.points, previous['points']),
+            }
+
+        participation.cumtime = max(sum(data['time'] for data in format_data.values() if data['points']), 0)
+        participation.score = sum(data['points'] for data in format_data.values())
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+
+    def apply_submission(self, participation, contest_submission):
+        # Both the points and the time are maxima, so the order of the results does not matter.
+        format_data = participation.format_data or {}
+        dt = (contest_submission.submission.date - participation.start).total_seconds()
+        points = contest_submission.points
+        previous = format_data.get(str(contest_submission.problem_id))
+        if previous:
+            dt = max(dt, previous['time'])
+            points = max(points, previous['points'])
+        format_data[str(contest_submission.problem_id)] = {'time': dt, 'points': points}
+
+        self.mark_counted(format_data, [(contest_submission.problem_id, contest_submission.submission_id)])
+        participation.cumtime = max(sum(data['time'] for data in format_data.values() if data['points']), 0)
+        participation.score = sum(data['points'] for data in format_data.values())
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+        participation.save()
+        return True
+
     def display_user_problem(self, participation, contest_problem):
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
         if format_data:
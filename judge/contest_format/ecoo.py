@@ -95,12 +95,98 @@ class ECOOContestFormat(DefaultContestFormat):
                 cumtime += data['time']
             score += data['points'] + data['bonus']
 
+        self.mark_counted(format_data, participation.submissions.values_list('problem_id', 'submission_id'))
         participation.cumtime = cumtime
         participation.score = score
         participation.tiebreaker = 0
         participation.format_data = format_data
         participation.save()
 
+    def compute_results(self, participation, submissions):
+        frozen = self.contest.freeze_submissions and participation.live_or_spectate
+        latest = {}
+        counts = {}
+        for submission in submissions:
+            if submission.result in ('IE', 'CE') or (frozen and submission.date >= self.contest.freeze_after):
+                continue
+            counts[submission.problem_id] = counts.get(submission.problem_id, 0) + 1
+            previous = latest.get(submission.problem_id)
+            if previous is None or submission.date > previous.date or submission.points > previous.points:
+                latest[submission.problem_id] = submission
+
+        format_data = {}
+        for problem_id, submission in latest.items():
+            bonus = 0
+            if submission.points > 0:
+                # First AC bonus
+                if counts[problem_id] == 1 and submission.points == submission.problem_points:
+                    bonus += self.config['first_ac_bonus']
+                # Time bonus
+                if self.config['time_bonus']:
+                    bonus += (participation.end_time - submission.date).total_seconds() // 60 // \
+                        self.config['time_bonus']
+
+            format_data[str(problem_id)] = {
+                'time': (submission.date - participation.start).total_seconds(), 'points': submission.points,
+                'bonus': bonus,
+            }
+
+        cumtime = 0
+        score = 0
+        for data in format_data.values():
+            if self.config['cumtime']:
+                cumtime += data['time']
+            score += data['points'] + data['bonus']
+
+        participation.cumtime = cumtime
+        participation.score = score
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+
+    def apply_submission(self, participation, contest_submission):
+        submission = contest_submission.submission
+        if submission.result in ('IE', 'CE'):
+            return True
+        if (self.contest.freeze_submissions and participation.live_or_spectate and
+                submission.date >= self.contest.freeze_after):
+            return True
+
+        format_data = participation.format_data or {}
+        previous = format_data.get(str(contest_submission.problem_id))
+        if previous and 'bonus' not in previous:
+            return False
+
+        # The latest submission counts, whatever its score.
+        points = contest_submission.points
+        bonus = 0
+        if points > 0:
+            # First AC bonus
+            if not previous and points == contest_submission.problem.points:
+                bonus += self.config['first_ac_bonus']
+            # Time bonus
+            if self.config['time_bonus']:
+                bonus += (participation.end_time - submission.date).total_seconds() // 60 // self.config['time_bonus']
+
+        format_data[str(contest_submission.problem_id)] = {
+            'time': (submission.date - participation.start).total_seconds(), 'points': points, 'bonus': bonus,
+        }
+
+        self.mark_counted(format_data, [(contest_submission.problem_id, contest_submission.submission_id)])
+
+        cumtime = 0
+        score = 0
+        for data in format_data.values():
+            if self.config['cumtime']:
+                cumtime += data['time']
+            score += data['points'] + data['bonus']
+
+        participation.cumtime = cumtime
+        participation.score = score
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+        participation.save()
+        return True
+
     def display_user_problem(self, participation, contest_problem):
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
         if format_data:
@@ -91,12 +91,91 @@ class ICPCContestFormat(DefaultContestFormat):
                 format_data[str(prob)] = {'time': dt, 'points': points, 'penalty': prev}
                 score += points
 
+        self.mark_counted(format_data, participation.submissions.values_list('problem_id', 'submission_id'))
         participation.cumtime = cumtime + penalty
         participation.score = score
         participation.tiebreaker = last  # field is sorted from least to greatest
         participation.format_data = format_data
         participation.save()
 
+    def compute_results(self, participation, submissions):
+        format_data = {}
+        counted = {}
+        for submission in submissions:
+            key = str(submission.problem_id)
+            # An IE can have a submission result of `None`
+            counted[key] = counted.get(key, 0) + (submission.result not in (None, 'IE', 'CE'))
+            if key not in format_data or submission.points > format_data[key]['points']:
+                format_data[key] = {'time': (submission.date - participation.start).total_seconds(),
+                                    'points': submission.points, 'penalty': counted[key] - 1}
+
+        cumtime = 0
+        last = 0
+        penalty = 0
+        score = 0
+        for key, data in format_data.items():
+            if not self.config['penalty']:
+                data['penalty'] = 0
+            elif not data['points']:
+                # We should always display the penalty, even if the user has a score of 0
+                data['penalty'] = counted[key]
+
+            if data['points']:
+                cumtime += data['time']
+                last = max(last, data['time'])
+                penalty += data['penalty'] * self.config['penalty'] * 60
+            score += data['points']
+
+        participation.cumtime = cumtime + penalty
+        participation.score = score
+        participation.tiebreaker = last  # field is sorted from least to greatest
+        participation.format_data = format_data
+
+    def apply_submission(self, participation, contest_submission):
+        format_data = participation.format_data or {}
+        previous = format_data.get(str(contest_submission.problem_id))
+        if previous and 'penalty' not in previous:
+            return False
+
+        points = contest_submission.points
+        dt = (contest_submission.submission.date - participation.start).total_seconds()
+        # An IE can have a submission result of `None`
+        counted = int(bool(self.config['penalty']) and
+                      contest_submission.submission.result not in (None, 'IE', 'CE'))
+
+        if not previous:
+            format_data[str(contest_submission.problem_id)] = {
+                'time': dt, 'points': points, 'penalty': 0 if points else counted,
+            }
+        elif points > previous['points']:
+            if previous['points'] and self.config['penalty']:
+                # We don't know how many of the penalized submissions were made after the previous best.
+                return False
+            # Before the first points, every submission was penalized, and this one is not.
+            previous.update({'time': dt, 'points': points})
+        elif not points and not previous['points']:
+            previous['penalty'] += counted
+
+        self.mark_counted(format_data, [(contest_submission.problem_id, contest_submission.submission_id)])
+
+        cumtime = 0
+        last = 0
+        penalty = 0
+        score = 0
+        for data in format_data.values():
+            if data['points']:
+                cumtime += data['time']
+                last = max(last, data['time'])
+                penalty += data['penalty'] * self.config['penalty'] * 60
+            score += data['points']
+
+        participation.cumtime = cumtime + penalty
+        participation.score = score
+        participation.tiebreaker = last  # field is sorted from least to greatest
+        participation.format_data = format_data
+        participation.save()
+        return True
+
     def display_user_problem(self, participation, contest_problem):
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
         if format_data:
@@ -76,12 +76,68 @@ class IOIContestFormat(DefaultContestFormat):
                 'first_solve': points == problem_points,
             })
 
+        self.mark_counted(format_data, participation.submissions.values_list('problem_id', 'submission_id'))
         participation.cumtime = max(cumtime, 0)
         participation.score = score
         participation.tiebreaker = 0
         participation.format_data = format_data
         participation.save()
 
+    def compute_results(self, participation, submissions):
+        format_data = {}
+        first = {}
+        for submission in submissions:
+            key = str(submission.problem_id)
+            if self.config['cumtime']:
+                dt = (submission.date - participation.start).total_seconds()
+            else:
+                dt = 0
+
+            if key not in format_data:
+                format_data[key] = {'points': submission.points, 'time': dt}
+                first[key] = submission
+            else:
+                if submission.points > format_data[key]['points']:
+                    format_data[key].update({'points': submission.points, 'time': dt})
+                if submission.date == first[key].date and submission.points > first[key].points:
+                    first[key] = submission
+
+        for key, submission in first.items():
+            format_data[key]['first_solve'] = submission.points == submission.problem_points
+
+        participation.cumtime = max(sum(data['time'] for data in format_data.values() if data['points']), 0)
+        participation.score = sum(data['points'] for data in format_data.values())
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+
+    def apply_submission(self, participation, contest_submission):
+        format_data = participation.format_data or {}
+        previous = format_data.get(str(contest_submission.problem_id))
+        if previous and 'first_solve' not in previous:
+            return False
+
+        points = contest_submission.points
+        if self.config['cumtime']:
+            dt = (contest_submission.submission.date - participation.start).total_seconds()
+        else:
+            dt = 0
+
+        if not previous:
+            format_data[str(contest_submission.problem_id)] = {
+                'points': points, 'time': dt, 'first_solve': points == contest_submission.problem.points,
+            }
+        elif points > previous['points']:
+            # The earliest submission with the best score is kept on ties, and this one came last.
+            previous.update({'points': points, 'time': dt})
+
+        self.mark_counted(format_data, [(contest_submission.problem_id, contest_submission.submission_id)])
+        participation.cumtime = max(sum(data['time'] for data in format_data.values() if data['points']), 0)
+        participation.score = sum(data['points'] for data in format_data.values())
+        participation.tiebreaker = 0
+        participation.format_data = format_data
+        participation.save()
+        return True
+
     def display_user_problem(self, participation, contest_problem):
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
         if format_data:
@@ -0,0 +1,360 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import stat
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qs, unquote, urlsplit
+
+__all__ = ['EventHub', 'EventHubServer']
+logger = logging.getLogger('judge.event_hub')
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_HEADER_SIZE = 16384
+MAX_MESSAGE_SIZE = 65536
+# Subscribers that stop reading are disconnected once this much is waiting to be sent to them.
+MAX_WRITE_BUFFER = 1 << 20
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class EventHub(object):
+    """In-memory event hub, with the semantics of websocket/daemon.js.
+
+    Messages get increasing ids, starting from the current time in milliseconds, and the last max_queue of them are
+    kept for subscribers catching up. Subscribers are indexed by channel, so posting a message only touches the ones
+    listening on its channel. Everything runs on one event loop, so there is no locking.
+    """
+
+    def __init__(self, max_queue=50):
+        self.messages = deque(maxlen=max_queue)  # (id, channel, JSON of the message)
+        self.message_id = int(time.time() * 1000)
+        self.subscribers = defaultdict(set)  # channel: {subscriber}
+
+    def post(self, channel, message):
+        self.message_id += 1
+        data = json.dumps({'id': self.message_id, 'channel': channel, 'message': message})
+        self.messages.append((self.message_id, channel, data))
+        for subscriber in list(self.subscribers.get(channel, ())):
+            subscriber.deliver(self.message_id, data)
+        return self.message_id
+
+    def since(self, last, channels):
+        return [(id, data) for id, channel, data in self.messages if id > last and channel in channels]
+
+    def subscribe(self, subscriber, channels):
+        for channel in channels:
+            self.subscribers[channel].add(subscriber)
+
+    def unsubscribe(self, subscriber, channels):
+        for channel in channels:
+            subscribers = self.subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[channel]
+
+
+class WebSocketSubscriber(object):
+    def __init__(self, hub, writer):
+        self.hub = hub
+        self.writer = writer
+        self.filter = frozenset()
+        self.last_msg = 0
+        # daemon.js moves last_msg of every subscriber forward on every message, on any channel. This hub only
+        # delivers to the subscribers of the channel, so it remembers where it was when the filter was set instead.
+        self.followed_from = None
+
+    def deliver(self, id, data):
+        if self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            logger.info('Disconnecting slow subscriber: %s', self.writer.get_extra_info('peername'))
+            self.writer.close()
+            return
+        self.writer.write(encode_frame(OP_TEXT, data.encode('utf-8')))
+        self.last_msg = id
+
+    def send_json(self, data):
+        self.writer.write(encode_frame(OP_TEXT, json.dumps(data).encode('utf-8')))
+
+    def on_message(self, text):
+        try:
+            request = json.loads(text)
+            command = request['command'].replace('-', '_')
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json({'status': 'error', 'code': 'syntax-error', 'message': str(e)})
+            return
+
+        if command == 'start_msg':
+            try:
+                self.last_msg = int(request.get('start') or 0)
+            except (ValueError, TypeError):
+                self.last_msg = 0
+        elif command == 'set_filter':
+            channels = request.get('filter')
+            if not isinstance(channels, list) or not channels or not all(isinstance(c, str) for c in channels):
+                self.send_json({'status': 'error', 'code': 'invalid-filter',
+                                'message': 'invalid filter: %s' % (channels,)})
+                return
+            if self.followed_from is not None and self.hub.message_id > self.followed_from:
+                self.last_msg = max(self.last_msg, self.hub.message_id)
+            self.hub.unsubscribe(self, self.filter)
+            self.filter = frozenset(channels)
+            self.hub.subscribe(self, self.filter)
+            self.followed_from = self.hub.message_id
+            for id, data in self.hub.since(self.last_msg, self.filter):
+                self.deliver(id, data)
+        else:
+            self.send_json({'status': 'error', 'code': 'bad-command', 'message': 'bad command: %s' % command})
+
+    def close(self):
+        self.hub.unsubscribe(self, self.filter)
+
+
+class LongPollSubscriber(object):
+    def __init__(self, future):
+        self.future = future
+
+    def deliver(self, id, data):
+        if not self.future.done():
+            self.future.set_result(data)
+
+
+def encode_frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def unmask(payload, mask):
+    length = len(payload)
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+    return (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(1009, 'message too big')
+    if not second & 0x80:
+        raise ProtocolError(1002, 'client frames must be masked')
+    mask = await reader.readexactly(4)
+    return bool(first & 0x80), first & 0x0F, unmask(await reader.readexactly(length), mask)
+
+
+class EventHubServer(object):
+    """Serves an EventHub: posting over a Unix socket, and subscribing over websockets and long polling over HTTP.
+
+    The post socket takes one JSON command per line, {"command": "post", "channel": ..., "message": ...} or
+    {"command": "last-msg"}, and answers each with a line like the post port of daemon.js, so posts can be pipelined.
+    The HTTP address speaks the websocket protocol of daemon.js (start-msg and set-filter) on any path, and answers
+    long polls on /channels/<channel>|<channel>?last=<id>.
+
+    serve_forever() runs the hub on its own event loop until shutdown() is called, so it can run in a thread of the
+    bridge, or on its own with the runeventhub command. The started event is set once it is listening, or has failed
+    to, in which case start_error is the reason.
+    """
+
+    def __init__(self, post_socket, address, max_queue=50, poll_timeout=60):
+        self.post_socket = post_socket
+        self.address = address
+        self.poll_timeout = poll_timeout
+        self.hub = EventHub(max_queue)
+        self.loop = asyncio.new_event_loop()
+        self._servers = []
+        self.started = threading.Event()
+        self.start_error = None
+
+    async def _start(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.post_socket).st_mode):
+                os.unlink(self.post_socket)
+        except FileNotFoundError:
+            pass
+        self._servers.append(await asyncio.start_unix_server(self._handle_poster, self.post_socket))
+        host, port = self.address
+        self._servers.append(await asyncio.start_server(self._handle_http, host, port))
+        logger.info('Event hub accepting posts on %s and subscribers on %s:%d', self.post_socket, host, port)
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            try:
+                self.loop.run_until_complete(self._start())
+            except Exception as e:
+                self.start_error = e
+                raise
+            finally:
+                self.started.set()
+            self.loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            try:
+                os.unlink(self.post_socket)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _handle_poster(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(json.dumps(self._post_command(line)).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Connections are cancelled when the hub shuts down. The stream server would log it as an error.
+            pass
+        finally:
+            writer.close()
+
+    def _post_command(self, line):
+        try:
+            request = json.loads(line)
+            command = request['command'].replace('-', '_')
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {'status': 'error', 'code': 'syntax-error', 'message': str(e)}
+        if command == 'post':
+            if not isinstance(request.get('channel'), str):
+                return {'status': 'error', 'code': 'invalid-channel'}
+            return {'status': 'success', 'id': self.hub.post(request['channel'], request.get('message'))}
+        elif command == 'last_msg':
+            return {'status': 'success', 'id': self.hub.message_id}
+        return {'status': 'error', 'code': 'bad-command', 'message': 'bad command: %s' % command}
+
+    async def _handle_http(self, reader, writer):
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.LimitOverrunError:
+                return await self._respond(writer, 431, 'text/plain', b'431 Request Header Fields Too Large')
+            if len(head) > MAX_HEADER_SIZE:
+                return await self._respond(writer, 431, 'text/plain', b'431 Request Header Fields Too Large')
+
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            try:
+                method, target, _ = request_line.split(' ', 2)
+            except ValueError:
+                return await self._respond(writer, 400, 'text/plain', b'400 Bad Request')
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+
+            if headers.get('upgrade', '').lower() == 'websocket':
+                await self._websocket(reader, writer, headers)
+            else:
+                await self._long_poll(writer, target)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Connections are cancelled when the hub shuts down. The stream server would log it as an error.
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 431: 'Request Header Fields Too Large',
+                   504: 'Gateway Timeout'}
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % (
+            status, reasons[status], content_type, len(body))).encode('latin-1') + body)
+        await writer.drain()
+
+    async def _long_poll(self, writer, target):
+        url = urlsplit(target)
+        if not url.path.startswith('/channels/'):
+            return await self._respond(writer, 404, 'text/plain', b'404 Not Found')
+        channels = frozenset(unquote(url.path[len('/channels/'):]).split('|')) - {''}
+        if not channels:
+            return await self._respond(writer, 400, 'text/plain', b'400 Bad Request')
+        try:
+            last = int(parse_qs(url.query).get('last', ['0'])[0])
+        except ValueError:
+            last = 0
+
+        pending = self.hub.since(last, channels)
+        if pending:
+            return await self._respond(writer, 200, 'application/json', pending[0][1].encode('utf-8'))
+
+        subscriber = LongPollSubscriber(self.loop.create_future())
+        self.hub.subscribe(subscriber, channels)
+        try:
+            data = await asyncio.wait_for(subscriber.future, self.poll_timeout)
+        except asyncio.TimeoutError:
+            return await self._respond(writer, 504, 'application/json', b'{"error": "timeout"}')
+        finally:
+            self.hub.unsubscribe(subscriber, channels)
+        await self._respond(writer, 200, 'application/json', data.encode('utf-8'))
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            return await self._respond(writer, 400, 'text/plain', b'400 Bad Request')
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WEBSOCKET_GUID).digest()).decode('ascii')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: %s\r\n\r\n' % accept).encode('latin-1'))
+
+        subscriber = WebSocketSubscriber(self.hub, writer)
+        fragments = []
+        try:
+            while not writer.is_closing():
+                fin, opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                    break
+                elif opcode == OP_PING:
+                    writer.write(encode_frame(OP_PONG, payload))
+                elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+                    fragments.append(payload)
+                    if sum(map(len, fragments)) > MAX_MESSAGE_SIZE:
+                        raise ProtocolError(1009, 'message too big')
+                    if fin:
+                        message, fragments = b''.join(fragments), []
+                        try:
+                            subscriber.on_message(message.decode('utf-8'))
+                        except UnicodeDecodeError:
+                            raise ProtocolError(1007, 'invalid utf-8')
+                await writer.drain()
+        except ProtocolError as e:
+            writer.write(encode_frame(OP_CLOSE, struct.pack('!H', e.code) + str(e).encode('utf-8')))
+        finally:
+            subscriber.close()
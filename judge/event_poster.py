@@ -10,9 +10,20 @@ if not settings.EVENT_DAEMON_USE:
 
     def last():
         return 0
-elif hasattr(settings, 'EVENT_DAEMON_AMQP'):
-    from .event_poster_amqp import last, post
-    real = True
 else:
-    from .event_poster_ws import last, post
+    if hasattr(settings, 'EVENT_DAEMON_AMQP'):
+        from . import event_poster_amqp as backend
+    elif settings.EVENT_DAEMON_HUB_SOCKET:
+        from . import event_poster_hub as backend
+    else:
+        from . import event_poster_ws as backend
     real = True
+
+    last = backend.last
+    if settings.EVENT_DAEMON_ASYNC:
+        from .event_poster_queue import QueuedEventPoster
+
+        post = QueuedEventPoster(backend.EventPoster, settings.EVENT_DAEMON_QUEUE_SIZE,
+                                 settings.EVENT_DAEMON_BATCH_SIZE).post
+    else:
+        post = backend.post
@@ -30,6 +30,15 @@ class EventPoster(object):
             self._connect()
             return self.post(channel, message, tries + 1)
 
+    def post_many(self, events):
+        ids = []
+        for channel, message in events:
+            id = int(time() * 1000000)
+            self._chan.basic_publish(self._exchange, '',
+                                     json.dumps({'id': id, 'channel': channel, 'message': message}))
+            ids.append(id)
+        return ids
+
 
 _local = threading.local()
 
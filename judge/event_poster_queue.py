@@ -0,0 +1,132 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from judge.utils.metrics import Counter, Gauge
+
+__all__ = ['QueuedEventPoster']
+logger = logging.getLogger('judge.event_poster')
+
+queued_count = Counter('event_poster_queued_total', 'Events queued for the event daemon.')
+sent_count = Counter('event_poster_sent_total', 'Events delivered to the event daemon.')
+dropped_count = Counter('event_poster_dropped_total', 'Events that were never delivered to the event daemon.',
+                        ['reason'])
+reconnect_count = Counter('event_poster_reconnects_total', 'Connections made to the event daemon after a failure.')
+queue_size = Gauge('event_poster_queue_size', 'Events waiting to be sent to the event daemon.')
+
+
+class QueuedEventPoster(object):
+    """Posts events from a background thread, so that posting never waits on the event daemon.
+
+    post() only puts the event on a bounded queue, and returns 0, since the id is not known yet. The sender thread
+    takes whatever has accumulated, up to batch_size events, and hands it to the post_many method of a poster made
+    by make_poster, which delivers the batch without waiting on each event in turn. If that fails, the poster is
+    thrown away, and a new one is made after an exponential backoff between min_backoff and max_backoff seconds,
+    to retry the same batch. Events that arrive while the queue is full are dropped and counted, as are events the
+    daemon rejects.
+
+    Delivery is at-least-once: when post_many fails partway through a batch, there is no telling which events the
+    daemon already accepted, so the retry posts those again.
+
+    The sender thread is started by the first post in each process, so that it survives forking web workers.
+    """
+
+    def __init__(self, make_poster, max_size=10000, batch_size=100, min_backoff=0.5, max_backoff=30, drain_timeout=2):
+        self.make_poster = make_poster
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._last_warning = 0
+
+        queue_size.set_function(lambda: self._queue.qsize() if self._queue is not None else 0)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.max_size)
+            thread = threading.Thread(target=self._run, args=(self._queue,), name='event-poster', daemon=True)
+            thread.start()
+            if self._pid is None:
+                atexit.register(self.drain)
+            self._pid = os.getpid()
+
+    def post(self, channel, message):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((channel, message))
+        except queue.Full:
+            self._dropped('queue-full')
+        else:
+            queued_count.inc()
+        return 0
+
+    def drain(self, timeout=None):
+        """Waits up to timeout seconds for the queued events to be sent, e.g. before the process exits."""
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        while self._queue is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return {
+            'queued': queued_count.value(),
+            'sent': sent_count.value(),
+            'dropped': {reason: dropped_count.value(reason) for reason in ('queue-full', 'rejected')},
+            'reconnects': reconnect_count.value(),
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def _dropped(self, reason, amount=1):
+        dropped_count.inc(reason, amount=amount)
+        now = time.monotonic()
+        if now - self._last_warning > 60:
+            self._last_warning = now
+            logger.warning('Dropping events for the event daemon (%s), %d dropped so far',
+                           reason, dropped_count.value(reason))
+
+    def _take_batch(self, events):
+        batch = [events.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(events.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, events):
+        poster = None
+        backoff = self.min_backoff
+        while True:
+            batch = self._take_batch(events)
+            while True:
+                try:
+                    if poster is None:
+                        poster = self.make_poster()
+                    ids = poster.post_many(batch)
+                except Exception:
+                    logger.warning('Failed to post %d events, retrying in %.1fs', len(batch), backoff, exc_info=True)
+                    poster = None
+                    time.sleep(backoff * random.uniform(0.5, 1))
+                    backoff = min(backoff * 2, self.max_backoff)
+                    reconnect_count.inc()
+                    continue
+                backoff = self.min_backoff
+                break
+
+            rejected = ids.count(0)
+            sent_count.inc(amount=len(batch) - rejected)
+            if rejected:
+                self._dropped('rejected', rejected)
+            for _ in batch:
+                events.task_done()
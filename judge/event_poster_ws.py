@@ -39,6 +39,17 @@ class EventPoster(object):
             self._connect()
             return self.post(channel, message, tries + 1)
 
+    def post_many(self, events):
+        """Posts (channel, message) pairs, sending all of them before reading the replies, which the daemon sends
+        in order. Returns their ids, with 0 for events the daemon rejected."""
+        for channel, message in events:
+            self._conn.send(json.dumps({'command': 'post', 'channel': channel, 'message': message}))
+        ids = []
+        for _ in events:
+            resp = json.loads(self._conn.recv())
+            ids.append(0 if resp['status'] == 'error' else resp['id'])
+        return ids
+
     def last(self, tries=0):
         try:
             self._conn.send('{"command": "last-msg"}')
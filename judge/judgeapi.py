@@ -1,16 +1,31 @@
 import json
 import logging
+import os
 import socket
 import struct
+import threading
 import zlib
+from itertools import count
 
 from django.conf import settings
+from django.db import transaction
 
 from judge import event_poster as event
+from judge.utils.hashring import HashRing
 
 logger = logging.getLogger('judge.judgeapi')
 size_pack = struct.Struct('!I')
 
+CONTEST_SUBMISSION_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+REJUDGE_PRIORITY = 2
+BATCH_REJUDGE_PRIORITY = 3
+
+# Submissions per UPDATE/DELETE statement in judge_submissions.
+BULK_JUDGE_CHUNK_SIZE = 1000
+# Keep bulk packets well below the bridge's MAX_ALLOWED_PACKET_SIZE, even before compression.
+BULK_JUDGE_MAX_SOURCE_SIZE = 4 * 1024 * 1024
+
 
 def _post_update_submission(submission, done=False):
     if submission.problem.is_public:
@@ -21,41 +36,204 @@ def _post_update_submission(submission, done=False):
                                    'status': submission.status, 'language': submission.language.key})
 
 
-def judge_request(packet, reply=True):
-    sock = socket.create_connection(settings.BRIDGED_DJANGO_CONNECT or
-                                    settings.BRIDGED_DJANGO_ADDRESS[0])
+_rings = {}
+
+
+def _bridge_addresses():
+    if settings.BRIDGED_DJANGO_SHARDS:
+        return [tuple(address) for address in settings.BRIDGED_DJANGO_SHARDS]
+    return [tuple(settings.BRIDGED_DJANGO_CONNECT or settings.BRIDGED_DJANGO_ADDRESS[0])]
+
+
+def bridge_shard(problem, addresses=None):
+    """Returns the index of the bridge in BRIDGED_DJANGO_SHARDS that submissions to problem (a code) are sent to."""
+    addresses = tuple(addresses or _bridge_addresses())
+    if len(addresses) == 1:
+        return 0
+    if addresses not in _rings:
+        _rings[addresses] = HashRing(addresses)
+    return _rings[addresses].index(problem)
+
+
+def _bridge_address(problem=None):
+    addresses = _bridge_addresses()
+    if problem is None:
+        return addresses[0]
+    return addresses[bridge_shard(problem, addresses)]
+
 
+def _pack_packet(packet):
     output = json.dumps(packet, separators=(',', ':'))
     output = zlib.compress(output.encode('utf-8'))
+    return size_pack.pack(len(output)) + output
+
+
+def _read_packet(reader):
+    input = reader.read(size_pack.size)
+    if not input:
+        raise ValueError('Judge did not respond')
+    length = size_pack.unpack(input)[0]
+    input = reader.read(length)
+    if not input:
+        raise ValueError('Judge did not respond')
+    return json.loads(zlib.decompress(input).decode('utf-8'))
+
+
+class BridgeChannel(object):
+    """A persistent connection to the bridge that can have many requests in flight.
+
+    Every request is tagged with a request ID, which the bridge echoes in its reply. There is no reader thread:
+    one of the threads waiting for a reply reads from the socket and hands out replies meant for the others. Requests
+    that need no reply are marked as such instead, so that the bridge sends none that nobody would read.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._lock = threading.Condition()
+        self._sock = None
+        self._reader = None
+        self._generation = 0
+        self._ids = count(1)
+        self._waiting = set()
+        self._replies = {}
+        self._reading = False
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address)
+        self._reader = self._sock.makefile('rb', -1)
+
+    def _disconnect(self):
+        # Must be called with the lock held. Fails every request in flight on the current connection.
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+        self._generation += 1
+        self._waiting.clear()
+        self._replies.clear()
+        self._lock.notify_all()
+
+    def request(self, packet, reply=True):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+
+            id = next(self._ids)
+            generation = self._generation
+            try:
+                self._sock.sendall(_pack_packet(dict(packet, **({'request-id': id} if reply else {'no-reply': True}))))
+            except OSError:
+                self._disconnect()
+                raise
+
+            if not reply:
+                return
+            self._waiting.add(id)
+
+            while True:
+                if id in self._replies:
+                    return self._replies.pop(id)
+                if self._generation != generation:
+                    raise ConnectionError('Connection to bridge lost')
+                if not self._reading:
+                    self._reading = True
+                    break
+                self._lock.wait()
+
+            reader = self._reader
+
+        # We are now the reader for this connection until our own reply arrives.
+        try:
+            while True:
+                result = _read_packet(reader)
+                with self._lock:
+                    reply_id = result.pop('request-id', None)
+                    if reply_id == id:
+                        self._waiting.discard(id)
+                        self._reading = False
+                        self._lock.notify_all()
+                        return result
+                    if reply_id in self._waiting:
+                        self._waiting.discard(reply_id)
+                        self._replies[reply_id] = result
+                        self._lock.notify_all()
+        except Exception:
+            with self._lock:
+                self._reading = False
+                if self._generation == generation:
+                    self._disconnect()
+            raise
+
+
+_channels = {}
+_channels_pid = None
+_channels_lock = threading.Lock()
+_channel_counter = count()
+
+
+def _get_channel(address):
+    global _channels, _channels_pid
+
+    # Sockets must not be shared with processes forked after the pool was created.
+    with _channels_lock:
+        if _channels_pid != os.getpid():
+            _channels = {}
+            _channels_pid = os.getpid()
+        if address not in _channels:
+            _channels[address] = [BridgeChannel(address) for _ in range(settings.BRIDGED_DJANGO_POOL_SIZE)]
+        channels = _channels[address]
+    return channels[next(_channel_counter) % len(channels)]
+
+
+def _judge_request_once(packet, reply=True, address=None):
+    sock = socket.create_connection(address or _bridge_address())
+
     writer = sock.makefile('wb')
-    writer.write(size_pack.pack(len(output)))
-    writer.write(output)
+    writer.write(_pack_packet(packet))
     writer.close()
 
     if reply:
         reader = sock.makefile('rb', -1)
-        input = reader.read(size_pack.size)
-        if not input:
-            raise ValueError('Judge did not respond')
-        length = size_pack.unpack(input)[0]
-        input = reader.read(length)
-        if not input:
-            raise ValueError('Judge did not respond')
+        result = _read_packet(reader)
         reader.close()
         sock.close()
-
-        result = json.loads(zlib.decompress(input).decode('utf-8'))
         return result
 
 
+def judge_request(packet, reply=True, problem=None, address=None):
+    """Sends packet to the bridge responsible for problem (a code), or to address if given."""
+    address = address or _bridge_address(problem)
+    if settings.BRIDGED_DJANGO_POOL_SIZE:
+        try:
+            return _get_channel(address).request(packet, reply)
+        except (OSError, ValueError, zlib.error):
+            logger.warning('Persistent bridge connection failed, falling back to a one-shot request', exc_info=True)
+    return _judge_request_once(packet, reply, address)
+
+
+def _broadcast_request(packet):
+    # For requests that concern every bridge, like those about judges, which may be connected to any of them.
+    addresses = _bridge_addresses()
+    if len(addresses) == 1:
+        return judge_request(packet, reply=False, address=addresses[0])
+
+    failed = 0
+    for address in addresses:
+        try:
+            judge_request(packet, reply=False, address=address)
+        except OSError:
+            logger.warning('Failed to send %s to bridge at %s', packet['name'], address, exc_info=True)
+            failed += 1
+    if failed == len(addresses):
+        raise ConnectionError('Failed to reach any bridge')
+
+
 def judge_submission(submission, rejudge, batch_rejudge=False):
     from .models import ContestSubmission, Submission, SubmissionTestCase
 
-    CONTEST_SUBMISSION_PRIORITY = 0
-    DEFAULT_PRIORITY = 1
-    REJUDGE_PRIORITY = 2
-    BATCH_REJUDGE_PRIORITY = 3
-
     updates = {'time': None, 'memory': None, 'points': None, 'result': None, 'error': None,
                'was_rejudged': rejudge, 'status': 'QU'}
     try:
@@ -89,7 +267,7 @@ def judge_submission(submission, rejudge, batch_rejudge=False):
             'language': submission.language.key,
             'source': submission.source.source,
             'priority': BATCH_REJUDGE_PRIORITY if batch_rejudge else REJUDGE_PRIORITY if rejudge else priority,
-        })
+        }, problem=submission.problem.code)
     except BaseException:
         logger.exception('Failed to send request to judge')
         Submission.objects.filter(id=submission.id).update(status='IE', result='IE')
@@ -102,13 +280,124 @@ def judge_submission(submission, rejudge, batch_rejudge=False):
     return success
 
 
+def _send_submission_batch(batch, priority, address):
+    from .models import Submission
+
+    ids = [id for id, _, _, _ in batch]
+    try:
+        response = judge_request({
+            'name': 'submission-batch-request',
+            'priority': priority,
+            'submissions': [{'submission-id': id, 'problem-id': problem, 'language': language, 'source': source}
+                            for id, problem, language, source in batch],
+        }, address=address)
+    except BaseException:
+        logger.exception('Failed to send batch request to judge')
+        response = None
+
+    if response is None or response['name'] != 'submission-batch-received':
+        Submission.objects.filter(id__in=ids).update(status='IE', result='IE')
+        return 0
+    return len(ids)
+
+
+def judge_submissions(queryset, priority, rejudge=True, progress=None):
+    """Schedule every submission in queryset for judging with a few set-based queries per chunk.
+
+    This is the bulk counterpart of judge_submission: it skips submissions that are currently being judged, resets
+    the rest, and sends them to the bridge in submission-batch-request packets. Unlike judge_submission, no live
+    update is posted for each submission. If given, progress is advanced by the size of every processed chunk.
+
+    Returns the number of submissions that were sent to the bridge.
+    """
+    from .models import Submission, SubmissionTestCase
+
+    updates = {'time': None, 'memory': None, 'points': None, 'result': None, 'error': None,
+               'was_rejudged': rejudge, 'status': 'QU'}
+    ids = list(queryset.values_list('id', flat=True).order_by('id'))
+    sent = 0
+
+    for start in range(0, len(ids), BULK_JUDGE_CHUNK_SIZE):
+        chunk = ids[start:start + BULK_JUDGE_CHUNK_SIZE]
+
+        # See judge_submission for why submissions being graded must not be touched.
+        # As in judge_submission, is_pretested is only set on contest submissions.
+        pretested = {True: [], False: []}
+        for id, is_pretested, run_pretests_only in (
+                Submission.objects.filter(id__in=chunk, contest__isnull=False)
+                                  .values_list('id', 'contest__problem__is_pretested',
+                                               'contest__problem__contest__run_pretests_only')):
+            pretested[is_pretested and run_pretests_only].append(id)
+        Submission.objects.filter(id__in=chunk).exclude(status__in=('P', 'G')).update(**updates)
+        for is_pretested, contest_ids in pretested.items():
+            if contest_ids:
+                Submission.objects.filter(id__in=contest_ids, status='QU').update(is_pretested=is_pretested)
+
+        queued = list(Submission.objects.filter(id__in=chunk, status='QU')
+                                        .values_list('id', 'problem__code', 'language__key', 'source__source'))
+        SubmissionTestCase.objects.filter(submission_id__in=[id for id, _, _, _ in queued]).delete()
+
+        # With several bridges, every one gets its own batches.
+        batches = {}
+        for submission in queued:
+            address = _bridge_address(submission[1])
+            batch, batch_size = batches.get(address, ([], 0))
+            size = len(submission[3] or '')
+            if batch and batch_size + size > BULK_JUDGE_MAX_SOURCE_SIZE:
+                sent += _send_submission_batch(batch, priority, address)
+                batch, batch_size = [], 0
+            batch.append(submission)
+            batches[address] = batch, batch_size + size
+        for address, (batch, _) in batches.items():
+            sent += _send_submission_batch(batch, priority, address)
+
+        if progress is not None:
+            progress.did(len(chunk))
+    return sent
+
+
 def disconnect_judge(judge, force=False):
-    judge_request({'name': 'disconnect-judge', 'judge-id': judge.name, 'force': force}, reply=False)
+    _broadcast_request({'name': 'disconnect-judge', 'judge-id': judge.name, 'force': force})
+
+
+def invalidate_language_limits(problem_id):
+    # The bridge caches resource limits, so it has to hear about changes to them. Failing to reach it must not
+    # prevent the change from being saved.
+    try:
+        _broadcast_request({'name': 'invalidate-limits', 'problem-id': problem_id})
+    except OSError:
+        logger.warning('Failed to notify bridge of changed limits for problem %d', problem_id, exc_info=True)
+
+
+_changed_limits = threading.local()
+
+
+def invalidate_language_limits_on_commit(problem_id):
+    """
+    Tells the bridge that the resource limits of a problem changed, once the current transaction commits.
+
+    Otherwise, the bridge could reload the old limits before the new ones are committed, and keep them. Problems
+    changed together, e.g. by one admin save with inline language limits, are only sent once each.
+    """
+    if not hasattr(_changed_limits, 'problem_ids'):
+        _changed_limits.problem_ids = set()
+    _changed_limits.problem_ids.add(problem_id)
+    # Every change registers a callback, since there is no hook to forget the ids of a transaction that rolls back.
+    # The first one to run sends everything, and the others find nothing left.
+    transaction.on_commit(_send_changed_limits)
+
+
+def _send_changed_limits():
+    problem_ids = getattr(_changed_limits, 'problem_ids', set())
+    _changed_limits.problem_ids = set()
+    for problem_id in sorted(problem_ids):
+        invalidate_language_limits(problem_id)
 
 
 def abort_submission(submission):
     from .models import Submission
-    response = judge_request({'name': 'terminate-submission', 'submission-id': submission.id})
+    response = judge_request({'name': 'terminate-submission', 'submission-id': submission.id},
+                             problem=submission.problem.code)
     # This defaults to true, so that in the case the JudgeList fails to remove the submission from the queue,
     # and returns a bad-request, the submission is not falsely shown as "Aborted" when it will still be judged.
     if not response.get('judge-aborted', True):
@@ -0,0 +1,218 @@
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.bridge.simulator import SimulatedJudge
+from judge.judgeapi import DEFAULT_PRIORITY, judge_submission, judge_submissions
+from judge.models import Judge, Language, Problem, Profile, Submission, SubmissionSource, SubmissionTestCase
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+class Command(BaseCommand):
+    help = 'benchmark a running bridge with a fleet of simulated judges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--judges', type=int, default=4, help='number of simulated judges')
+        parser.add_argument('-n', '--submissions', type=int, default=200, help='number of submissions to judge')
+        parser.add_argument('-p', '--problems', type=int, default=10,
+                            help='number of problems the submissions are spread over')
+        parser.add_argument('--cases', type=int, default=10, help='test cases per submission')
+        parser.add_argument('--cases-per-packet', type=int, default=1,
+                            help='test case results per test-case-status packet')
+        parser.add_argument('--batch-size', type=int, default=0, help='test cases per batch, 0 for no batches')
+        parser.add_argument('--case-delay', type=float, default=0.0,
+                            help='seconds a judge spends between test-case-status packets')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='number of threads sending submissions through judgeapi')
+        parser.add_argument('--bulk', action='store_true', default=False,
+                            help='send all submissions with one judge_submissions call')
+        parser.add_argument('--codec', action='append', dest='codecs',
+                            help='codec the judges offer to the bridge, in order of preference; may be repeated')
+        parser.add_argument('--dictionary', help='compression dictionary the judges share with the bridge')
+        parser.add_argument('--language', default='PY3', help='key of the language to submit in')
+        parser.add_argument('--judge-address', type=parse_address,
+                            help='host:port the bridge accepts judges on, defaults to BRIDGED_JUDGE_ADDRESS')
+        parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for grading to finish')
+        parser.add_argument('--keep', action='store_true', default=False,
+                            help='keep the benchmark submissions instead of deleting them afterwards')
+
+    def handle(self, *args, **options):
+        try:
+            language = Language.objects.get(key=options['language'])
+        except Language.DoesNotExist:
+            raise CommandError('no such language: %s' % options['language'])
+
+        problems = self.setup_problems(options['problems'], language)
+        profile = self.setup_profile(language)
+        submissions = self.setup_submissions(options['submissions'], profile, problems, language)
+
+        fleet = self.start_judges(options, problems, language)
+        try:
+            self.run(options, submissions, fleet)
+        finally:
+            for judge in fleet:
+                judge.close()
+            if not options['keep']:
+                Submission.objects.filter(id__in=[submission.id for submission in submissions]).delete()
+
+    def setup_problems(self, count, language):
+        problems = []
+        for i in range(count):
+            problem, _ = Problem.objects.get_or_create(code='benchbridge%d' % i, defaults={
+                'name': 'Bridge Benchmark %d' % i,
+                'description': 'Problem used by the benchbridge command.',
+                'time_limit': 1,
+                'memory_limit': 65536,
+                'points': 1,
+                'partial': True,
+            })
+            problem.allowed_languages.add(language)
+            problems.append(problem)
+        return problems
+
+    def setup_profile(self, language):
+        user, _ = User.objects.get_or_create(username='benchbridge', defaults={'is_active': False})
+        profile, _ = Profile.objects.get_or_create(user=user, defaults={'language': language})
+        return profile
+
+    def setup_submissions(self, count, profile, problems, language):
+        self.stdout.write('Creating %d submissions...' % count)
+        submissions = []
+        for i in range(count):
+            submission = Submission.objects.create(user=profile, problem=problems[i % len(problems)],
+                                                   language=language)
+            SubmissionSource.objects.create(submission=submission, source='print(%d)' % i)
+            submissions.append(submission)
+        return list(Submission.objects.filter(id__in=[submission.id for submission in submissions])
+                                      .select_related('problem', 'language', 'source').order_by('id'))
+
+    def start_judges(self, options, problems, language):
+        address = options['judge_address'] or settings.BRIDGED_JUDGE_ADDRESS[0]
+        dictionary = None
+        if options['dictionary']:
+            with open(options['dictionary'], 'rb') as f:
+                dictionary = f.read()
+
+        fleet = []
+        for i in range(options['judges']):
+            name = 'benchbridge%d' % i
+            key = secrets.token_hex(32)
+            Judge.objects.update_or_create(name=name, defaults={'auth_key': key, 'is_blocked': False})
+            fleet.append(SimulatedJudge(
+                address, name, key, [problem.code for problem in problems], {language.key: [['bench', [1, 0]]]},
+                cases=options['cases'], cases_per_packet=options['cases_per_packet'], case_delay=options['case_delay'],
+                batch_size=options['batch_size'], codecs=options['codecs'], dictionary=dictionary,
+                codec_threshold=settings.BRIDGED_CODEC_THRESHOLD,
+            ))
+
+        # Judges are brought up one at a time, since the bridge marks a judge online only after registering it, and
+        # the connection storms of many judges at once are not what is being measured.
+        for judge in fleet:
+            judge.start()
+            deadline = time.monotonic() + 30
+            while not Judge.objects.filter(name=judge.name, online=True).exists():
+                if time.monotonic() > deadline:
+                    raise CommandError('simulated judge failed to come online: %s' % judge.name)
+                time.sleep(0.05)
+        return fleet
+
+    def run(self, options, submissions, fleet):
+        ids = [submission.id for submission in submissions]
+        pending = set(ids)
+        sent = {}
+        request_times = []
+        done = {}
+        stop = threading.Event()
+
+        def poll():
+            while pending and not stop.is_set():
+                now = time.monotonic()
+                for id in Submission.objects.filter(id__in=list(pending)).exclude(status__in=('QU', 'P', 'G')) \
+                                            .values_list('id', flat=True):
+                    done[id] = now
+                    pending.discard(id)
+                time.sleep(0.02)
+            db.connection.close()
+
+        def submit(submission):
+            try:
+                start = sent[submission.id] = time.monotonic()
+                judge_submission(submission, rejudge=False)
+                request_times.append(time.monotonic() - start)
+            finally:
+                db.connection.close()
+
+        start = time.monotonic()
+        poller = threading.Thread(target=poll, daemon=True)
+        poller.start()
+
+        if options['bulk']:
+            for id in ids:
+                sent[id] = start
+            judge_submissions(Submission.objects.filter(id__in=ids), DEFAULT_PRIORITY, rejudge=False)
+            request_times.append(time.monotonic() - start)
+        else:
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                list(executor.map(submit, submissions))
+        submitted = time.monotonic()
+
+        poller.join(options['timeout'])
+        stop.set()
+        finished = time.monotonic()
+        elapsed = finished - start
+
+        received = {}
+        for judge in fleet:
+            received.update(judge.received)
+        dispatch = [received[id] - sent[id] for id in received if id in sent]
+        latency = [done[id] - sent[id] for id in done]
+        statuses = {}
+        for status, result in Submission.objects.filter(id__in=ids).values_list('status', 'result'):
+            key = result or status
+            statuses[key] = statuses.get(key, 0) + 1
+        test_cases = SubmissionTestCase.objects.filter(submission_id__in=ids).count()
+
+        write = self.stdout.write
+        write('')
+        write('Judges: %d, submissions: %d, test cases each: %d (%d per packet), mode: %s' % (
+            len(fleet), len(ids), options['cases'], options['cases_per_packet'],
+            'bulk' if options['bulk'] else '%d submitting threads' % options['concurrency']))
+        write('Finished: %d, unfinished: %d, results: %s' % (
+            len(done), len(pending), ', '.join('%s=%d' % item for item in sorted(statuses.items()) if item[1])))
+        write('')
+        write('Submit time:         %8.3fs (%.1f submissions/s)' % (submitted - start, len(ids) / (submitted - start)))
+        write('Total time:          %8.3fs' % elapsed)
+        write('Dispatch throughput: %8.1f submissions/s' % (len(received) / elapsed))
+        write('Grading throughput:  %8.1f submissions/s' % (len(done) / elapsed))
+        write('DB write rate:       %8.1f test cases/s, %.1f finished submissions/s' % (
+            test_cases / elapsed, len(done) / elapsed))
+        codecs = sorted({judge.codec.name if judge.codec else 'zlib (legacy)' for judge in fleet})
+        write('Codec:               %s' % ', '.join(codecs))
+        write('Judge traffic:       %8d packets, %d bytes' % (
+            sum(judge.packets_sent for judge in fleet), sum(judge.bytes_sent for judge in fleet)))
+        write('')
+        write('%-22s %9s %9s %9s %9s %9s' % ('Latency (ms)', 'p50', 'p90', 'p99', 'max', 'mean'))
+        for name, values in (('judgeapi request', request_times), ('submit to dispatch', dispatch),
+                             ('submit to finished', latency)):
+            write('%-22s %9.2f %9.2f %9.2f %9.2f %9.2f' % (
+                name, percentile(values, 0.5) * 1000, percentile(values, 0.9) * 1000,
+                percentile(values, 0.99) * 1000, max(values, default=float('nan')) * 1000,
+                sum(values) / len(values) * 1000 if values else float('nan'),
+            ))
@@ -0,0 +1,195 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from judge.contest_format import formats
+from judge.models import Contest, ContestParticipation, ContestProblem, ContestSubmission, Language, Problem, \
+    Profile, Submission
+
+# Configurations that are checked besides the default one of each format, as (format config, freeze submissions).
+CONFIGS = {
+    'atcoder': [({'penalty': 0}, False)],
+    'ecoo': [({'cumtime': True, 'first_ac_bonus': 0, 'time_bonus': 0}, False), (None, True)],
+    'icpc': [({'penalty': 0}, False)],
+    'ioi': [({'cumtime': True}, False)],
+}
+RESULTS = ('AC', 'WA', 'TLE', 'RTE', 'CE', 'IE', 'AB')
+PROBLEMS = 3
+
+
+class Rollback(Exception):
+    pass
+
+
+def same_results(a, b, tolerance=1e-6):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_results(a[key], b[key], tolerance) for key in a)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+    return a == b
+
+
+def results(participation):
+    # Which submissions are recorded as counted depends on the order they were added in.
+    format_data = {key: {field: value for field, value in data.items() if field != 'last_submission'}
+                   for key, data in (participation.format_data or {}).items()}
+    return {'score': participation.score, 'cumtime': participation.cumtime,
+            'tiebreaker': participation.tiebreaker, 'format_data': format_data}
+
+
+class Command(BaseCommand):
+    help = ('check, on generated submissions, that adding the results of contest submissions one at a time, and '
+            'recomputing all of the results of a contest at once, agree with recomputing the results of each '
+            'participation; nothing is saved')
+
+    def add_arguments(self, parser):
+        parser.add_argument('formats', nargs='*', metavar='format', help='contest formats to check, defaults to all')
+        parser.add_argument('--runs', type=int, default=100, help='participations to generate for each configuration')
+        parser.add_argument('--size', type=int, default=12, help='most submissions of a generated participation')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the generated submissions')
+
+    def handle(self, *args, **options):
+        names = options['formats'] or sorted(formats)
+        unknown = set(names) - set(formats)
+        if unknown:
+            raise CommandError('no such contest formats: %s' % ', '.join(sorted(unknown)))
+
+        rng = random.Random(options['seed'])
+        failed = False
+        try:
+            with transaction.atomic():
+                language = Language.get_default_language()
+                problems = [Problem.objects.create(code='checkcontestformat%d' % i, name='Check Contest Format %d' % i,
+                                                   description='', time_limit=1, memory_limit=65536, points=1)
+                            for i in range(PROBLEMS)]
+
+                cases = [(name, config, freeze) for name in names
+                         for config, freeze in [(None, False)] + CONFIGS.get(name, [])]
+                for index, (name, config, freeze) in enumerate(cases):
+                    contest = self.make_contest(index, name, config, freeze, problems)
+                    mismatches = 0
+                    for run in range(options['runs']):
+                        mismatches += self.check_run(rng, contest, language, options['size'], run)
+                    bulk_mismatches = self.check_bulk(contest)
+                    self.stdout.write('%s %r%s: %d participations, %d mismatches, %d bulk mismatches' % (
+                        name, config, ' frozen' if freeze else '', options['runs'], mismatches, bulk_mismatches))
+                    failed |= bool(mismatches or bulk_mismatches)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if failed:
+            raise CommandError('incremental or bulk results disagree with update_participation')
+
+    def make_contest(self, index, name, config, freeze, problems):
+        start = timezone.now() - timedelta(days=1)
+        contest = Contest.objects.create(key='checkcontestformat%d' % index, name='Check Contest Format',
+                                         start_time=start, end_time=start + timedelta(hours=5), format_name=name,
+                                         format_config=config, freeze_submissions=freeze,
+                                         freeze_after=start + timedelta(hours=3))
+        for order, problem in enumerate(problems):
+            ContestProblem.objects.create(contest=contest, problem=problem, points=10 * (order + 1),
+                                          partial=order % 2 == 0, order=order)
+        return contest
+
+    def check_run(self, rng, contest, language, size, run):
+        """
+        Generates submissions for a new participation, which are judged, and added to its results, in a random
+        order, with recomputes of the results interleaved, as rejudges or concurrent graders could do.
+
+        Returns how many times the results disagreed with update_participation, whenever all of the submissions made
+        so far were added.
+        """
+        user = User.objects.create(username='checkcontestformat%d_%d' % (contest.id, run), is_active=False)
+        profile = Profile.objects.create(user=user, language=language)
+        participation = ContestParticipation.objects.create(contest=contest, user=profile)
+
+        contest_problems = list(contest.contest_problems.select_related('problem'))
+        # Submissions are made in order of their dates.
+        dates = sorted((contest.start_time + timedelta(minutes=minutes)
+                        for minutes in rng.sample(range(300), rng.randint(1, size))), reverse=True)
+        queued = []
+        finished = []
+        mismatches = 0
+        while dates or queued or finished:
+            actions = [('submit', 2 if dates else 0), ('finish', 2 if queued else 0), ('add', 2 if finished else 0),
+                       ('recompute', 1 if queued or finished else 0)]
+            action = rng.choices([action for action, _ in actions], [weight for _, weight in actions])[0]
+            if action == 'submit':
+                contest_problem = rng.choice(contest_problems)
+                submission = Submission.objects.create(user=profile, problem=contest_problem.problem,
+                                                       language=language)
+                Submission.objects.filter(id=submission.id).update(date=dates.pop())
+                queued.append(ContestSubmission.objects.create(submission=submission, problem=contest_problem,
+                                                               participation=participation, points=0).id)
+            elif action == 'finish':
+                contest_submission = queued.pop(rng.randrange(len(queued)))
+                self.finish(rng, contest_submission)
+                finished.append(contest_submission)
+            elif action == 'add':
+                contest_submission = finished.pop(rng.randrange(len(finished)))
+                ContestParticipation.objects.get(id=participation.id).apply_submission(
+                    ContestSubmission.objects.select_related('submission', 'problem__problem')
+                                             .get(id=contest_submission))
+            else:
+                # Judged submissions are saved before they are added to the results, and a rejudge, or a grader
+                # that can't add a result, may recompute the results in between.
+                ContestParticipation.objects.get(id=participation.id).recompute_results()
+
+            if not queued and not finished:
+                mismatches += self.compare(participation.id)
+        return mismatches
+
+    def finish(self, rng, contest_submission_id):
+        contest_submission = ContestSubmission.objects.select_related('problem').get(id=contest_submission_id)
+        contest_problem = contest_submission.problem
+        result = rng.choice(RESULTS)
+        if result == 'AC':
+            points = contest_problem.points
+        elif result in ('WA', 'TLE', 'RTE') and contest_problem.partial:
+            points = rng.choice((0, contest_problem.points / 4, contest_problem.points / 2))
+        else:
+            points = 0
+        Submission.objects.filter(id=contest_submission.submission_id).update(
+            status='D' if result not in ('CE', 'IE', 'AB') else result, result=result, points=points,
+        )
+        ContestSubmission.objects.filter(id=contest_submission_id).update(points=points)
+
+    def compare(self, participation_id):
+        got = results(ContestParticipation.objects.get(id=participation_id))
+        try:
+            with transaction.atomic():
+                ContestParticipation.objects.get(id=participation_id).recompute_results()
+                expected = results(ContestParticipation.objects.get(id=participation_id))
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if same_results(got, expected):
+            return 0
+        self.stderr.write('Participation %d:\n  incremental: %r\n  recomputed:  %r' % (participation_id, got, expected))
+        return 1
+
+    def check_bulk(self, contest):
+        """Recomputes the results of a contest with update_participations and with update_participation, in a
+        transaction that is rolled back, and returns how many participations they disagree on."""
+        mismatches = 0
+        try:
+            with transaction.atomic():
+                contest.format.update_participations(contest.users.all())
+                bulk = {participation.id: results(participation) for participation in contest.users.all()}
+                for participation in contest.users.all():
+                    participation.recompute_results()
+                for participation in contest.users.all():
+                    if not same_results(bulk[participation.id], results(participation)):
+                        mismatches += 1
+                        self.stderr.write('Participation %d:\n  bulk:        %r\n  recomputed:  %r' % (
+                            participation.id, bulk[participation.id], results(participation)))
+                raise Rollback()
+        except Rollback:
+            pass
+        return mismatches
@@ -0,0 +1,63 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.bridge.packet_codecs import dictionary_id, zstandard
+from judge.models import Submission, SubmissionTestCase
+
+STATUS_BITS = {'AC': 0, 'WA': 1, 'RTE': 2, 'TLE': 4, 'MLE': 8, 'IR': 16, 'SC': 32, 'OLE': 64}
+
+
+def encode(packet):
+    return json.dumps(packet, separators=(',', ':')).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = 'train a compression dictionary for bridge packets on recent submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file to write the dictionary to')
+        parser.add_argument('--submissions', type=int, default=2000, help='number of recent submissions to sample')
+        parser.add_argument('--size', type=int, default=16 * 1024, help='size of the dictionary in bytes')
+
+    def handle(self, *args, **options):
+        if zstandard is None:
+            raise CommandError('training a dictionary requires the zstandard package')
+
+        samples = []
+        now = time.time()
+        submissions = (Submission.objects.order_by('-id').select_related('problem', 'language', 'source')
+                       .only('id', 'problem__code', 'problem__time_limit', 'problem__memory_limit', 'language__key',
+                             'source__source', 'user_id')[:options['submissions']])
+        for submission in submissions:
+            id = submission.id
+            samples.append(encode({
+                'name': 'submission-request', 'submission-id': id, 'problem-id': submission.problem.code,
+                'language': submission.language.key, 'source': submission.source.source,
+                'time-limit': submission.problem.time_limit, 'memory-limit': submission.problem.memory_limit,
+                'short-circuit': False, 'meta': {'pretests-only': False, 'in-contest': None, 'attempt-no': 1,
+                                                 'user': submission.user_id},
+            }))
+            samples.append(encode({'name': 'submission-acknowledged', 'submission-id': id}))
+            samples.append(encode({'name': 'grading-begin', 'submission-id': id, 'pretested': False}))
+            samples.append(encode({'name': 'grading-end', 'submission-id': id}))
+            samples.append(encode({'name': 'ping', 'when': now}))
+            samples.append(encode({'name': 'ping-response', 'when': now, 'time': now, 'load': 0.5}))
+
+        cases = SubmissionTestCase.objects.filter(submission_id__in=[submission.id for submission in submissions])
+        for case in cases.iterator():
+            samples.append(encode({'name': 'test-case-status', 'submission-id': case.submission_id, 'cases': [{
+                'position': case.case, 'status': STATUS_BITS.get(case.status, 0), 'time': case.time,
+                'memory': case.memory, 'points': case.points, 'total-points': case.total, 'output': case.output,
+                'feedback': case.feedback, 'extended-feedback': case.extended_feedback,
+            }]}))
+
+        if len(samples) < 100:
+            raise CommandError('not enough submissions to train on: %d packets' % len(samples))
+
+        dictionary = zstandard.train_dictionary(options['size'], samples).as_bytes()
+        with open(options['output'], 'wb') as f:
+            f.write(dictionary)
+        self.stdout.write('Trained a %d byte dictionary on %d packets, id: %s' % (
+            len(dictionary), len(samples), dictionary_id(dictionary)))
@@ -1,8 +1,32 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
 from judge.bridge.daemon import judge_daemon
 
 
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
 class Command(BaseCommand):
+    help = 'run the bridge between the site and the judges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--judge-address', type=parse_address, action='append',
+                            help='host:port to accept judges on, instead of BRIDGED_JUDGE_ADDRESS; may be repeated')
+        parser.add_argument('--django-address', type=parse_address, action='append',
+                            help='host:port to accept the site on, instead of BRIDGED_DJANGO_ADDRESS; may be repeated')
+        parser.add_argument('--metrics-address', type=parse_address,
+                            help='host:port to serve metrics on, instead of BRIDGED_METRICS_ADDRESS')
+        parser.add_argument('--journal', help='queue journal path, instead of BRIDGED_JOURNAL_PATH')
+        parser.add_argument('--shard', type=int,
+                            help='index of this bridge in BRIDGED_DJANGO_SHARDS, when running several bridges')
+
     def handle(self, *args, **options):
-        judge_daemon()
+        shard = options['shard']
+        if shard is not None and not 0 <= shard < len(settings.BRIDGED_DJANGO_SHARDS or ()):
+            raise CommandError('--shard must be an index into BRIDGED_DJANGO_SHARDS')
+
+        judge_daemon(judge_addresses=options['judge_address'], django_addresses=options['django_address'],
+                     metrics_address=options['metrics_address'], journal_path=options['journal'], shard=shard)
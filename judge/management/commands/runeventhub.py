@@ -0,0 +1,35 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.event_hub import EventHubServer
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+class Command(BaseCommand):
+    help = 'run the built-in event hub, in place of websocket/daemon.js'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', help='Unix socket to take posts on, instead of EVENT_DAEMON_HUB_SOCKET')
+        parser.add_argument('--address', type=parse_address,
+                            help='host:port to serve subscribers on, instead of EVENT_DAEMON_HUB_ADDRESS')
+
+    def handle(self, *args, **options):
+        post_socket = options['socket'] or settings.EVENT_DAEMON_HUB_SOCKET
+        if not post_socket:
+            raise CommandError('no socket to take posts on, set EVENT_DAEMON_HUB_SOCKET or pass --socket')
+
+        server = EventHubServer(post_socket, options['address'] or settings.EVENT_DAEMON_HUB_ADDRESS,
+                                settings.EVENT_DAEMON_HUB_MAX_QUEUE, settings.EVENT_DAEMON_HUB_POLL_TIMEOUT)
+
+        def signal_handler(signum, _):
+            server.shutdown()
+
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        server.serve_forever()
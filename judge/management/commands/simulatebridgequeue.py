@@ -0,0 +1,229 @@
+import heapq
+import logging
+import math
+import random
+from itertools import count
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.bridge.grading_cost import GradingCostModel
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.queue_policy import POLICIES, make_policy
+from judge.bridge.submission_data import SubmissionData
+from judge.judgeapi import CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY
+from judge.management.commands.benchbridge import percentile
+from judge.models import Submission
+
+
+class Clock(object):
+    """Simulated time, advanced from one event to the next."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._sequence = count()
+
+    def call_at(self, when, func, *args):
+        heapq.heappush(self._events, (when, next(self._sequence), func, args))
+
+    def run(self):
+        while self._events:
+            self.now, _, func, args = heapq.heappop(self._events)
+            func(*args)
+
+
+class VirtualJudge(object):
+    """Stands in for a JudgeHandler: takes one submission at a time, and grades it in simulated time.
+
+    A judge with a slowdown of 2 takes twice as long as the cost of the submission.
+    """
+
+    def __init__(self, name, problems, judges, clock, costs, on_event, slowdown=1.0):
+        self.name = name
+        self.problems = set(problems)
+        self.load = 0
+        self.judges = judges
+        self.clock = clock
+        self.costs = costs
+        self.on_event = on_event
+        self.slowdown = slowdown
+        self.current = None
+
+    @property
+    def working(self):
+        return self.current is not None
+
+    def can_judge(self, problem, language):
+        return problem in self.problems
+
+    def get_current_submission(self):
+        return self.current
+
+    def submit(self, id, problem, language, source, data):
+        self.current = id
+        self.on_event(id, 'dispatched', self.clock.now)
+        elapsed = self.costs[id] * self.slowdown
+        self.clock.call_at(self.clock.now + elapsed, self.finish, id, problem, language, elapsed)
+
+    def finish(self, id, problem, language, elapsed):
+        self.on_event(id, 'finished', self.clock.now)
+        self.current = None
+        self.judges.record_cost(self, problem, language, elapsed)
+        self.judges.on_judge_free(self, id)
+
+    def abort(self):
+        pass
+
+    def disconnect(self, force=False):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'simulate the bridge queue under a skewed or recorded load, to compare queue policies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--judges', type=int, default=8, help='number of simulated judges')
+        parser.add_argument('--slow-judges', type=int, default=0, help='how many of the judges are slower')
+        parser.add_argument('--slowdown', type=float, default=2.0, help='how much slower the slow judges are')
+        parser.add_argument('-p', '--problems', type=int, default=20, help='number of problems')
+        parser.add_argument('--duration', type=float, default=3600, help='simulated seconds of submissions')
+        parser.add_argument('--grading-time', type=float, default=2.0,
+                            help='geometric mean of the seconds it takes to grade a submission to each problem')
+        parser.add_argument('--cost-spread', type=float, default=1.0,
+                            help='ratio between the grading times of the most and least expensive problems')
+        parser.add_argument('--light-users', type=int, default=50, help='number of users submitting occasionally')
+        parser.add_argument('--light-rate', type=float, default=1.0,
+                            help='submissions per minute of each light user')
+        parser.add_argument('--heavy-users', type=int, default=1, help='number of users submitting a lot')
+        parser.add_argument('--heavy-rate', type=float, default=180.0,
+                            help='submissions per minute of each heavy user')
+        parser.add_argument('--contests', type=int, default=0,
+                            help='if set, every submission is in a contest: the heavy users share one hot contest, '
+                                 'and the light users are spread over this many others')
+        parser.add_argument('--replay', type=int, default=0, metavar='N',
+                            help='instead of a synthetic load, replay the last N graded submissions in the database, '
+                                 'using their total test case time as their grading time')
+        parser.add_argument('--replay-speed', type=float, default=1.0,
+                            help='how many times faster than they were made to replay the submissions')
+        parser.add_argument('--policy', action='append', dest='policies', choices=POLICIES,
+                            help='queue policy to simulate; may be repeated, defaults to all of them')
+        parser.add_argument('--aging', type=float, default=10.0, help='aging of the sjf policy')
+        parser.add_argument('--heavy-factor', type=float, default=None,
+                            help='send submissions this many times costlier than usual to the fastest judge')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the random workload')
+
+    def handle(self, *args, **options):
+        # The judge list logs every dispatch.
+        logging.getLogger('judge.bridge').setLevel(logging.WARNING)
+
+        if options['replay']:
+            workload = self.replay_workload(options)
+            self.stdout.write('Replaying %d submissions over %ds to %d judges' % (
+                len(workload), workload[-1][1], options['judges']))
+        else:
+            workload = self.make_workload(options)
+            self.stdout.write('%d submissions over %ds to %d judges, %d light and %d heavy users%s' % (
+                len(workload), options['duration'], options['judges'], options['light_users'],
+                options['heavy_users'], ' in %d contests' % (options['contests'] + 1) if options['contests'] else ''))
+        kinds = sorted({arrival[4] for arrival in workload}, reverse=True)
+
+        write = self.stdout.write
+        write('')
+        write('%-6s %-6s %7s %9s %9s %9s %9s %9s %9s' % (
+            'Policy', 'Users', 'Count', 'Wait', 'p50', 'p90', 'p99', 'max', 'mean'))
+        for name in options['policies'] or POLICIES:
+            waits, latencies = self.simulate(name, workload, options)
+            for kind in kinds:
+                ids = [arrival[0] for arrival in workload if arrival[4] == kind and arrival[0] in latencies]
+                wait = [waits[id] for id in ids]
+                latency = [latencies[id] for id in ids]
+                write('%-6s %-6s %7d %9.2f %9.2f %9.2f %9.2f %9.2f %9.2f' % (
+                    name, kind, len(latency), sum(wait) / len(wait) if wait else float('nan'),
+                    percentile(latency, 0.5), percentile(latency, 0.9), percentile(latency, 0.99),
+                    max(latency, default=float('nan')), sum(latency) / len(latency) if latency else float('nan')))
+        write('')
+        write('Wait is the mean seconds spent queued, the rest are seconds from submitting to finished grading.')
+
+    def make_workload(self, options):
+        """Returns (id, time, problem, language, kind, data, cost) for every submission, in the order they are made."""
+        rng = random.Random(options['seed'])
+        spread = math.log(options['cost_spread']) / 2
+        problems = [('problem%d' % i, options['grading_time'] * math.exp(rng.uniform(-spread, spread)))
+                    for i in range(options['problems'])]
+
+        arrivals = []
+        user_id = 0
+        for kind, number, rate in (('light', options['light_users'], options['light_rate']),
+                                   ('heavy', options['heavy_users'], options['heavy_rate'])):
+            for _ in range(number):
+                user_id += 1
+                if not options['contests']:
+                    contest_id = None
+                elif kind == 'heavy':
+                    contest_id = 0
+                else:
+                    contest_id = 1 + user_id % options['contests']
+                when = rng.expovariate(rate / 60) if rate else options['duration']
+                while when < options['duration']:
+                    arrivals.append((when, kind, user_id, contest_id))
+                    when += rng.expovariate(rate / 60)
+        arrivals.sort()
+
+        workload = []
+        for id, (when, kind, user_id, contest_id) in enumerate(arrivals):
+            problem, cost = rng.choice(problems)
+            data = SubmissionData(time=1, memory=65536, short_circuit=False, pretests_only=False,
+                                  contest_no=None if contest_id is None else 0, attempt_no=1, user_id=user_id,
+                                  contest_id=contest_id)
+            workload.append((id, when, problem, 'PY3', kind, data, cost * rng.lognormvariate(0, 0.25)))
+        return workload
+
+    def replay_workload(self, options):
+        submissions = list(Submission.objects.filter(status='D', time__isnull=False).order_by('-id')
+                           .values_list('id', 'date', 'problem__code', 'language__key', 'user_id',
+                                        'contest__participation__contest_id', 'time')[:options['replay']])
+        if not submissions:
+            raise CommandError('no graded submissions to replay')
+        submissions.reverse()
+
+        start = submissions[0][1]
+        workload = []
+        for id, date, problem, language, user_id, contest_id, cost in submissions:
+            data = SubmissionData(time=1, memory=65536, short_circuit=False, pretests_only=False,
+                                  contest_no=None if contest_id is None else 0, attempt_no=1, user_id=user_id,
+                                  contest_id=contest_id)
+            # Judges take some time to compile and set up, even for submissions that ran in no time at all.
+            workload.append((id, (date - start).total_seconds() / options['replay_speed'], problem, language, 'all',
+                             data, max(cost, 0.1)))
+        return workload
+
+    def simulate(self, name, workload, options):
+        clock = Clock()
+        costs = GradingCostModel()
+        judges = JudgeList(policy=make_policy(name, costs, options['aging'], clock=lambda: clock.now), costs=costs,
+                           heavy_factor=options['heavy_factor'])
+        submission_costs = {arrival[0]: arrival[6] for arrival in workload}
+        submitted = {}
+        waits = {}
+        latencies = {}
+
+        def on_event(id, event, now):
+            if event == 'dispatched':
+                waits[id] = now - submitted[id]
+            else:
+                latencies[id] = now - submitted[id]
+
+        problems = {arrival[2] for arrival in workload}
+        for i in range(options['judges']):
+            judges.register(VirtualJudge('judge%d' % i, problems, judges, clock, submission_costs, on_event,
+                                         options['slowdown'] if i < options['slow_judges'] else 1.0))
+
+        def submit(id, problem, language, data):
+            submitted[id] = clock.now
+            priority = DEFAULT_PRIORITY if data.contest_id is None else CONTEST_SUBMISSION_PRIORITY
+            judges.judge(id, problem, language, '', priority, data)
+
+        for id, when, problem, language, _, data, _ in workload:
+            clock.call_at(when, submit, id, problem, language, data)
+        clock.run()
+        return waits, latencies
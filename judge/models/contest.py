@@ -324,6 +324,19 @@ class ContestParticipation(models.Model):
                 self.save(update_fields=['score'])
     recompute_results.alters_data = True
 
+    def apply_submission(self, contest_submission):
+        with transaction.atomic():
+            # Judges can finish several submissions of a participation at once, so the results we add to must be
+            # read under a lock.
+            list(ContestParticipation.objects.select_for_update().filter(id=self.id).values_list('id'))
+            self.refresh_from_db(fields=['score', 'cumtime', 'tiebreaker', 'format_data'])
+            # The submission is saved before the lock is taken, so a recompute in between may already count it.
+            format = self.contest.format
+            if self.is_disqualified or format.is_counted(self, contest_submission) or \
+                    not format.apply_submission(self, contest_submission):
+                self.recompute_results()
+    apply_submission.alters_data = True
+
     def set_disqualified(self, disqualified):
         self.is_disqualified = disqualified
         self.recompute_results()
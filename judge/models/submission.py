@@ -123,7 +123,7 @@ class Submission(models.Model):
 
     abort.alters_data = True
 
-    def update_contest(self):
+    def update_contest(self, judged=False):
         try:
             contest = self.contest
         except AttributeError:
@@ -138,7 +138,12 @@ class Submission(models.Model):
             contest.points = 0
 
         contest.save()
-        participation.recompute_results()
+        # Only the first judging of a submission can be added to the results: before a rejudge, or when the score
+        # is recalculated, the previous result may already be part of them.
+        if judged and not self.was_rejudged:
+            participation.apply_submission(contest)
+        else:
+            participation.recompute_results()
 
     update_contest.alters_data = True
 
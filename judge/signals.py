@@ -7,10 +7,13 @@ from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .caching import finished_submission
-from .models import BlogPost, Contest, ContestSubmission, EFFECTIVE_MATH_ENGINES, Judge, Language, \
-    MiscConfig, NavigationBar, Organization, Problem, Profile, Submission
+from .caching import finished_submission, invalidate_contest_ranking
+from .judgeapi import invalidate_language_limits_on_commit
+from .models import BlogPost, Contest, ContestParticipation, ContestProblem, ContestSubmission, \
+    EFFECTIVE_MATH_ENGINES, Judge, Language, LanguageLimit, MiscConfig, NavigationBar, Organization, Problem, \
+    Profile, Submission
 
 
 def get_pdf_path(basename):
@@ -43,14 +46,29 @@ def problem_update(sender, instance, **kwargs):
     for lang, _ in settings.LANGUAGES:
         unlink_if_exists(get_pdf_path('%s.%s.pdf' % (instance.code, lang)))
 
+    invalidate_language_limits_on_commit(instance.id)
+
+
+@receiver(post_save, sender=LanguageLimit)
+@receiver(post_delete, sender=LanguageLimit)
+def language_limit_update(sender, instance, **kwargs):
+    invalidate_language_limits_on_commit(instance.problem_id)
+
 
 @receiver(post_save, sender=Profile)
-def profile_update(sender, instance, **kwargs):
+def profile_update(sender, instance, update_fields=None, **kwargs):
     if hasattr(instance, '_updating_stats_only'):
         return
 
     cache.delete_many([make_template_fragment_key('org_member_count', (org_id,))
                        for org_id in instance.organizations.values_list('id', flat=True)])
+    # Contest rankings show the display rank of participants, and leave out unlisted ones. Those of contests that
+    # are over are left to expire, as they are looked at far less.
+    if update_fields is None or {'display_rank', 'is_unlisted'} & set(update_fields):
+        for contest_id in instance.contest_history.filter(virtual=ContestParticipation.LIVE,
+                                                          contest__end_time__gt=timezone.now()) \
+                .values_list('contest_id', flat=True):
+            invalidate_contest_ranking(contest_id)
 
 
 @receiver(post_save, sender=Contest)
@@ -61,6 +79,21 @@ def contest_update(sender, instance, **kwargs):
     cache.delete_many(['generated-meta-contest:%d' % instance.id] +
                       [make_template_fragment_key('contest_html', (instance.id, engine))
                        for engine in EFFECTIVE_MATH_ENGINES])
+    invalidate_contest_ranking(instance.id)
+
+
+@receiver(post_save, sender=ContestProblem)
+@receiver(post_delete, sender=ContestProblem)
+def contest_problem_update(sender, instance, **kwargs):
+    invalidate_contest_ranking(instance.contest_id)
+
+
+@receiver(post_save, sender=ContestParticipation)
+@receiver(post_delete, sender=ContestParticipation)
+def contest_participation_update(sender, instance, **kwargs):
+    # Only live participations are on the cached ranking.
+    if instance.live:
+        invalidate_contest_ranking(instance.contest_id)
 
 
 @receiver(post_save, sender=Language)
@@ -1,29 +1,49 @@
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import gettext as _
 from moss import MOSS
 
 from judge.models import Contest, ContestMoss, ContestParticipation, Submission
-from judge.utils.celery import Progress
+from judge.utils.celery import Progress, SharedProgress, id_ranges
 
-__all__ = ('rescore_contest', 'run_moss')
+__all__ = ('rescore_contest', 'rescore_contest_chunk', 'run_moss', 'sum_results')
+
+# Participations recomputed by each task of a contest rescore, which run in parallel on different workers.
+RESCORE_CHUNK_SIZE = 500
 
 
 @shared_task(bind=True)
 def rescore_contest(self, contest_key):
     contest = Contest.objects.get(key=contest_key)
 
-    participations = contest.users
-    rescored = 0
-    with Progress(self, participations.count(), stage=_('Recalculating contest scores')) as p:
-        for participation in participations.iterator():
-            participation.recompute_results()
-            rescored += 1
-            if rescored % 10 == 0:
-                p.done = rescored
+    ranges = id_ranges(contest.users.all(), RESCORE_CHUNK_SIZE)
+    if len(ranges) <= 1:
+        participations = contest.users.all()
+        with Progress(self, participations.count(), stage=_('Recalculating contest scores')) as p:
+            return contest.format.update_participations(participations, p)
+
+    # The chunks run in parallel, and the chord's callback takes over the id of this task, so that its result is
+    # the number of participations.
+    stage = _('Recalculating contest scores')
+    progress = SharedProgress.start(self, contest.users.count(), stage)
+    return self.replace(chord(
+        [rescore_contest_chunk.s(contest_key, start, end, self.request.id, progress.total, stage)
+         for start, end in ranges],
+        sum_results.s(),
+    ))
+
+
+@shared_task(bind=True)
+def rescore_contest_chunk(self, contest_key, start, end, task_id, total, stage):
+    contest = Contest.objects.get(key=contest_key)
+    participations = contest.users.filter(id__gte=start, id__lte=end)
+    return contest.format.update_participations(participations, SharedProgress(self, task_id, total, stage))
+
 
-    return rescored
+@shared_task
+def sum_results(results):
+    return sum(results)
 
 
 @shared_task(bind=True)
@@ -1,11 +1,17 @@
-from celery import shared_task
+from celery import chord, shared_task
 from django.core.cache import cache
+from django.db import transaction
 from django.utils.translation import gettext as _
 
-from judge.models import Problem, Profile, Submission
-from judge.utils.celery import Progress
+from judge.judgeapi import BATCH_REJUDGE_PRIORITY, judge_submissions
+from judge.models import Contest, ContestParticipation, ContestSubmission, Problem, Profile, Submission
+from judge.utils.celery import Progress, SharedProgress, id_ranges
 
-__all__ = ('apply_submission_filter', 'rejudge_problem_filter', 'rescore_problem')
+__all__ = ('apply_submission_filter', 'rejudge_problem_filter', 'rescore_problem', 'rescore_problem_chunk',
+           'rescore_problem_results')
+
+# Submissions rescored by each task of a problem rescore, which run in parallel on different workers.
+RESCORE_CHUNK_SIZE = 2000
 
 
 def apply_submission_filter(queryset, id_range, languages, results):
@@ -25,33 +31,65 @@ def rejudge_problem_filter(self, problem_id, id_range=None, languages=None, resu
     queryset = Submission.objects.filter(problem_id=problem_id)
     queryset = apply_submission_filter(queryset, id_range, languages, results)
 
-    rejudged = 0
     with Progress(self, queryset.count()) as p:
-        for submission in queryset.iterator():
-            submission.judge(rejudge=True, batch_rejudge=True)
-            rejudged += 1
-            if rejudged % 10 == 0:
-                p.done = rejudged
-    return rejudged
+        return judge_submissions(queryset, BATCH_REJUDGE_PRIORITY, progress=p)
 
 
 @shared_task(bind=True)
 def rescore_problem(self, problem_id):
+    submissions = Submission.objects.filter(problem_id=problem_id)
+    stage = _('Modifying submissions')
+    progress = SharedProgress.start(self, submissions.count(), stage)
+
+    # The chunks run in parallel, and the chord's callback takes over the id of this task, so that its result is
+    # the number of submissions.
+    ranges = id_ranges(submissions, RESCORE_CHUNK_SIZE)
+    if not ranges:
+        return self.replace(rescore_problem_results.s([], problem_id))
+    return self.replace(chord(
+        [rescore_problem_chunk.s(problem_id, start, end, self.request.id, progress.total, stage)
+         for start, end in ranges],
+        rescore_problem_results.s(problem_id),
+    ))
+
+
+@shared_task(bind=True)
+def rescore_problem_chunk(self, problem_id, start, end, task_id, total, stage):
     problem = Problem.objects.get(id=problem_id)
+    submissions = []
+    contest_submissions = []
+    for id, case_points, case_total, contest_id, contest_points, contest_partial in (
+        Submission.objects.filter(problem_id=problem_id, id__gte=start, id__lte=end)
+                          .values_list('id', 'case_points', 'case_total', 'contest__id', 'contest__problem__points',
+                                       'contest__problem__partial').iterator()
+    ):
+        points = round(case_points / case_total * problem.points if case_total else 0, 1)
+        if not problem.partial and points < problem.points:
+            points = 0
+        submissions.append(Submission(id=id, points=points))
+
+        if contest_id is not None:
+            points = round(case_points / case_total * contest_points if case_total > 0 else 0, 3)
+            if not contest_partial and points != contest_points:
+                points = 0
+            contest_submissions.append(ContestSubmission(id=contest_id, points=points))
+
+    with transaction.atomic():
+        Submission.objects.bulk_update(submissions, ['points'])
+        ContestSubmission.objects.bulk_update(contest_submissions, ['points'])
+    SharedProgress(self, task_id, total, stage).did(len(submissions))
+    return len(submissions)
+
+
+@shared_task(bind=True)
+def rescore_problem_results(self, rescored, problem_id):
     submissions = Submission.objects.filter(problem_id=problem_id)
 
-    with Progress(self, submissions.count(), stage=_('Modifying submissions')) as p:
-        rescored = 0
-        for submission in submissions.iterator():
-            submission.points = round(submission.case_points / submission.case_total * problem.points
-                                      if submission.case_total else 0, 1)
-            if not problem.partial and submission.points < problem.points:
-                submission.points = 0
-            submission.save(update_fields=['points'])
-            submission.update_contest()
-            rescored += 1
-            if rescored % 10 == 0:
-                p.done = rescored
+    # Every participation with a submission to the problem is recomputed once, after all of the chunks are done.
+    participations = ContestParticipation.objects.filter(submission__submission__problem_id=problem_id).distinct()
+    with Progress(self, participations.count(), stage=_('Recalculating contest scores')) as p:
+        for contest in Contest.objects.filter(id__in=participations.values('contest_id')):
+            contest.format.update_participations(participations.filter(contest=contest), p)
 
     with Progress(self, submissions.values('user_id').distinct().count(), stage=_('Recalculating user points')) as p:
         users = 0
@@ -62,4 +100,4 @@ def rescore_problem(self, problem_id):
             users += 1
             if users % 10 == 0:
                 p.done = users
-    return rescored
+    return sum(rescored)
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.http import urlencode
@@ -51,6 +52,62 @@ class Progress:
             self.done = self._total
 
 
+class SharedProgress(Progress):
+    """Progress of one chunk of a task that was replaced by a chord of chunks, reported as the combined progress of
+    all of the chunks on the replaced task, which is the one the task status page follows.
+
+    The chunks add to a counter in the cache, which start() creates before the chord is sent. Only did() can be used.
+    """
+
+    def __init__(self, task, task_id, total, stage=None):
+        super().__init__(task, total, stage)
+        self.task_id = task_id
+
+    @staticmethod
+    def _key(task_id):
+        return 'task_progress:%s' % task_id
+
+    @classmethod
+    def start(cls, task, total, stage=None):
+        cache.set(cls._key(task.request.id), 0, 86400)
+        progress = cls(task, task.request.id, total, stage)
+        progress._update_state()
+        return progress
+
+    def _update_state(self):
+        self.task.update_state(
+            task_id=self.task_id,
+            state='PROGRESS',
+            meta={
+                'done': self._done,
+                'total': self._total,
+                'stage': self._stage,
+            },
+        )
+
+    def did(self, delta):
+        try:
+            self._done = cache.incr(self._key(self.task_id), delta)
+        except ValueError:
+            # The counter expired, so we can only tell how much this chunk did.
+            self._done += delta
+        self._update_state()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def id_ranges(queryset, size):
+    """Splits the rows of queryset into [first id, last id] ranges of at most size rows each, in order of id."""
+    ranges = []
+    for index, id in enumerate(queryset.order_by('id').values_list('id', flat=True).iterator()):
+        if index % size:
+            ranges[-1][1] = id
+        else:
+            ranges.append([id, id])
+    return ranges
+
+
 def task_status_url(result, message=None, redirect=None):
     args = {}
     if message:
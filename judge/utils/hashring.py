@@ -0,0 +1,28 @@
+import hashlib
+from bisect import bisect
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """Consistent hash ring: adding or removing a node only moves the keys of that node.
+
+    Nodes are identified by str(node), so the same nodes give the same mapping in every process, whatever their order.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        self.nodes = list(nodes)
+        points = sorted((_hash('%s#%d' % (node, i)), index)
+                        for index, node in enumerate(self.nodes) for i in range(replicas))
+        self._hashes = [hash for hash, _ in points]
+        self._indices = [index for _, index in points]
+
+    def index(self, key):
+        if not self.nodes:
+            raise ValueError('empty hash ring')
+        return self._indices[bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+    def get(self, key):
+        return self.nodes[self.index(key)]
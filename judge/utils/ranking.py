@@ -0,0 +1,95 @@
+from collections import namedtuple
+
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.utils.safestring import mark_safe
+
+from judge.caching import next_contest_ranking_update
+from judge.models import ContestParticipation
+
+__all__ = ['ContestRankingProfile', 'base_contest_ranking_list', 'contest_ranking_queryset', 'contest_ranking_row',
+           'contest_ranking_update', 'make_contest_ranking_profile']
+
+
+ContestRankingProfile = namedtuple(
+    'ContestRankingProfile',
+    'id user css_class username points cumtime tiebreaker participation '
+    'problem_cells result_cell',
+)
+
+
+def make_contest_ranking_profile(contest, participation, contest_problems):
+    def display_user_problem(contest_problem):
+        # When the contest format is changed, `format_data` might be invalid.
+        # This will cause `display_user_problem` to error, so we display '???' instead.
+        try:
+            return contest.format.display_user_problem(participation, contest_problem)
+        except (KeyError, TypeError, ValueError):
+            return mark_safe('<td>???</td>')
+
+    user = participation.user
+    return ContestRankingProfile(
+        id=user.id,
+        user=user.user,
+        css_class=user.css_class,
+        username=user.username,
+        points=participation.score,
+        cumtime=participation.cumtime,
+        tiebreaker=participation.tiebreaker,
+        problem_cells=[display_user_problem(contest_problem) for contest_problem in contest_problems],
+        result_cell=contest.format.display_participation_result(participation),
+        participation=participation,
+    )
+
+
+def base_contest_ranking_list(contest, problems, queryset):
+    return [make_contest_ranking_profile(contest, participation, problems) for participation in
+            queryset.select_related('user__user')]
+
+
+def contest_ranking_queryset(contest):
+    return contest.users.filter(virtual=0, user__is_unlisted=False)
+
+
+def contest_ranking_row(rank, profile):
+    return {
+        'participation': profile.participation.id,
+        'user': profile.username,
+        'rank': rank,
+        'points': profile.points,
+        'cumtime': profile.cumtime,
+        'tiebreaker': profile.tiebreaker,
+        'disqualified': profile.participation.is_disqualified,
+        'problems': profile.problem_cells,
+        'result': profile.result_cell,
+    }
+
+
+def contest_ranking_update(participation):
+    """
+    Returns the event to post to the contest's channel after the results of a participation changed, or None if it
+    is not on the ranking.
+
+    If anyone can see the full scoreboard, the event carries the participation's new row, for ranking pages to
+    patch themselves with. Otherwise, it only tells them to fetch the ranking again.
+    """
+    contest = participation.contest
+    if not contest.can_see_full_scoreboard(AnonymousUser()):
+        return {'type': 'update'}
+
+    try:
+        participation = contest_ranking_queryset(contest).select_related('user__user').get(id=participation.id)
+    except ContestParticipation.DoesNotExist:
+        return None
+    participation.contest = contest
+
+    # Rank as the ranker does, by the number of participations with better results.
+    rank = contest_ranking_queryset(contest).filter(
+        Q(score__gt=participation.score) |
+        Q(score=participation.score, cumtime__lt=participation.cumtime) |
+        Q(score=participation.score, cumtime=participation.cumtime, tiebreaker__lt=participation.tiebreaker),
+    ).count() + 1
+    problems = list(contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'))
+    row = contest_ranking_row(rank, make_contest_ranking_profile(contest, participation, problems))
+    row.update({'type': 'row', 'update': next_contest_ranking_update(contest.id)})
+    return row
@@ -1,5 +1,5 @@
 import json
-from collections import defaultdict, namedtuple
+from collections import defaultdict
 from functools import partial
 from itertools import chain
 from operator import attrgetter, itemgetter
@@ -10,7 +10,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Case, Count, FloatField, IntegerField, Sum, Value, When
 from django.db.models.expressions import CombinedExpression
-from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
@@ -21,6 +21,7 @@ from django.views.generic import ListView
 from django.views.generic.detail import BaseDetailView, DetailView, SingleObjectMixin, View
 
 from judge import event_poster as event
+from judge.caching import get_contest_ranking
 from judge.forms import ContestCloneForm
 from judge.models import Contest, ContestMoss, ContestParticipation, ContestProblem, \
     Problem, Submission
@@ -29,13 +30,15 @@ from judge.utils.celery import redirect_to_task_status
 from judge.utils.opengraph import generate_opengraph
 from judge.utils.problems import _get_result_data
 from judge.utils.ranker import ranker
+from judge.utils.ranking import base_contest_ranking_list, contest_ranking_queryset, contest_ranking_row, \
+    make_contest_ranking_profile
 from judge.utils.stats import get_bar_chart, get_pie_chart
 from judge.utils.views import DiggPaginatorMixin, SingleObjectFormView, TitleMixin, generic_message, \
     paginate_query_context
 
 __all__ = ['ContestList', 'ContestDetail', 'ContestRanking', 'ContestJoin', 'ContestLeave',
            'ContestClone', 'ContestStats', 'ContestMossView', 'ContestMossDelete', 'contest_ranking_ajax',
-           'ContestParticipationDisqualify', 'get_contest_ranking_list',
+           'contest_ranking_snapshot_ajax', 'ContestParticipationDisqualify', 'get_contest_ranking_list',
            'base_contest_ranking_list']
 
 
@@ -427,45 +430,17 @@ class ContestStats(TitleMixin, ContestMixin, DetailView):
         return context
 
 
-ContestRankingProfile = namedtuple(
-    'ContestRankingProfile',
-    'id user css_class username points cumtime tiebreaker participation '
-    'problem_cells result_cell',
-)
-
-
-def make_contest_ranking_profile(contest, participation, contest_problems):
-    def display_user_problem(contest_problem):
-        # When the contest format is changed, `format_data` might be invalid.
-        # This will cause `display_user_problem` to error, so we display '???' instead.
-        try:
-            return contest.format.display_user_problem(participation, contest_problem)
-        except (KeyError, TypeError, ValueError):
-            return mark_safe('<td>???</td>')
-
-    user = participation.user
-    return ContestRankingProfile(
-        id=user.id,
-        user=user.user,
-        css_class=user.css_class,
-        username=user.username,
-        points=participation.score,
-        cumtime=participation.cumtime,
-        tiebreaker=participation.tiebreaker,
-        problem_cells=[display_user_problem(contest_problem) for contest_problem in contest_problems],
-        result_cell=contest.format.display_participation_result(participation),
-        participation=participation,
-    )
-
-
-def base_contest_ranking_list(contest, problems, queryset):
-    return [make_contest_ranking_profile(contest, participation, problems) for participation in
-            queryset.select_related('user__user')]
+def contest_ranking_snapshot(contest, problems):
+    # The cached ranking is pickled, so only what is displayed is loaded.
+    queryset = (contest_ranking_queryset(contest)
+                .only('contest', 'user__display_rank', 'user__user__username', 'real_start', 'score', 'cumtime',
+                      'is_disqualified', 'tiebreaker', 'virtual', 'format_data')
+                .order_by('is_disqualified', '-score', 'cumtime', 'tiebreaker'))
+    return get_contest_ranking(contest.id, partial(base_contest_ranking_list, contest, problems, queryset))
 
 
 def contest_ranking_list(contest, problems):
-    return base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0, user__is_unlisted=False)
-                                     .order_by('is_disqualified', '-score', 'cumtime', 'tiebreaker'))
+    return contest_ranking_snapshot(contest, problems)[1]
 
 
 def get_contest_ranking_list(request, contest, participation=None, ranking_list=contest_ranking_list,
@@ -484,6 +459,23 @@ def get_contest_ranking_list(request, contest, participation=None, ranking_list=
     return users, problems
 
 
+def get_contest_ranking_snapshot(request, contest, participation=None, show_current_virtual=True):
+    """
+    Returns the full ranking of a contest as get_contest_ranking_list does, preceded by the number of the last
+    ranking update posted to the contest's event channel that it includes.
+    """
+    updates = []
+
+    def ranking_list(contest, problems):
+        update, ranking = contest_ranking_snapshot(contest, problems)
+        updates.append(update)
+        return ranking
+
+    users, problems = get_contest_ranking_list(request, contest, participation, ranking_list=ranking_list,
+                                               show_current_virtual=show_current_virtual)
+    return updates[0], users, problems
+
+
 def contest_ranking_ajax(request, contest, participation=None):
     contest, exists = _find_contest(request, contest)
     if not exists:
@@ -492,18 +484,38 @@ def contest_ranking_ajax(request, contest, participation=None):
     if not contest.can_see_full_scoreboard(request.user):
         raise Http404()
 
-    users, problems = get_contest_ranking_list(request, contest, participation)
-    return render(request, 'contest/ranking-table.html', {
+    update, users, problems = get_contest_ranking_snapshot(request, contest, participation)
+    response = render(request, 'contest/ranking-table.html', {
         'users': users,
         'problems': problems,
         'can_edit': contest.is_editable_by(request.user),
         'contest': contest,
     })
+    response['X-Ranking-Update'] = update
+    return response
+
+
+def contest_ranking_snapshot_ajax(request, contest):
+    contest, exists = _find_contest(request, contest)
+    if not exists:
+        return HttpResponseBadRequest('Invalid contest', content_type='text/plain')
+
+    if not contest.can_see_full_scoreboard(request.user):
+        raise Http404()
+
+    update, users, problems = get_contest_ranking_snapshot(request, contest, show_current_virtual=False)
+    return JsonResponse({
+        'update': update,
+        'rows': [contest_ranking_row(rank, profile) for rank, profile in users],
+    })
 
 
 class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
     template_name = 'contest/ranking.html'
     tab = None
+    # Number of the last update posted to the contest's event channel that the ranking includes, if it can be patched
+    # with the later ones.
+    ranking_update = None
 
     def get_title(self):
         raise NotImplementedError()
@@ -523,7 +535,9 @@ class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
         users, problems = self.get_ranking_list()
         context['users'] = users
         context['problems'] = problems
-        context['last_msg'] = event.last() if self.request.user.is_staff else None
+        context['ranking_update'] = self.ranking_update
+        context['ranking_debounce'] = settings.DMOJ_CONTEST_RANKING_DEBOUNCE or 0
+        context['last_msg'] = event.last() if self.ranking_update is not None else None
         context['tab'] = self.tab
         return context
 
@@ -543,7 +557,8 @@ class ContestRanking(ContestRankingBase):
                 ranker=lambda users, key: ((_('???'), user) for user in users),
             )
 
-        return get_contest_ranking_list(self.request, self.object)
+        self.ranking_update, users, problems = get_contest_ranking_snapshot(self.request, self.object)
+        return users, problems
 
 
 class ContestParticipationDisqualify(ContestMixin, SingleObjectMixin, View):